@@ -0,0 +1,302 @@
+#!/usr/bin/env python2
+
+""" Fit many pixels at once with a vectorized Levenberg-Marquardt least
+squares fit. Every pixel has its own constant and mean; sigma is either free
+for every pixel or shared by groups of pixels, e.g. all pixels of a chip. """
+
+from math import pi, sqrt
+import numpy as np
+from Logger import LGR
+
+
+def _erf_approx(a_z):
+
+    """ Return error function of every element of a_z, approximated as in
+    Abramowitz and Stegun 7.1.26, with an absolute error below 1.5e-7. """
+
+    a_z = np.asarray(a_z, dtype=float)
+    a_t = 1./(1+0.3275911*np.abs(a_z))
+    poly = a_t*(0.254829592+a_t*(-0.284496736+a_t*(
+        1.421413741+a_t*(-1.453152027+a_t*1.061405429))))
+
+    return np.sign(a_z)*(1-poly*np.exp(-a_z**2))
+
+
+# Element-wise error function; SciPy is only used if it is installed
+try:
+    from scipy.special import erf as _ERF  # pylint: disable=import-error
+except ImportError:
+    _ERF = _erf_approx
+
+
+def _gaus(a_x, params):
+
+    """ Return gaus and its derivatives with respect to constant, mean and
+    sigma, for params of shape (pixels, 3). """
+
+    const, mean, sigma = [params[:, idx, None] for idx in range(3)]
+    pull = (a_x-mean)/sigma
+    gauss = np.exp(-1./2*pull**2)
+    model = const*gauss
+
+    return model, [gauss, model*pull/sigma, model*pull**2/sigma]
+
+
+def _erf(a_x, params):
+
+    """ Return error function (see ToolboxTGraph.ERF_FORMULA) and its
+    derivatives with respect to constant, mean and sigma, for params of shape
+    (pixels, 3). """
+
+    const, mean, sigma = [params[:, idx, None] for idx in range(3)]
+    pull = (a_x-mean)/sigma
+    step = 1./2*(1+_ERF(pull/sqrt(2)))
+    density = const*np.exp(-1./2*pull**2)/(sqrt(2*pi)*sigma)
+
+    return const*step, [step, -density, -density*pull]
+
+
+# Model functions which can be fitted
+MODELS = {'gaus': _gaus, 'erf': _erf}
+
+
+class BatchFitter(object):
+
+    """ Fit many pixels at once with a vectorized Levenberg-Marquardt least
+    squares fit. The normal equations of every group of pixels with a shared
+    sigma are solved by eliminating the per-pixel parameters first (Schur
+    complement), so the cost grows linearly with the number of pixels. """
+
+    def __init__(self, distribution='gaus', max_iterations=100,
+                 tolerance=1e-8):
+
+        """ Initialize object variables. """
+
+        if distribution not in MODELS:
+            raise ValueError('Don\'t know how to fit {0} in batch, use one of '
+                             '{1}.'.format(distribution,
+                                           ', '.join(sorted(MODELS))))
+
+        self.distribution = distribution
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+
+    def fit(self, a_x, a_y, seeds, groups=None):
+
+        """ Fit all rows of a_y over a_x, both of shape (pixels, points),
+        starting from seeds of shape (pixels, 3). groups gives for every pixel
+        the group whose pixels share sigma; if it is None, every pixel has
+        its own sigma.
+
+        Returns parameters, errors (both of shape (pixels, 3)), chi square
+        and NDF of every pixel and whether the fit of the pixel converged.
+        Fits of degenerate curves may converge as well, see
+        is_degenerate(). """
+
+        a_x = np.asarray(a_x, dtype=float)
+        a_y = np.asarray(a_y, dtype=float)
+        params = np.array(seeds, dtype=float)
+        n_pixels, n_points = a_y.shape
+        shared = groups is not None
+        groups, n_groups = self._get_groups(groups, n_pixels)
+
+        # Shared sigma starts at mean of seeds of its group
+        if shared:
+            sigma = np.bincount(groups, params[:, 2]) / \
+                np.bincount(groups).astype(float)
+            params[:, 2] = sigma[groups]
+
+        model = MODELS[self.distribution]
+        chi2 = self._get_chi2(a_y, model(a_x, params)[0], groups, n_groups)
+        damping = np.full(n_groups, 1e-3)
+        converged = np.zeros(n_groups, dtype=bool)
+
+        for iteration in range(self.max_iterations):
+            step = self._get_step(a_x, a_y, params, groups, n_groups,
+                                  damping, model)
+            trial = params+step
+            chi2_trial = self._get_chi2(a_y, model(a_x, trial)[0], groups,
+                                        n_groups)
+
+            # Accept step for groups where chi square decreased
+            better = np.isfinite(chi2_trial) & (chi2_trial <= chi2) & \
+                ~converged
+            change = np.where(better, (chi2-chi2_trial) /
+                              np.maximum(chi2, 1e-300), 0.)
+            params[better[groups]] = trial[better[groups]]
+            chi2 = np.where(better, chi2_trial, chi2)
+            damping = np.where(better, damping/10., damping*10.)
+
+            # A group has converged once its chi square doesn't change any
+            # more, or if no step improves it
+            converged |= (better & (change < self.tolerance)) | \
+                (damping > 1e10)
+            if converged.all():
+                break
+
+        LGR.debug('Batch fit of {0} pixels took {1} iterations.'
+                  .format(n_pixels, iteration+1))
+
+        # Parameters with chi square and NDF of every pixel
+        residuals = a_y-model(a_x, params)[0]
+        chi2_pixel = (residuals**2).sum(axis=1)
+        n_free = 2 if shared else 3
+        ndf = np.full(n_pixels, max(n_points-n_free, 0))
+
+        errors = self._get_errors(a_x, params, groups, n_groups, chi2,
+                                  n_points, shared, model)
+
+        return params, errors, chi2_pixel, ndf, converged[groups]
+
+    def is_degenerate(self, a_y, params):
+
+        """ Return whether the fit of every pixel is degenerate: its curve is
+        flat, e.g. of a dead pixel, or the fitted constant vanishes. Such fits
+        say nothing about mean and sigma, even if they converged. """
+
+        a_y = np.asarray(a_y, dtype=float)
+        params = np.asarray(params, dtype=float)
+
+        return (np.ptp(a_y, axis=1) == 0) | (params[:, 0] == 0)
+
+    def get_edm(self, a_x, a_y, params, groups=None):
+
+        """ Return estimated distance to minimum (EDM) of every pixel, like
+        Minuit's: half the decrease of chi square an undamped Newton step
+        from params would give. With groups, every pixel gets the EDM of its
+        group. """
+
+        a_x = np.asarray(a_x, dtype=float)
+        a_y = np.asarray(a_y, dtype=float)
+        params = np.asarray(params, dtype=float)
+        groups, n_groups = self._get_groups(groups, len(a_y))
+        if not n_groups:
+            return np.empty(0)
+
+        model = MODELS[self.distribution]
+        step = self._get_step(a_x, a_y, params, groups, n_groups,
+                              np.zeros(n_groups), model)
+        _, grad, _, _, grad_s = self._get_normal(a_x, a_y, params, model)
+        edm = np.bincount(groups, (step[:, :2]*grad).sum(axis=1) +
+                          step[:, 2]*grad_s, minlength=n_groups)/2.
+
+        return edm[groups]
+
+    def _get_groups(self, groups, n_pixels):
+
+        """ Return group index of every pixel, counting from 0, and number of
+        groups; without groups, every pixel is its own group. """
+
+        if groups is not None:
+            groups = np.unique(np.asarray(groups), return_inverse=True)[1]
+        else:
+            groups = np.arange(n_pixels)
+        n_groups = groups.max()+1 if n_pixels else 0
+
+        return groups, n_groups
+
+    def _get_chi2(self, a_y, a_model, groups, n_groups):
+
+        """ Return chi square of every group. """
+
+        return np.bincount(groups, ((a_y-a_model)**2).sum(axis=1),
+                           minlength=n_groups)
+
+    def _get_normal(self, a_x, a_y, params, model):
+
+        """ Return blocks of normal equations of every pixel: A (pixels, 2, 2)
+        and gradient g (pixels, 2) for constant and mean, B (pixels, 2) for
+        mixed terms with sigma, d and gradient g_s (pixels) for sigma. """
+
+        a_model, (d_c, d_mu, d_sigma) = model(a_x, params)
+        residuals = a_y-a_model
+
+        block_a = np.empty((len(a_y), 2, 2))
+        block_a[:, 0, 0] = (d_c*d_c).sum(axis=1)
+        block_a[:, 0, 1] = block_a[:, 1, 0] = (d_c*d_mu).sum(axis=1)
+        block_a[:, 1, 1] = (d_mu*d_mu).sum(axis=1)
+        grad = np.stack([(d_c*residuals).sum(axis=1),
+                         (d_mu*residuals).sum(axis=1)], axis=1)
+        block_b = np.stack([(d_c*d_sigma).sum(axis=1),
+                            (d_mu*d_sigma).sum(axis=1)], axis=1)
+        block_d = (d_sigma*d_sigma).sum(axis=1)
+        grad_s = (d_sigma*residuals).sum(axis=1)
+
+        return block_a, grad, block_b, block_d, grad_s
+
+    def _invert(self, block_a):
+
+        """ Return inverse of every 2x2 matrix in block_a. """
+
+        det = block_a[:, 0, 0]*block_a[:, 1, 1] - \
+            block_a[:, 0, 1]*block_a[:, 1, 0]
+        det = np.where(det == 0, 1e-300, det)
+        inverse = np.empty_like(block_a)
+        inverse[:, 0, 0] = block_a[:, 1, 1]/det
+        inverse[:, 1, 1] = block_a[:, 0, 0]/det
+        inverse[:, 0, 1] = -block_a[:, 0, 1]/det
+        inverse[:, 1, 0] = -block_a[:, 1, 0]/det
+
+        return inverse
+
+    def _get_step(self, a_x, a_y, params, groups, n_groups, damping, model):
+
+        """ Return damped Levenberg-Marquardt step for all parameters. """
+
+        block_a, grad, block_b, block_d, grad_s = \
+            self._get_normal(a_x, a_y, params, model)
+
+        # Marquardt damping scales diagonal of normal equations
+        damp = 1+damping[groups]
+        block_a[:, 0, 0] *= damp
+        block_a[:, 1, 1] *= damp
+        block_d_group = np.bincount(groups, block_d, minlength=n_groups) * \
+            (1+damping)
+
+        # Eliminate constant and mean of every pixel, solve for sigma of every
+        # group and substitute back
+        inverse = self._invert(block_a)
+        inv_b = np.einsum('pij,pj->pi', inverse, block_b)
+        inv_g = np.einsum('pij,pj->pi', inverse, grad)
+        schur = block_d_group - np.bincount(
+            groups, (block_b*inv_b).sum(axis=1), minlength=n_groups)
+        rhs = np.bincount(groups, grad_s, minlength=n_groups) - np.bincount(
+            groups, (block_b*inv_g).sum(axis=1), minlength=n_groups)
+        schur = np.where(schur == 0, 1e-300, schur)
+        step_sigma = rhs/schur
+
+        step = np.empty_like(params)
+        step[:, :2] = inv_g-inv_b*step_sigma[groups, None]
+        step[:, 2] = step_sigma[groups]
+
+        return step
+
+    def _get_errors(self, a_x, params, groups, n_groups, chi2, n_points,
+                    shared, model):
+
+        """ Return errors of parameters from undamped normal equations.
+        Since TGraphs carry no errors, they are scaled with chi2/ndf of the
+        group. """
+
+        block_a, _, block_b, block_d, _ = \
+            self._get_normal(a_x, np.zeros((len(params), n_points)), params,
+                             model)
+        inverse = self._invert(block_a)
+        inv_b = np.einsum('pij,pj->pi', inverse, block_b)
+        schur = np.bincount(groups, block_d, minlength=n_groups) - \
+            np.bincount(groups, (block_b*inv_b).sum(axis=1),
+                        minlength=n_groups)
+        schur = np.where(schur == 0, 1e-300, schur)
+
+        var = np.empty_like(params)
+        var[:, 0] = inverse[:, 0, 0]+inv_b[:, 0]**2/schur[groups]
+        var[:, 1] = inverse[:, 1, 1]+inv_b[:, 1]**2/schur[groups]
+        var[:, 2] = 1./schur[groups]
+
+        n_pixels_group = np.bincount(groups, minlength=n_groups)
+        n_free = 2*n_pixels_group+(1 if shared else n_pixels_group)
+        ndf_group = n_points*n_pixels_group-n_free
+        scale = np.where(ndf_group > 0,
+                         chi2/np.maximum(ndf_group, 1), 1.)
+
+        return np.sqrt(np.abs(var*scale[groups, None]))
@@ -0,0 +1,277 @@
+#!/usr/bin/env python2
+
+""" Benchmark of the S-curve pipeline on synthetic calibration files. The
+files have the layout SCurve.retrieve_graphs expects, i.e. one TGraph per
+pixel named after its number, with a Gaussian response over the thresholds
+plus noise. Every stage is timed for every size and the results are written
+as JSON. Optionally, the time and memory needed to import the modules is
+measured in fresh interpreters. """
+
+import sys
+import json
+import random
+import argparse
+import subprocess
+from os import path, makedirs
+from math import exp
+from array import array
+from timeit import default_timer
+from Logger import LGR
+from ToolboxHelper import load_root
+
+# Modules whose import is timed
+MODULES = ['ToolboxHelper', 'FitTable', 'ToolboxArray', 'NumericPipeline',
+           'Campaign', 'RootOutput', 'Floorplan', 'ToolboxTGraph', 'SCurve']
+
+# Run in a fresh interpreter to time import of a module; prints seconds and
+# maximum resident set size in kB
+_IMPORT_SCRIPT = '''
+import resource
+from timeit import default_timer
+start = default_timer()
+import {0}
+print(default_timer()-start)
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+
+def time_import(module, repeat=3):
+
+    """ Return fastest time in seconds and maximum resident set size in kB
+    of importing module in a fresh interpreter, out of repeat runs. """
+
+    directory = path.dirname(path.abspath(__file__))
+    results = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c', _IMPORT_SCRIPT.format(module)],
+            cwd=directory)
+        seconds, max_rss = output.decode('utf-8').split()[-2:]
+        results.append((float(seconds), int(max_rss)))
+
+    return min(results)
+
+
+def make_calibration_file(path_file, pixels=48, thresholds=256, noise=3.,
+                          seed=0):
+
+    """ Write synthetic calibration file with one TGraph per pixel, named
+    "0" to str(pixels-1). Every pixel responds with a Gaussian of width noise
+    around its threshold, which is spread over the middle of the threshold
+    range, and counts fluctuate by their square root. """
+
+    root = load_root()
+    rng = random.Random(seed)
+    a_x = array('d', [float(threshold) for threshold in range(thresholds)])
+
+    f_out = root.TFile(path_file, 'RECREATE')
+    if f_out.IsZombie():
+        raise IOError('Couldn\'t create ROOT file {0}.'.format(path_file))
+
+    for pixel in range(pixels):
+        mean = rng.uniform(0.3, 0.5)*thresholds
+        width = max(rng.gauss(noise, noise/10.), 0.1)
+        const = rng.uniform(800, 1200)
+        a_y = array('d')
+        for x_n in a_x:
+            count = const*exp(-1./2*((x_n-mean)/width)**2)
+            a_y.append(max(rng.gauss(count, count**0.5), 0.))
+        graph = root.TGraph(thresholds, a_x, a_y)
+        graph.SetName(str(pixel))
+        graph.Write()
+
+    f_out.Close()
+
+
+class Benchmark(object):
+
+    """ Time the stages of the S-curve pipeline on synthetic calibration
+    files of various sizes. """
+
+    def __init__(self, directory):
+
+        """ Initialize object variables. directory holds the synthetic files
+        and the output of the pipeline. """
+
+        self._directory = directory.rstrip('/')
+        self._noise = 3.
+        self._backend = 'root'
+        self._render_policy = 'all'
+        self._repeat = 1
+        self._results = []
+        self._imports = []
+
+    def set_noise(self, noise):
+
+        """ Set width of Gaussian response of synthetic pixels. """
+
+        self._noise = noise
+
+    def set_backend(self, backend):
+
+        """ Set backend used by SCurve. """
+
+        self._backend = backend
+
+    def set_render_policy(self, policy):
+
+        """ Set render policy used by SCurve. """
+
+        self._render_policy = policy
+
+    def set_repeat(self, repeat):
+
+        """ Set how often every size is measured. """
+
+        if repeat < 1:
+            raise ValueError('Number of repetitions needs to be at least 1, '
+                             'not {0}.'.format(repeat))
+
+        self._repeat = repeat
+
+    def run_imports(self, modules=None):
+
+        """ Time import of every module in a fresh interpreter. """
+
+        for module in modules or MODULES:
+            seconds, max_rss = time_import(module, self._repeat)
+            LGR.info('Import of {0}: {1:.3f} s, {2} kB'
+                     .format(module, seconds, max_rss))
+            self._imports.append({'module': module,
+                                  'seconds': seconds,
+                                  'max_rss_kb': max_rss})
+
+        return self._imports
+
+    def get_results(self):
+
+        """ Get list of results, one dictionary per size and repetition. """
+
+        return self._results
+
+    def run(self, sizes):
+
+        """ Time all stages for every (pixels, thresholds) size. Only pixels
+        0 to 47 exist on an MPA, so at most 48 pixels are used. """
+
+        for pixels, thresholds in sizes:
+            if pixels not in range(1, 49):
+                raise ValueError('Number of pixels needs to be between 1 and '
+                                 '48, not {0}.'.format(pixels))
+
+            name = 'bench_{0}x{1}'.format(pixels, thresholds)
+            path_file = path.join(self._directory, '{0}.root'.format(name))
+            if not path.exists(self._directory):
+                makedirs(self._directory)
+            make_calibration_file(path_file, pixels, thresholds, self._noise)
+
+            for repetition in range(self._repeat):
+                timings = self._run_once(path_file, name, pixels)
+                LGR.info('{0} pixels, {1} thresholds: {2:.3f} s'
+                         .format(pixels, thresholds, sum(timings.values())))
+                self._results.append({'pixels': pixels,
+                                      'thresholds': thresholds,
+                                      'noise': self._noise,
+                                      'backend': self._backend,
+                                      'render_policy': self._render_policy,
+                                      'repetition': repetition,
+                                      'timings': timings})
+
+        return self._results
+
+    def _run_once(self, path_file, name, pixels):
+
+        """ Run pipeline once on path_file and return time of every stage in
+        seconds. """
+
+        from SCurve import SCurve
+        from Floorplan import Floorplan
+
+        # Read graphs from file every time
+        SCurve.clear_graph_cache()
+
+        # Fresh 2d maps every time, otherwise they are only written once
+        scurve = SCurve(path_file)
+        scurve.set_floorplan(Floorplan())
+        scurve.set_backend(self._backend)
+        scurve.set_render_policy(self._render_policy)
+        scurve.set_directory(path.join(self._directory, name, '0_pre'))
+        scurve.set_rootfile(path.join(self._directory, name, 'out.root'))
+        scurve.set_graphs(range(0, pixels))
+
+        # Stages of ToolboxTGraph are timed one by one, which SCurve can't do
+        toolbox = scurve._toolbox_graph  # pylint: disable=protected-access
+
+        timings = {}
+        for stage, function in [
+                ('retrieve_graphs',
+                 lambda: scurve.retrieve_graphs(draw=False)),
+                ('draw_measurements', scurve.draw_measurements),
+                ('integrate_graphs',
+                 lambda: toolbox.integrate_graphs(['measurements'])),
+                ('normalize', toolbox.normalize),
+                ('fit', lambda: toolbox.fit('gaus', ['measurements'])),
+                ('fill_maps', lambda: scurve.make_maps(0, 0)),
+                ('save', scurve.flush),
+                ('render', scurve.render)]:
+            start = default_timer()
+            function()
+            timings[stage] = default_timer()-start
+        scurve.close()
+
+        return timings
+
+    def write(self, s_jsonfile):
+
+        """ Write results into JSON file. """
+
+        with open(s_jsonfile, 'w') as f_out:
+            json.dump({'stages': self._results, 'imports': self._imports},
+                      f_out, indent=2, sort_keys=True)
+        LGR.info('Wrote benchmark results to {0}.'.format(s_jsonfile))
+
+
+def _parse_size(size):
+
+    """ Parse size given as PIXELSxTHRESHOLDS. """
+
+    try:
+        pixels, thresholds = [int(value) for value in size.split('x')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('Size {0} is not of the form '
+                                         'PIXELSxTHRESHOLDS.'.format(size))
+
+    return pixels, thresholds
+
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description=__doc__)
+    PARSER.add_argument('--sizes', nargs='*', type=_parse_size,
+                        default=[(6, 256), (24, 256), (48, 256), (48, 1024)],
+                        help='sizes as PIXELSxTHRESHOLDS')
+    PARSER.add_argument('--noise', type=float, default=3.,
+                        help='width of Gaussian response of pixels')
+    PARSER.add_argument('--backend', default='root',
+                        help='backend of SCurve: root, array or batch')
+    PARSER.add_argument('--render-policy', default='all',
+                        help='render policy: none, summary or all')
+    PARSER.add_argument('--repeat', type=int, default=3,
+                        help='number of measurements per size')
+    PARSER.add_argument('--imports', action='store_true',
+                        help='also time import of modules')
+    PARSER.add_argument('--directory', default='benchmark',
+                        help='directory for synthetic files and output')
+    PARSER.add_argument('--output', default='benchmark.json',
+                        help='JSON file with results')
+    ARGS = PARSER.parse_args()
+
+    BENCHMARK = Benchmark(ARGS.directory)
+    BENCHMARK.set_noise(ARGS.noise)
+    BENCHMARK.set_backend(ARGS.backend)
+    BENCHMARK.set_render_policy(ARGS.render_policy)
+    BENCHMARK.set_repeat(ARGS.repeat)
+    BENCHMARK.run(ARGS.sizes)
+    if ARGS.imports:
+        BENCHMARK.run_imports()
+    BENCHMARK.write(ARGS.output)
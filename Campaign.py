@@ -0,0 +1,727 @@
+#!/usr/bin/env python2
+
+""" Process calibration measurements of several MPAs and calibration stages
+in parallel worker processes. ROOT is only imported by jobs which make plots
+or ROOT output, so numeric runs don't load it. """
+
+import json
+from os import remove, path, makedirs
+from multiprocessing import Pool, cpu_count
+from Logger import LGR
+from Instrumentation import INS
+from ToolboxHelper import check_if_file_exists, load_root
+from Geometry import Geometry, DEFAULT_GEOMETRY
+from Constants import STAGES, STEPS
+
+
+def _run_steps(pipeline, steps):
+
+    """ Run steps of SCurve or NumericPipeline pipeline on the pixels set
+    with set_graphs(). """
+
+    if 'retrieve' in steps:
+        pipeline.retrieve_graphs()
+    if 'integrate' in steps:
+        pipeline.make_s_curve()
+    if 'fit' in steps:
+        pipeline.fit_gaussian()
+
+
+def _process_job(job):
+
+    """ Process one (MPA, stage) job: fit single pixels and all pixels
+    together, writing into the partial ROOT file of the job. This is a module
+    level function so that it can be sent to worker processes. Returns job,
+    fits and statistics of the job. """
+
+    # Statistics are collected per job and merged by the main process
+    INS.reset()
+    INS.set_profiling(job['profile_dir'])
+    INS.set_memory_tracing(job['trace_memory'])
+
+    from SCurve import SCurve
+
+    LGR.info('Processing MPA {0} {1}'.format(job['mpa'],
+                                             STAGES[job['stage']]))
+
+    scurve = SCurve(job['path'])
+    if job['geometry_file']:
+        scurve.set_geometry_file(job['geometry_file'])
+    scurve.set_backend(job['backend'])
+    scurve.set_shared_sigma(job['shared_sigma'])
+    scurve.set_render_policy(job['render_policy'])
+    if job['fit_cache']:
+        scurve.set_fit_cache(job['fit_cache'])
+    scurve.set_directory(job['directory'])
+    scurve.set_rootfile(job['rootfile'])
+
+    # All individual pixels
+    for pixel in job['pixels_single']:
+        scurve.set_graphs([pixel])
+        _run_steps(scurve, job['steps'])
+
+    # All pixels together
+    scurve.set_graphs(job['pixels_all'])
+    _run_steps(scurve, job['steps'])
+    scurve.close()
+
+    stats = INS.get_stats()
+    INS.write_profiles()
+    INS.reset()
+
+    return job, scurve.get_fit_table(), stats
+
+
+def _process_job_numeric(job):
+
+    """ Process one (MPA, stage) job without PyROOT: fit all pixels
+    together and return job, fits and statistics of the job. With the array
+    backend, Gaussian parameters are estimated, otherwise they are fitted
+    with a BatchFitter. """
+
+    INS.reset()
+    INS.set_profiling(job['profile_dir'])
+    INS.set_memory_tracing(job['trace_memory'])
+
+    from NumericPipeline import NumericPipeline
+
+    LGR.info('Processing MPA {0} {1}'.format(job['mpa'],
+                                             STAGES[job['stage']]))
+
+    pipeline = NumericPipeline(job['path'])
+    if job['geometry_file']:
+        pipeline.set_geometry_file(job['geometry_file'])
+    if job['backend'] == 'array':
+        pipeline.set_fit_mode('estimate')
+    pipeline.set_shared_sigma(job['shared_sigma'])
+    if job['curve_store']:
+        pipeline.set_store(job['curve_store'])
+    pipeline.set_graphs(job['pixels_all'])
+    _run_steps(pipeline, job['steps'])
+
+    stats = INS.get_stats()
+    INS.write_profiles()
+    INS.reset()
+
+    return job, pipeline.get_fit_table(), stats
+
+
+class Campaign(object):
+
+    """ Process calibration measurements of several MPAs and calibration
+    stages in parallel worker processes. Every (MPA, stage) job writes into
+    its own ROOT file, since ROOT files opened with UPDATE can't be written
+    concurrently; the partial files are merged into the output ROOT file
+    once all jobs are done, and the 2d maps are made from the fits returned
+    by the workers. """
+
+    def __init__(self, output):
+
+        """ Initialize class variables. """
+
+        # Directory where plots and ROOT file are stored in
+        self._output = output.rstrip('/')
+
+        # List of (MPA, stage) jobs
+        self._jobs = []
+
+        # Number of worker processes
+        self._workers = cpu_count()
+
+        # Pixels which are processed individually and all together; all
+        # pixels of the Geometry if None
+        self._pixels_single = range(0, 6)
+        self._pixels_all = None
+
+        # Steps which are run
+        self._steps = list(STEPS)
+
+        # Index of shard of jobs which is processed and number of shards
+        self._shard = (0, 1)
+
+        # Backend and render policy used by SCurve
+        self._backend = 'root'
+        self._shared_sigma = False
+        self._render_policy = 'all'
+
+        # Path to persistent fit cache, shared by all jobs
+        self._fit_cache = ''
+
+        # JSON file with statistics of run, directory for profiles and
+        # whether memory is traced; see Instrumentation
+        self._stats_file = ''
+        self._profile_dir = ''
+        self._trace_memory = False
+
+        # Path to file with Geometry of assembly; default geometry if empty
+        self._geometry_file = ''
+
+        # Whether only fits are made, without plots and ROOT output
+        self._numeric = False
+
+        # Whether numeric jobs keep their curves in a memory-mapped CurveStore
+        self._curve_store = False
+
+        # Directory of Parquet dataset fits are exported to, and name of run
+        # they are tagged with; no export if empty
+        self._export_dir = ''
+        self._run = ''
+
+    def add_job(self, path_file, mpa, stage):
+
+        """ Add job for calibration measurement in path_file of MPA mpa. stage
+        is the index of the calibration stage in STAGES. """
+
+        if stage not in range(0, len(STAGES)):
+            raise ValueError('Unknown calibration stage {0}.'.format(stage))
+
+        pixels_all = self._pixels_all
+        if pixels_all is None:
+            pixels_all = Geometry(self._geometry_file or
+                                  DEFAULT_GEOMETRY).get_numbering()
+
+        name = '{0}_{1}'.format(mpa, STAGES[stage])
+        curve_store = ''
+        if self._curve_store:
+            curve_store = '{0}/{1}_curves'.format(self._output, name)
+        self._jobs.append({'path': path_file,
+                           'mpa': mpa,
+                           'stage': stage,
+                           'directory': '{0}/{1}'.format(self._output, name),
+                           'rootfile': '{0}/{1}.root'.format(self._output,
+                                                             name),
+                           'pixels_single': self._pixels_single,
+                           'pixels_all': pixels_all,
+                           'steps': self._steps,
+                           'backend': self._backend,
+                           'shared_sigma': self._shared_sigma,
+                           'render_policy': self._render_policy,
+                           'fit_cache': self._fit_cache,
+                           'profile_dir': self._profile_dir,
+                           'trace_memory': self._trace_memory,
+                           'curve_store': curve_store,
+                           'geometry_file': self._geometry_file})
+
+    def get_jobs(self):
+
+        """ Get list of jobs of the shard which is processed. """
+
+        index, count = self._shard
+        return sorted(self._jobs, key=lambda job: (job['mpa'], job['stage'],
+                                                   job['path']))[index::count]
+
+    def set_shard(self, index, count):
+
+        """ Set shard of jobs which is processed: jobs are sorted by MPA,
+        stage and path, and every count-th job starting from index is
+        processed. This way, the jobs of a campaign can be spread over count
+        runs, e.g. on different nodes of a batch system, which all add the
+        same jobs.
+
+        With more than one shard, a run writes a partial result: the fits of
+        every job, the ROOT file with the plots and maps of its MPAs, and the
+        JSON file get_partialfile() describing them, all named after the
+        shard. merge() makes the combined maps from the partial results of
+        all shards. """
+
+        if count < 1 or index not in range(0, count):
+            raise ValueError('Shard {0}/{1} doesn\'t exist, index needs to be '
+                             'between 0 and {2}.'.format(index, count,
+                                                         count-1))
+
+        self._shard = (index, count)
+
+    def get_steps(self):
+
+        """ Get list of steps which are run. """
+
+        return self._steps
+
+    def set_steps(self, steps):
+
+        """ Set steps which are run, out of STEPS. Integration and fits need
+        the TGraphs to be retrieved, and maps need fits. Only affects jobs
+        which are added afterwards. """
+
+        unknown = [step for step in steps if step not in STEPS]
+        if unknown:
+            raise ValueError('Unknown steps {0}, use any of {1}.'
+                             .format(', '.join(unknown), ', '.join(STEPS)))
+        if 'retrieve' not in steps and \
+           ('integrate' in steps or 'fit' in steps):
+            raise ValueError('Integration and fits need step retrieve.')
+        if 'maps' in steps and 'fit' not in steps:
+            raise ValueError('Maps need step fit.')
+
+        self._steps = [step for step in STEPS if step in steps]
+
+    def get_workers(self):
+
+        """ Get number of worker processes. """
+
+        return self._workers
+
+    def set_workers(self, workers):
+
+        """ Set number of worker processes. With one worker, all jobs are
+        processed in the current process. """
+
+        if workers < 1:
+            raise ValueError('Number of workers needs to be at least 1, not '
+                             '{0}.'.format(workers))
+
+        self._workers = workers
+
+    def set_pixels(self, pixels_single, pixels_all=None):
+
+        """ Set pixels which are processed individually and all together; with
+        pixels_all None, all pixels of the Geometry are processed together.
+        Only affects jobs which are added afterwards. """
+
+        self._pixels_single = pixels_single
+        self._pixels_all = pixels_all
+
+    def set_backend(self, backend):
+
+        """ Set backend used by SCurve. Only affects jobs which are added
+        afterwards. """
+
+        self._backend = backend
+
+    def set_shared_sigma(self, shared_sigma):
+
+        """ Set whether all pixels of an MPA share sigma in batch fits. Only
+        affects jobs which are added afterwards. """
+
+        self._shared_sigma = shared_sigma
+
+    def set_render_policy(self, policy):
+
+        """ Set render policy used by SCurve. Only affects jobs which are
+        added afterwards; 2d maps are rendered unless the policy is none. """
+
+        self._render_policy = policy
+
+    def set_fit_cache(self, s_cachefile):
+
+        """ Set path to persistent fit cache used by all jobs. Only affects
+        jobs which are added afterwards. """
+
+        self._fit_cache = s_cachefile
+
+    def set_numeric(self, numeric):
+
+        """ Set whether only fits are made, without plots and ROOT output.
+        Numeric runs read the calibration files with a GraphReader and
+        never import PyROOT, unless uproot 3 is not installed; fits are written
+        into {output}/{mpa}_{stage}_fits.npz. """
+
+        self._numeric = numeric
+
+    def set_curve_store(self, curve_store):
+
+        """ Set whether numeric jobs keep their curves in a memory-mapped
+        CurveStore in {output}/{mpa}_{stage}_curves.dat instead of in memory.
+        Only affects jobs which are added afterwards. """
+
+        self._curve_store = curve_store
+
+    def get_fitfile(self, mpa, stage):
+
+        """ Get name of file with fits of MPA in stage of numeric runs. """
+
+        return '{0}/{1}_{2}_fits.npz'.format(self._output, mpa,
+                                              STAGES[stage])
+
+    def get_reportfile(self):
+
+        """ Get name of JSON file listing fits which failed. """
+
+        return '{0}/fit_report{1}.json'.format(self._output,
+                                               self._get_suffix())
+
+    def get_partialfile(self):
+
+        """ Get name of JSON file describing the partial result of the shard
+        which is processed. """
+
+        index, count = self._shard
+        return '{0}/partial_{1}of{2}.json'.format(self._output, index, count)
+
+    def _get_suffix(self):
+
+        """ Get suffix of output files, which names the shard if there is
+        more than one. """
+
+        index, count = self._shard
+        if count == 1:
+            return ''
+
+        return '_{0}of{1}'.format(index, count)
+
+    def set_stats(self, s_jsonfile='', profile_dir='', trace_memory=False):
+
+        """ Set JSON file into which statistics of the run are written, and
+        optionally directory for cProfile profiles of every stage and
+        whether peak memory of every stage is traced. Profiling and memory
+        tracing only affect jobs which are added afterwards. """
+
+        self._stats_file = s_jsonfile
+        self._profile_dir = profile_dir
+        self._trace_memory = trace_memory
+
+    def set_export(self, export_dir, run=''):
+
+        """ Set directory of Parquet dataset into which the fits of every
+        job are exported, tagged with run; see FitExport. Needs pyarrow. """
+
+        self._export_dir = export_dir
+        self._run = run
+
+    def set_geometry_file(self, s_geometryfile):
+
+        """ Set file with Geometry of assembly, which defines the pixels of
+        every chip and is used for 2d maps. The pixels of jobs which are added
+        afterwards are taken from it. """
+
+        self._geometry_file = s_geometryfile
+
+    def get_rootfile(self):
+
+        """ Get name of output ROOT file. """
+
+        return '{0}/out{1}.root'.format(self._output, self._get_suffix())
+
+    def get_process(self):
+
+        """ Get module level function which processes one job and returns
+        job, fits and statistics of the job, e.g. to process jobs in other
+        worker processes. """
+
+        return _process_job_numeric if self._numeric else _process_job
+
+    def run(self):
+
+        """ Process all jobs, merge their ROOT files and make 2d maps. In
+        numeric runs, only the fits of every job are written. """
+
+        jobs = self.get_jobs()
+        LGR.info('Process {0} jobs with {1} workers.'
+                 .format(len(jobs), self._workers))
+
+        self.prepare()
+        process = self.get_process()
+        if self._workers == 1:
+            results = [process(job) for job in jobs]
+        else:
+            pool = Pool(processes=max(min(self._workers, len(jobs)), 1))
+            try:
+                results = pool.map(process, jobs, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+
+        self.collect(results)
+
+    def prepare(self):
+
+        """ Prepare output directory before jobs are processed. """
+
+        # Numeric jobs write curve stores into output directory
+        if self._numeric and not path.exists(self._output):
+            makedirs(self._output)
+
+    def collect(self, results):
+
+        """ Collect results of processed jobs, given as (job, fits, stats):
+        merge their ROOT files and make 2d maps, or write the fits in
+        numeric runs, and summarize the statistics of the run. Runs of one
+        of several shards also write the fits and describe their partial
+        result, which is empty for a shard without jobs. """
+
+        INS.set_profiling(self._profile_dir)
+        INS.set_memory_tracing(self._trace_memory)
+        partial = self._shard[1] > 1
+        if self._numeric or partial:
+            self._write_fits(results)
+        if not self._numeric and results:
+            self._merge([job['rootfile'] for job, _, _ in results])
+            if 'maps' in self._steps:
+                self._make_maps(results)
+        if partial:
+            self._write_partial(results)
+        if self._export_dir:
+            self._export(results)
+        self._write_report(results)
+        for _, _, stats in results:
+            INS.merge(stats)
+
+        INS.write_profiles()
+        INS.log_summary()
+        if self._stats_file:
+            INS.dump(self._stats_file)
+
+    def merge(self, partialfiles):
+
+        """ Make combined 2d maps and the fit report of a campaign from the
+        partial results of all its shards, given as the JSON files written
+        by their runs, without fitting again. The ROOT files of the shards
+        are merged into the output ROOT file and kept. Paths in the JSON
+        files are relative to their directory, so partial results can be
+        copied from the nodes which made them. """
+
+        from FitTable import FitTable
+
+        partials = []
+        for partialfile in partialfiles:
+            check_if_file_exists(partialfile)
+            with open(partialfile) as f_in:
+                partial = json.load(f_in)
+            partial['base'] = path.dirname(partialfile)
+            partials.append(partial)
+        self._check_partials(partials)
+
+        results = []
+        for partial in partials:
+            for job in partial['jobs']:
+                fits = FitTable.read_npz(path.join(partial['base'],
+                                                   job['fitfile']))
+                job = dict(job)
+                job['directory'] = '{0}/{1}_{2}'.format(
+                    self._output, job['mpa'], STAGES[job['stage']])
+                job['render_policy'] = self._render_policy
+                results.append((job, fits, {}))
+        LGR.info('Merge {0} jobs of {1} shards.'.format(len(results),
+                                                        len(partials)))
+
+        if not path.exists(self._output):
+            makedirs(self._output)
+        if not self._geometry_file:
+            self._geometry_file = partials[0]['geometry_file']
+        rootfiles = [path.join(partial['base'], partial['rootfile'])
+                     for partial in partials if partial['rootfile']]
+        if rootfiles:
+            self._merge(rootfiles, remove_inputs=False)
+        self._make_maps(results)
+        if self._export_dir:
+            self._export(results)
+        self._write_report(results)
+
+        INS.log_summary()
+        if self._stats_file:
+            INS.dump(self._stats_file)
+
+    def _check_partials(self, partials):
+
+        """ Raise error unless partials are the results of every shard of one
+        campaign, each with fits. """
+
+        if not partials:
+            raise ValueError('There are no partial results to merge.')
+
+        counts = set(partial['shard'][1] for partial in partials)
+        if len(counts) != 1:
+            raise ValueError('Partial results come from campaigns with {0} '
+                             'shards.'.format(sorted(counts)))
+        count = counts.pop()
+        indices = sorted(partial['shard'][0] for partial in partials)
+        if indices != range(0, count):
+            raise ValueError('Partial results of shards {0} of {1} are '
+                             'needed, got shards {2}.'
+                             .format(range(0, count), count, indices))
+
+        if any('fit' not in partial['steps'] for partial in partials):
+            raise ValueError('Partial results without fits can\'t be '
+                             'merged.')
+        jobs = [(job['mpa'], job['stage']) for partial in partials
+                for job in partial['jobs']]
+        if len(set(jobs)) != len(jobs):
+            raise ValueError('Partial results contain an MPA and stage more '
+                             'than once.')
+
+        totals = set(partial['jobs_total'] for partial in partials)
+        if len(totals) != 1:
+            raise ValueError('Partial results come from campaigns with {0} '
+                             'jobs.'.format(sorted(totals)))
+        total = totals.pop()
+        if len(jobs) != total:
+            raise ValueError('Partial results contain {0} of the {1} jobs of '
+                             'the campaign.'.format(len(jobs), total))
+
+    def _write_partial(self, results):
+
+        """ Write JSON file describing the partial result of the shard which
+        is processed: the settings of the run and, for every job, its input
+        and the file with its fits. Files are given relative to the output
+        directory. """
+
+        partial = {'shard': list(self._shard),
+                   'jobs_total': len(self._jobs),
+                   'steps': self._steps,
+                   'numeric': self._numeric,
+                   'backend': self._backend,
+                   'shared_sigma': self._shared_sigma,
+                   'geometry_file': self._geometry_file,
+                   'rootfile': '' if self._numeric or not results else
+                               path.basename(self.get_rootfile()),
+                   'jobs': [{'path': job['path'],
+                             'mpa': job['mpa'],
+                             'stage': job['stage'],
+                             'pixels_all': list(job['pixels_all']),
+                             'fitfile': path.basename(self.get_fitfile(
+                                 job['mpa'], job['stage']))}
+                            for job, _, _ in results]}
+
+        with open(self.get_partialfile(), 'w') as f_out:
+            json.dump(partial, f_out, indent=1, sort_keys=True)
+        LGR.info('Wrote partial result of shard {0}/{1} to {2}.'
+                 .format(self._shard[0], self._shard[1],
+                         self.get_partialfile()))
+
+    def _write_fits(self, results):
+
+        """ Write fits of every job of a numeric run. """
+
+        if not path.exists(self._output):
+            makedirs(self._output)
+
+        for job, fits, _ in results:
+            fits.write_npz(self.get_fitfile(job['mpa'], job['stage']))
+
+    def _write_report(self, results):
+
+        """ Write fits which needed a retry or failed into JSON file, one
+        entry per pixel, and log how many there are. """
+
+        from FitTable import ATTEMPTS, STATUS_ESTIMATED
+
+        report = []
+        for job, fits, _ in results:
+            columns = fits.to_numpy()
+            for row in range(len(fits)):
+                attempts = int(columns['attempts'][row])
+                status = int(columns['status'][row])
+                if attempts == 1 and status in [0, STATUS_ESTIMATED]:
+                    continue
+                report.append({'mpa': job['mpa'],
+                               'stage': STAGES[job['stage']],
+                               'pixel': int(columns['numbering'][row]),
+                               'attempts': attempts,
+                               'method': ATTEMPTS[min(attempts,
+                                                      len(ATTEMPTS))-1],
+                               'status': status,
+                               'cov_status': int(columns['cov_status'][row]),
+                               'edm': float(columns['edm'][row])})
+
+        if not path.exists(self._output):
+            makedirs(self._output)
+        with open(self.get_reportfile(), 'w') as f_out:
+            json.dump(report, f_out, indent=1, sort_keys=True)
+
+        fallbacks = len([entry for entry in report
+                         if entry['method'] == ATTEMPTS[-1]])
+        if report:
+            LGR.warning('{0} fits needed a retry or failed, {1} of them kept '
+                        'their initial values; see {2}.'
+                        .format(len(report), fallbacks,
+                                self.get_reportfile()))
+        else:
+            LGR.info('All fits succeeded at the first attempt.')
+
+    def _export(self, results):
+
+        """ Export fits of every job into Parquet dataset. """
+
+        from FitExport import FitExport
+
+        export = FitExport(self._export_dir)
+        for job, fits, _ in results:
+            export.write(fits, job['mpa'], job['stage'], self._run,
+                         job['path'])
+
+    def _merge(self, rootfiles, remove_inputs=True):
+
+        """ Merge partial ROOT files into output ROOT file and remove them,
+        unless remove_inputs is False. Every key is copied with all its
+        cycles, so the output holds the same objects as if all jobs had
+        written into it; TFileMerger would only keep the highest cycle of
+        objects it can merge, e.g. TGraphs and histograms. """
+
+        root = load_root()
+
+        LGR.info('Merge {0} ROOT files into {1}.'
+                 .format(len(rootfiles), self.get_rootfile()))
+
+        f_out = root.TFile(self.get_rootfile(), 'UPDATE')
+        if f_out.IsZombie():
+            raise IOError('Couldn\'t open ROOT file {0}.'
+                          .format(self.get_rootfile()))
+        for rootfile in rootfiles:
+            if not path.exists(rootfile):
+                LGR.warning('ROOT file {0} does not exist, there is nothing '
+                            'to merge.'.format(rootfile))
+                continue
+            f_in = root.TFile(rootfile)
+            if f_in.IsZombie():
+                raise IOError('Couldn\'t open ROOT file {0}.'
+                              .format(rootfile))
+            self._copy_keys(root, f_in, f_out)
+            f_in.Close()
+        f_out.Close()
+
+        # Don't leave a closed file as current directory
+        root.gROOT.cd()
+
+        if not remove_inputs:
+            return
+        for rootfile in rootfiles:
+            if path.exists(rootfile):
+                remove(rootfile)
+
+    def _copy_keys(self, root, source, target):
+
+        """ Copy every key of TDirectory source into TDirectory target,
+        descending into subdirectories. Cycles of an object are written in
+        the order they were written into source, so they keep their order. """
+
+        keys = sorted(source.GetListOfKeys(),
+                      key=lambda key: (key.GetName(), key.GetCycle()))
+        for key in keys:
+            name = key.GetName()
+            if root.TClass.GetClass(key.GetClassName()).InheritsFrom(
+                    'TDirectory'):
+                if not target.GetDirectory(name):
+                    target.mkdir(name)
+                self._copy_keys(root, source.GetDirectory(name),
+                                target.GetDirectory(name))
+                continue
+
+            obj = key.ReadObj()
+            # Histograms would otherwise stay attached to source
+            if obj.InheritsFrom('TH1'):
+                obj.SetDirectory(0)
+            target.WriteTObject(obj, name)
+
+    def _make_maps(self, results):
+
+        """ Make 2d maps from fits of all jobs. This is done in the current
+        process, since the maps of all MPAs are combined. Every call starts
+        from empty maps. """
+
+        from SCurve import SCurve
+        from Floorplan import Floorplan
+
+        floorplan = Floorplan(Geometry(self._geometry_file)
+                              if self._geometry_file else None)
+        for job, fits, _ in sorted(
+                results, key=lambda result: (result[0]['mpa'],
+                                             result[0]['stage'])):
+            scurve = SCurve(job['path'])
+            scurve.set_floorplan(floorplan)
+            scurve.set_directory(job['directory'])
+            scurve.set_rootfile(self.get_rootfile())
+            scurve.set_render_policy(job['render_policy'])
+            scurve.set_graphs(job['pixels_all'])
+            scurve.fill_fits(fits)
+            scurve.make_maps(job['mpa'], job['stage'])
+            scurve.close()
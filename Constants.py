@@ -0,0 +1,11 @@
+#!/usr/bin/env python2
+
+""" Names of calibration stages and processing steps, to be imported by
+other modules. """
+
+# Names of calibration stages, index is used as prefix for Floorplan
+STAGES = ['pre', 'post']
+
+# Steps of processing a job, in the order they run; maps are made once all
+# jobs are done
+STEPS = ['retrieve', 'integrate', 'fit', 'maps']
@@ -0,0 +1,177 @@
+#!/usr/bin/env python2
+
+""" Memory-mapped store of curves of many pixels. The x values, raw
+measurements, integrated curves and normalized S-curves of all pixels are
+kept in one float64 file, which
+is mapped into memory, so that only the pages which are used are loaded and
+stages read and write the curves in place. An index in a JSON file next to it
+holds the shape, the pixel numbers and the byte offset of every pixel.
+
+The store is used by NumericPipeline, i.e. by numeric runs. ToolboxTGraph
+doesn't use it: ROOT fits, draws and writes TGraphs, which own a copy of
+their points, so a store behind them would add memory instead of saving
+it. Campaigns too large to keep in memory are processed numerically. """
+
+import json
+from collections import OrderedDict
+import numpy as np
+from Logger import LGR
+from ToolboxHelper import check_if_file_exists, check_if_object
+
+# Planes of the store, each a 2d (pixels x thresholds) array; S-curves are
+# copied from the integrated curves and normalized in place
+PLANES = ['x', 'measurements', 'integrated', 'scurves']
+
+
+class CurveStore(object):
+
+    """ Memory-mapped store of curves of many pixels, in the files
+    <prefix>.dat and <prefix>.json. """
+
+    def __init__(self, prefix):
+
+        """ Initialize object variables. """
+
+        self._prefix = prefix
+        self._data = None
+        self._numbering = []
+        self._rows = {}
+
+    def get_datafile(self):
+
+        """ Get name of file with curves. """
+
+        return '{0}.dat'.format(self._prefix)
+
+    def get_indexfile(self):
+
+        """ Get name of file with index. """
+
+        return '{0}.json'.format(self._prefix)
+
+    def create(self, numbering, n_points):
+
+        """ Create store for pixels in numbering with n_points thresholds
+        each, replacing an existing store with the same prefix. All curves
+        are set to 0. """
+
+        check_if_object(numbering, list)
+        if not numbering or n_points < 1:
+            raise ValueError('Can\'t create store for {0} pixels with {1} '
+                             'points.'.format(len(numbering), n_points))
+
+        self.close()
+        shape = (len(PLANES), len(numbering), n_points)
+        self._data = np.memmap(self.get_datafile(), dtype=np.float64,
+                               mode='w+', shape=shape)
+        self._set_numbering(numbering)
+
+        # Byte offset of every pixel within a plane; planes follow each other
+        row_bytes = n_points*self._data.itemsize
+        index = OrderedDict()
+        index['dtype'] = 'float64'
+        index['shape'] = list(shape)
+        index['planes'] = PLANES
+        index['plane_bytes'] = len(numbering)*row_bytes
+        index['offsets'] = OrderedDict(
+            (str(pixel), row*row_bytes)
+            for row, pixel in enumerate(self._numbering))
+        with open(self.get_indexfile(), 'w') as f_out:
+            json.dump(index, f_out, indent=1)
+
+        LGR.info('Created curve store {0} for {1} pixels with {2} points.'
+                 .format(self.get_datafile(), len(numbering), n_points))
+
+    def open(self, mode='r+'):
+
+        """ Open existing store; with mode r, it can't be changed. """
+
+        check_if_file_exists(self.get_indexfile())
+        check_if_file_exists(self.get_datafile())
+        with open(self.get_indexfile()) as f_in:
+            index = json.load(f_in)
+        if index['planes'] != PLANES:
+            raise ValueError('Curve store {0} has planes {1}, expected {2}.'
+                             .format(self.get_datafile(), index['planes'],
+                                     PLANES))
+
+        self.close()
+        self._data = np.memmap(self.get_datafile(), dtype=index['dtype'],
+                               mode=mode, shape=tuple(index['shape']))
+        row_bytes = index['shape'][2]*self._data.itemsize
+        self._set_numbering([int(pixel) for pixel, _ in sorted(
+            index['offsets'].items(), key=lambda item: item[1])])
+        if len(self._numbering) != index['shape'][1] or \
+           any(index['offsets'][str(pixel)] != row*row_bytes
+               for row, pixel in enumerate(self._numbering)):
+            raise ValueError('Index {0} doesn\'t match curve store.'
+                             .format(self.get_indexfile()))
+
+    def fill(self, numbering, a_x, a_y):
+
+        """ Create store for pixels in numbering and fill x values and
+        measurements, given as 2d (pixels x thresholds) arrays. """
+
+        a_y = np.atleast_2d(np.asarray(a_y, dtype=float))
+        self.create(numbering, a_y.shape[1])
+        self.get_plane('x')[:] = a_x
+        self.get_plane('measurements')[:] = a_y
+
+    def get_plane(self, plane):
+
+        """ Get 2d (pixels x thresholds) array of plane, which is a view on
+        the mapped file. """
+
+        self._check_open()
+        if plane not in PLANES:
+            raise ValueError('Unknown plane {0}, use one of {1}.'
+                             .format(plane, ', '.join(PLANES)))
+
+        return self._data[PLANES.index(plane)]
+
+    def get_numbering(self):
+
+        """ Get list of pixel numbers, in the order of the rows. """
+
+        return self._numbering
+
+    def get_rows(self, pixels):
+
+        """ Get rows of pixels. """
+
+        missing = [pixel for pixel in pixels if pixel not in self._rows]
+        if missing:
+            raise ValueError('Pixels {0} are not in curve store {1}.'
+                             .format(missing, self.get_datafile()))
+
+        return [self._rows[pixel] for pixel in pixels]
+
+    def flush(self):
+
+        """ Write changes to file. """
+
+        if self._data is not None and self._data.mode != 'r':
+            self._data.flush()
+
+    def close(self):
+
+        """ Write changes to file and unmap it. """
+
+        self.flush()
+        self._data = None
+
+    def _set_numbering(self, numbering):
+
+        """ Set pixel numbers and rows. """
+
+        self._numbering = list(numbering)
+        self._rows = dict((pixel, row)
+                          for row, pixel in enumerate(self._numbering))
+
+    def _check_open(self):
+
+        """ Raise error if store is not created or opened. """
+
+        if self._data is None:
+            raise ValueError('Curve store {0} is not open.'
+                             .format(self.get_datafile()))
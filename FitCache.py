@@ -0,0 +1,169 @@
+#!/usr/bin/env python2
+
+""" Persistent cache for fit results, stored in an SQLite file. Fits are
+keyed by a hash of the points of the TGraph, the fit function and the fit
+options, so unchanged pixels don't have to be fitted again. """
+
+import sqlite3
+import hashlib
+from collections import OrderedDict
+from time import time
+from array import array
+from Logger import LGR
+from ToolboxFit import ToolboxFit
+from FitTable import DEFAULTS
+
+# Columns holding the values of ToolboxFit, in the order of
+# ToolboxFit.from_values
+COLUMNS = ['c', 'c_err', 'mu', 'mu_err', 'sigma', 'sigma_err', 'chi2', 'ndf',
+           'status', 'cov_status', 'edm', 'attempts']
+
+# Columns holding integers
+INT_COLUMNS = ['ndf', 'status', 'cov_status', 'attempts']
+
+
+class FitCache(object):
+
+    """ Persistent cache for fit results, stored in an SQLite file. New fits
+    are written in one transaction by flush(); once more than max_entries
+    fits are stored, the least recently used ones are evicted then. """
+
+    def __init__(self, s_cachefile, max_entries=100000):
+
+        """ Initialize object variables and create table if needed. """
+
+        self.s_cachefile = s_cachefile
+        self.max_entries = max_entries
+        self._hits = 0
+        self._misses = 0
+
+        # Access times of cache hits and rows of new fits, keyed by their
+        # key, written by flush() to keep write locks short when worker
+        # processes share the cache
+        self._accessed = []
+        self._pending = OrderedDict()
+
+        # Several worker processes may share the cache, so wait for locks
+        self._connection = sqlite3.connect(s_cachefile, timeout=60)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS fits (key TEXT PRIMARY KEY, '
+            'accessed REAL, {0})'
+            .format(', '.join('{0} REAL'.format(col) for col in COLUMNS)))
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS fits_accessed ON fits (accessed)')
+
+        # Caches written before the fit quality was stored get its columns,
+        # filled with the defaults of FitTable
+        existing = set(row[1] for row in self._connection.execute(
+            'PRAGMA table_info(fits)'))
+        for col in COLUMNS:
+            if col not in existing:
+                self._connection.execute(
+                    'ALTER TABLE fits ADD COLUMN {0} REAL DEFAULT {1}'
+                    .format(col, DEFAULTS[col]))
+        self._connection.commit()
+
+    def get_key(self, graph, distribution, options):
+
+        """ Return key of fit of distribution with options on TGraph. """
+
+        n_points = graph.GetN()
+        buf_x = graph.GetX()
+        buf_y = graph.GetY()
+
+        digest = hashlib.sha1()
+        digest.update(array('d', [buf_x[idx] for idx in range(n_points)]))
+        digest.update(array('d', [buf_y[idx] for idx in range(n_points)]))
+        digest.update('{0}:{1}'.format(distribution, options).encode('utf-8'))
+
+        return digest.hexdigest()
+
+    def get(self, key, numbering):
+
+        """ Return ToolboxFit stored under key with numbering, or None if there
+        is no such fit. """
+
+        row = self._pending.get(key)
+        if row is not None:
+            row = row[1:]
+        else:
+            row = self._connection.execute(
+                'SELECT {0} FROM fits WHERE key = ?'
+                .format(', '.join(COLUMNS)), (key,)).fetchone()
+
+        if row is None:
+            self._misses += 1
+            return None
+
+        self._hits += 1
+        self._accessed.append((time(), key))
+
+        values = [int(value) if col in INT_COLUMNS else value
+                  for col, value in zip(COLUMNS, row)]
+        return ToolboxFit.from_values(numbering, *values)
+
+    def put(self, key, fit):
+
+        """ Store ToolboxFit under key. It is written into the cache file by
+        the next flush(). """
+
+        self._pending[key] = (time(), fit.get_c(), fit.get_c_err(),
+                              fit.get_mu(), fit.get_mu_err(), fit.get_sigma(),
+                              fit.get_sigma_err(), fit.get_chi2(),
+                              fit.get_ndf(), fit.get_status(),
+                              fit.get_cov_status(), fit.get_edm(),
+                              fit.get_attempts())
+
+    def flush(self):
+
+        """ Write new fits and access times of cache hits in one transaction
+        and evict least recently used fits if the cache is full. This is
+        meant to be called once all pixels are fitted. """
+
+        if not self._pending and not self._accessed:
+            return
+
+        self._connection.executemany(
+            'INSERT OR REPLACE INTO fits VALUES (?, ?, {0})'
+            .format(', '.join('?' for _ in COLUMNS)),
+            [(key,) + row for key, row in self._pending.items()])
+        self._pending = OrderedDict()
+        self._update_accessed()
+        self._evict()
+        self._connection.commit()
+
+    def _update_accessed(self):
+
+        """ Write access times of cache hits. """
+
+        self._connection.executemany(
+            'UPDATE fits SET accessed = ? WHERE key = ?', self._accessed)
+        self._accessed = []
+
+    def _evict(self):
+
+        """ Remove least recently used fits exceeding max_entries. """
+
+        n_entries = self._connection.execute(
+            'SELECT COUNT(*) FROM fits').fetchone()[0]
+        if n_entries <= self.max_entries:
+            return
+
+        LGR.debug('Evict {0} fits from cache {1}.'
+                  .format(n_entries-self.max_entries, self.s_cachefile))
+        self._connection.execute(
+            'DELETE FROM fits WHERE key IN (SELECT key FROM fits ORDER BY '
+            'accessed LIMIT ?)', (n_entries-self.max_entries,))
+
+    def get_stats(self):
+
+        """ Return number of cache hits and misses. """
+
+        return self._hits, self._misses
+
+    def close(self):
+
+        """ Write pending changes and close connection to cache file. """
+
+        self.flush()
+        self._connection.close()
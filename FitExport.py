@@ -0,0 +1,147 @@
+#!/usr/bin/env python2
+
+""" Export of fits into a Parquet dataset for analyses across many runs.
+Every fit is tagged with MPA, stage, pixel, run and path of the calibration
+file. The dataset is partitioned by MPA and stage (directories mpa=<n> and
+stage=<pre|post>), so reading a selection of MPAs or stages only opens their
+files, and every write adds new files, so runs can be appended. pyarrow is
+only needed for the export and is imported when it is used. """
+
+from collections import OrderedDict
+import numpy as np
+from Logger import LGR
+from FitTable import COLUMNS
+from Constants import STAGES
+
+# Columns of dataset, besides the partition columns mpa and stage; numbering
+# of FitTable is stored as pixel
+EXPORT_COLUMNS = ['pixel'] + COLUMNS[1:] + ['run', 'path']
+
+# Columns of FitTable which are stored as integers
+INT_COLUMNS = ['ndf', 'status', 'cov_status', 'attempts']
+
+
+def _load_pyarrow():
+
+    """ Return pyarrow and pyarrow.parquet, raise ImportError with a hint if
+    pyarrow is not installed. """
+
+    try:
+        import pyarrow  # pylint: disable=import-error
+        import pyarrow.parquet  # pylint: disable=import-error
+    except ImportError:
+        raise ImportError('Export of fits needs pyarrow, install it with '
+                          '"pip install pyarrow".')
+
+    return pyarrow, pyarrow.parquet
+
+
+class FitExport(object):
+
+    """ Export of fits into a Parquet dataset, partitioned by MPA and
+    stage. """
+
+    def __init__(self, directory, compression='zstd'):
+
+        """ Initialize object variables. directory is the root of the
+        dataset. """
+
+        self._directory = directory.rstrip('/')
+        self._compression = compression
+
+    def get_directory(self):
+
+        """ Get root directory of dataset. """
+
+        return self._directory
+
+    def write(self, fits, mpa, stage, run='', path_file=''):
+
+        """ Append FitTable fits of MPA in stage to the dataset. stage is
+        either the index or the name of the calibration stage. """
+
+        pyarrow, parquet = _load_pyarrow()
+
+        n_fits = len(fits)
+        if not n_fits:
+            return
+
+        columns = fits.to_numpy()
+        data = OrderedDict()
+        data['mpa'] = pyarrow.array([int(mpa)]*n_fits, type=pyarrow.int32())
+        data['stage'] = pyarrow.array([self._get_stage(stage)]*n_fits,
+                                      type=pyarrow.string())
+        data['pixel'] = pyarrow.array(columns['numbering'].astype('int32'))
+        for col in COLUMNS[1:]:
+            if col in INT_COLUMNS:
+                data[col] = pyarrow.array(columns[col].astype('int32'))
+            else:
+                data[col] = pyarrow.array(columns[col])
+        data['run'] = pyarrow.array([run]*n_fits, type=pyarrow.string())
+        data['path'] = pyarrow.array([path_file]*n_fits,
+                                     type=pyarrow.string())
+
+        table = pyarrow.Table.from_arrays(list(data.values()),
+                                          names=list(data.keys()))
+        parquet.write_to_dataset(table, self._directory,
+                                 partition_cols=['mpa', 'stage'],
+                                 compression=self._compression)
+
+        LGR.info('Exported {0} fits of MPA {1} {2} to {3}.'
+                 .format(n_fits, mpa, self._get_stage(stage),
+                         self._directory))
+
+    def read(self, mpa=None, stage=None, run=None):
+
+        """ Read fits from dataset and return OrderedDict with NumPy array of
+        every column. mpa, stage and run select fits; each is either a single
+        value or a list of values. Selections on MPA and stage only read the
+        files of the selected partitions; runs are selected after reading,
+        since pyarrow only filters on partition columns. """
+
+        pyarrow, parquet = _load_pyarrow()
+
+        filters = []
+        if mpa is not None:
+            filters.append(('mpa', 'in', [int(value)
+                                          for value in self._listify(mpa)]))
+        if stage is not None:
+            filters.append(('stage', 'in', [self._get_stage(value)
+                                            for value in
+                                            self._listify(stage)]))
+        table = parquet.read_table(self._directory, filters=filters or None)
+
+        data = OrderedDict()
+        for name in ['mpa', 'stage'] + EXPORT_COLUMNS:
+            column = table.column(name)
+            # Partition columns are read as dictionaries
+            if pyarrow.types.is_dictionary(column.type):
+                column = column.cast(column.type.value_type)
+            data[name] = column.to_numpy()
+
+        if run is not None:
+            runs = set(self._listify(run))
+            selected = np.array([value in runs for value in data['run']],
+                                dtype=bool)
+            for name in data:
+                data[name] = data[name][selected]
+
+        return data
+
+    def _get_stage(self, stage):
+
+        """ Return name of calibration stage, given by index or name. """
+
+        if stage in STAGES:
+            return stage
+        if stage in range(0, len(STAGES)):
+            return STAGES[stage]
+        raise ValueError('Unknown calibration stage {0}.'.format(stage))
+
+    def _listify(self, value):
+
+        """ Return value as list. """
+
+        if isinstance(value, (list, tuple, set)):
+            return list(value)
+        return [value]
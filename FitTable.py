@@ -0,0 +1,189 @@
+#!/usr/bin/env python2
+
+""" Columnar table to store fit values of many pixels. Every column is a
+NumPy array of doubles which grows geometrically, so the table stays compact
+for a large number of fits, appending is cheap and columns can be exported
+to NumPy without copying. """
+
+from collections import OrderedDict
+import numpy as np
+
+# Columns of table; numbering, ndf, status, cov_status and attempts are
+# stored as doubles as well
+COLUMNS = ['numbering', 'c', 'c_err', 'mu', 'mu_err', 'sigma', 'sigma_err',
+           'chi2', 'ndf', 'status', 'cov_status', 'edm', 'attempts']
+
+# Values of columns describing the quality of a fit, used for fits which
+# don't know them, e.g. ones read from older files. status is 0 for fits
+# which converged, STATUS_ESTIMATED for parameters which were estimated
+# instead of fitted, STATUS_FAILED for curves without signal and degenerate
+# fits, whose parameters are meaningless, and the status of the fitter
+# otherwise; cov_status is the status of the covariance matrix like in Minuit
+# (0 not calculated, 1 approximate, 2 forced positive definite, 3 accurate)
+# or -1 if unknown; edm is the estimated distance to the minimum; attempts is
+# the number of attempts of the retry ladder, see ATTEMPTS
+DEFAULTS = OrderedDict([('status', 0), ('cov_status', -1), ('edm', 0.),
+                        ('attempts', 1)])
+STATUS_ESTIMATED = -1
+STATUS_FAILED = -2
+
+# Attempts of the retry ladder for failed fits: the fit itself, a fit with
+# other initial values, a fit in a range around the peak, and finally an
+# estimate of the parameters without fitting
+ATTEMPTS = ['fit', 'reseeded', 'restricted', 'estimate']
+
+
+class FitTable(object):
+
+    """ Columnar table to store fit values of many pixels. """
+
+    def __init__(self, columns=None):
+
+        """ Initialize object variables; if constructor is called with a
+        dictionary of columns, fill them into the table. """
+
+        # Arrays of every column, of which the first _size entries are used
+        self._columns = OrderedDict((col, np.empty(0)) for col in COLUMNS)
+        self._size = 0
+        if columns is not None:
+            self.extend(columns)
+
+    def __len__(self):
+
+        """ Return number of fits in table. """
+
+        return self._size
+
+    def _reserve(self, n_rows):
+
+        """ Make room for n_rows more fits, at least doubling the capacity if
+        the arrays need to grow. The arrays are replaced instead of resized,
+        so arrays returned before keep their own memory. """
+
+        needed = self._size+n_rows
+        capacity = len(self._columns[COLUMNS[0]])
+        if needed <= capacity:
+            return
+
+        capacity = max(2*capacity, needed)
+        for col in COLUMNS:
+            column = np.empty(capacity)
+            column[:self._size] = self._columns[col][:self._size]
+            self._columns[col] = column
+
+    def append(self, numbering, c, c_err, mu, mu_err, sigma, sigma_err, chi2,
+               ndf, status=DEFAULTS['status'],
+               cov_status=DEFAULTS['cov_status'], edm=DEFAULTS['edm'],
+               attempts=DEFAULTS['attempts']):
+
+        """ Append values of one fit and return its row. """
+
+        self._reserve(1)
+        for col, value in zip(COLUMNS, [numbering, c, c_err, mu, mu_err, sigma,
+                                        sigma_err, chi2, ndf, status,
+                                        cov_status, edm, attempts]):
+            self._columns[col][self._size] = value
+        self._size += 1
+
+        return self._size-1
+
+    def extend(self, columns):
+
+        """ Append values of many fits at once. columns is a dictionary with
+        a sequence of values for every column, e.g. the one returned by
+        get_columns() of another FitTable. Columns in DEFAULTS may be
+        missing, they are filled with their default value. """
+
+        missing = [col for col in COLUMNS
+                   if col not in columns and col not in DEFAULTS]
+        if missing:
+            raise ValueError('Columns {0} are missing.'.format(missing))
+        lengths = set(len(columns[col]) for col in COLUMNS if col in columns)
+        if len(lengths) != 1:
+            raise ValueError('Columns don\'t have the same length: {0}.'
+                             .format(sorted(lengths)))
+        length = lengths.pop()
+
+        self._reserve(length)
+        rows = slice(self._size, self._size+length)
+        for col in COLUMNS:
+            if col in columns:
+                self._columns[col][rows] = np.asarray(columns[col],
+                                                      dtype=np.float64)
+            else:
+                self._columns[col][rows] = DEFAULTS[col]
+        self._size += length
+
+    def get_value(self, column, row):
+
+        """ Return value in column of row. """
+
+        if not -self._size <= row < self._size:
+            raise IndexError('Row {0} is not in table with {1} fits.'
+                             .format(row, self._size))
+
+        return float(self._columns[column][row % self._size])
+
+    def set_value(self, column, row, value):
+
+        """ Set value in column of row. """
+
+        if not -self._size <= row < self._size:
+            raise IndexError('Row {0} is not in table with {1} fits.'
+                             .format(row, self._size))
+
+        self._columns[column][row % self._size] = value
+
+    def get_column(self, column):
+
+        """ Return NumPy array of column, see to_numpy(). """
+
+        return self._columns[column][:self._size]
+
+    def get_columns(self):
+
+        """ Return dictionary with NumPy array of every column, see
+        to_numpy(). """
+
+        return self.to_numpy()
+
+    def select(self, rows):
+
+        """ Return new FitTable with selected rows. rows is either a sequence
+        of row numbers or a sequence of booleans with one entry per row, e.g.
+        a NumPy mask like table.to_numpy()['mu'] > 50. """
+
+        # NumPy masks are turned into row numbers directly
+        if getattr(rows, 'dtype', None) is not None and rows.dtype.kind == 'b':
+            rows = rows.nonzero()[0]
+        rows = list(rows)
+        if rows and all(isinstance(row, bool) for row in rows):
+            rows = [idx for idx, row in enumerate(rows) if row]
+        rows = np.asarray(rows, dtype=np.intp)
+
+        return FitTable(OrderedDict((col, self.get_column(col)[rows])
+                                    for col in COLUMNS))
+
+    def to_numpy(self):
+
+        """ Return dictionary with NumPy array of every column. The arrays
+        are views on the table, so they see values set later; once fits are
+        appended and the table grows, they keep the values they had. """
+
+        return OrderedDict((col, self.get_column(col)) for col in COLUMNS)
+
+    def write_npz(self, s_npzfile):
+
+        """ Write table into *.npz file, with one array per column. """
+
+        np.savez(s_npzfile, **self.to_numpy())
+
+    @classmethod
+    def read_npz(cls, s_npzfile):
+
+        """ Return FitTable read from *.npz file written by write_npz(). Files
+        written before the columns in DEFAULTS existed can be read as well. """
+
+        with np.load(s_npzfile) as f_in:
+            return cls(dict((col, f_in[col]) for col in COLUMNS
+                            if col in f_in.files))
@@ -5,52 +5,125 @@ Author: Basil Schneider <basil.schneider@cern.ch>
 Make 2d maps of MPA, showing various fit characteristics.
 """
 
-from os import makedirs, getcwd, path, chdir
-from ROOT import TH2F, TFile, TCanvas, gStyle, gPad, gROOT
+from os import path
+from collections import OrderedDict
+from ROOT import TH2F, TCanvas, gStyle, gPad, gROOT
 from Logger import LGR
+from Instrumentation import timed
+from RootOutput import RootOutput
+from FitTable import FitTable
+from Geometry import Geometry
+from RenderQueue import save_pdf
 
 gROOT.SetBatch(True)
 
+# Quantities shown in 2d maps: column of FitTable, title and range of z axis
+# (None for automatic range)
+QUANTITIES = [('c', 'Constant', None),
+              ('c_err', 'Error on constant', None),
+              ('mu', 'Mean', (30, 170)),
+              ('mu_err', 'Error on mean', (0, 0.1)),
+              ('sigma', '#sigma', (1, 7)),
+              ('sigma_err', 'Error on #sigma', (0, 0.1)),
+              ('chi2', '#chi^{2}', (0e6, 50e6)),
+              ('ndf', 'NDF', None)]
+
+# Names of calibration stages, index is prefix
+PREFIXES = ['pre', 'post']
+
 class Floorplan(object):
 
-    """ Make 2d maps of MPA, showing various fit characteristics. """
+    """ Make 2d maps of MPA, showing various fit characteristics. There is
+    exactly one set of histograms per chip and prefix, which is updated in
+    place: only bins whose values changed are set again, and only maps which
+    changed are drawn, written and rendered again. """
 
-    def __init__(self):
+    def __init__(self, layout=None):
 
-        """ Initialize class variables. """
+        """ Initialize class variables. layout is the Geometry of the
+        assembly; if it is not given, the default geometry is used. """
 
         self._geometry = []
-        self._histogram_c = []
-        self._histogram_c_err = []
-        self._histogram_mu = []
-        self._histogram_mu_err = []
-        self._histogram_sigma = []
-        self._histogram_sigma_err = []
-        self._histogram_chi2 = []
-        self._histogram_ndf = []
+        self._index = []
         self._bins_x = 0
         self._bins_y = 0
         self.directory = '.'
         self.name = ''
         self.s_rootfile = ''
-        self._canvas = TCanvas()
-        self._map_c = [TCanvas(), TCanvas()]
-        self._map_c_err = [TCanvas(), TCanvas()]
-        self._map_mu = [TCanvas(), TCanvas()]
-        self._map_mu_err = [TCanvas(), TCanvas()]
-        self._map_sigma = [TCanvas(), TCanvas()]
-        self._map_sigma_err = [TCanvas(), TCanvas()]
-        self._map_chi2 = [TCanvas(), TCanvas()]
-        self._map_ndf = [TCanvas(), TCanvas()]
-        for idx in range(0, 2):
-            self._map_c[idx].Divide(3, 2)
-            self._map_c_err[idx].Divide(3, 2)
-            self._map_mu[idx].Divide(3, 2)
-            self._map_mu_err[idx].Divide(3, 2)
-            self._map_sigma[idx].Divide(3, 2)
-            self._map_sigma_err[idx].Divide(3, 2)
-            self._map_chi2[idx].Divide(3, 2)
-            self._map_ndf[idx].Divide(3, 2)
+
+        # RootOutput through which maps are written
+        self.output = None
+
+        # RenderQueue through which maps are rendered
+        self.renderer = None
+
+        # Canvas for maps of single chips, created when it is needed
+        self._canvas = None
+
+        # Combined maps of all chips, for pre and post calibration
+        if layout is None:
+            layout = Geometry()
+        self.set_layout(layout)
+
+    def set_layout(self, layout):
+
+        """ Set Geometry of assembly, which defines the pads of the combined
+        maps. Histograms and canvases of the previous layout are freed. """
+
+        self._layout = layout
+
+        # Histograms of every chip, keyed by (coordinate, prefix); every
+        # entry holds the geometry of the chip, one TH2F per quantity and the
+        # values filled per numbering
+        self._maps = {}
+
+        # Quantities which changed since they were written, per (coordinate,
+        # prefix) and for the combined maps per prefix
+        self._dirty = {}
+        self._dirty_combined = [set(), set()]
+
+        # Coordinates of chips already filled into combined maps
+        self._filled = [set(), set()]
+
+        # Canvases of combined maps, keyed by (column, prefix); they are
+        # only created when the first chip is drawn on them
+        self._combined = {}
+
+    def reset(self):
+
+        """ Forget all maps, so that the next fill of every chip makes and
+        writes its maps again, e.g. for another output ROOT file. """
+
+        self.set_layout(self._layout)
+
+    def _get_canvas(self):
+
+        """ Get canvas for maps of single chips, creating it if needed. """
+
+        if self._canvas is None:
+            self._canvas = TCanvas()
+
+        return self._canvas
+
+    def _get_combined(self, column, prefix):
+
+        """ Get canvas of combined map of column in prefix, with one pad per
+        chip, creating it if needed. """
+
+        canvas = self._combined.get((column, prefix))
+        if canvas is None:
+            name = 'map_{0}_{1}'.format(column, PREFIXES[prefix])
+            canvas = TCanvas(name, name)
+            canvas.Divide(self._layout.get_columns(), self._layout.get_rows())
+            self._combined[(column, prefix)] = canvas
+
+        return canvas
+
+    def get_layout(self):
+
+        """ Get Geometry of assembly. """
+
+        return self._layout
 
     def set_geometry(self, geometry, prefix):
 
@@ -62,7 +135,8 @@ class Floorplan(object):
         1 2 3
         4 5 6
 
-        Also creates a TH2F with the corresponding number of bins. """
+        The TH2Fs with the corresponding number of bins are created when the
+        maps of a chip are filled for the first time. """
 
         # Set geometry
         self._geometry = geometry
@@ -75,279 +149,217 @@ class Floorplan(object):
         # Get number of bins in y
         self._bins_y = len(geometry)
 
-        # Create histograms
-        if prefix == 0:
-            prefix_str = 'pre'
-        else:
-            prefix_str = 'post'
-
-        self._histogram_c.append(TH2F('c', 'Constant ({0})'.format(prefix_str),
-                                      self._bins_x, 0, self._bins_x,
-                                      self._bins_y, 0, self._bins_y))
-        self._histogram_c_err.append(TH2F('c_err', 'Error on constant ({0})'
-                                          .format(prefix_str),
-                                          self._bins_x, 0, self._bins_x,
-                                          self._bins_y, 0, self._bins_y))
-        self._histogram_mu.append(TH2F('mu', 'Mean ({0})'.format(prefix_str),
-                                       self._bins_x, 0, self._bins_x,
-                                       self._bins_y, 0, self._bins_y))
-        self._histogram_mu_err.append(TH2F('mu_err', 'Error on mean ({0})'
-                                           .format(prefix_str),
-                                           self._bins_x, 0, self._bins_x,
-                                           self._bins_y, 0, self._bins_y))
-        self._histogram_sigma.append(TH2F('sigma', '#sigma ({0})'
-                                          .format(prefix_str),
-                                          self._bins_x, 0, self._bins_x,
-                                          self._bins_y, 0, self._bins_y))
-        self._histogram_sigma_err.append(TH2F('sigma_err',
-                                              'Error on #sigma ({0})'
-                                              .format(prefix_str),
-                                              self._bins_x, 0, self._bins_x,
-                                              self._bins_y, 0, self._bins_y))
-        self._histogram_chi2.append(TH2F('chi2', '#chi^{{2}} ({0})'
-                                         .format(prefix_str),
-                                         self._bins_x, 0, self._bins_x,
-                                         self._bins_y, 0, self._bins_y))
-        self._histogram_ndf.append(TH2F('ndf', 'NDF ({0})'.format(prefix_str),
-                                        self._bins_x, 0, self._bins_x,
-                                        self._bins_y, 0, self._bins_y))
-
-    def _get_x(self, numbering):
-
-        """ Return x axis coordinate in TH2F for numbering. """
-
-        for subgeometry in self._geometry:
-            if numbering in subgeometry:
-                return subgeometry.index(numbering) + 0.5
-
-    def _get_y(self, numbering):
-
-        """ Return y axis coordinate in TH2F for numbering. """
+        # Lookup table from numbering to bin
+        self._build_index()
+
+    def _get_maps(self, coordinate, prefix):
+
+        """ Return maps of chip in prefix, creating them if the chip has no
+        maps yet or if its geometry changed. Superseded histograms are
+        freed. """
+
+        key = (coordinate, prefix)
+        maps = self._maps.get(key)
+        if maps is not None and maps['geometry'] == self._geometry:
+            return maps
+
+        # Superseded histograms are deleted once they are not referenced any
+        # more, which also removes them from the pads of the combined maps
+        if maps is not None:
+            LGR.debug('Geometry of chip {0} changed, replace its maps.'
+                      .format(coordinate))
+
+        histograms = OrderedDict()
+        for column, title, _ in QUANTITIES:
+            histogram = TH2F(column, '{0} ({1})'.format(title,
+                                                        PREFIXES[prefix]),
+                             self._bins_x, 0, self._bins_x,
+                             self._bins_y, 0, self._bins_y)
+            # Histograms are owned by the Floorplan, not by a directory
+            histogram.SetDirectory(0)
+            histograms[column] = histogram
+
+        maps = {'geometry': self._geometry,
+                'histograms': histograms,
+                'values': {}}
+        self._maps[key] = maps
+        self._cosmetics(histograms)
+
+        # Draw new histograms on pad of combined maps once; later updates
+        # only mark the pad as modified
+        pad = self._get_mpa_coordinate(coordinate)
+        for column, _, _ in QUANTITIES:
+            self._get_combined(column, prefix).cd(pad)
+            histograms[column].Draw('COLZ')
+            self._dirty_combined[prefix].add(column)
+        self._dirty[key] = set(histograms)
+
+        return maps
+
+    def _build_index(self):
+
+        """ Build dense lookup table from numbering to (x, y) bin in TH2F. """
+
+        numberings = [numbering for subgeometry in self._geometry
+                      for numbering in subgeometry]
+        self._index = [None]*(max(numberings)+1 if numberings else 0)
 
         for idx, subgeometry in enumerate(self._geometry):
-            if numbering in subgeometry:
+            for pos, numbering in enumerate(subgeometry):
                 # Subtract idx from number of bins in y, since we start
-                # counting from top; subtract 0.5 to hit bin center
-                return self._bins_y - idx - 0.5
+                # counting from top
+                self._index[numbering] = (pos+1, self._bins_y-idx)
+
+    def _get_bin(self, numbering):
+
+        """ Return (x, y) bin in TH2F for numbering. """
+
+        try:
+            bin_xy = self._index[numbering]
+        except IndexError:
+            bin_xy = None
+        if bin_xy is None or numbering < 0:
+            raise TypeError('Couldn\'t fill map for MPA number {0}. Maybe '
+                            'the geometry is not defined for this MPA?'
+                            .format(numbering))
+
+        return bin_xy
+
+    def get_histograms(self, coordinate, prefix):
+
+        """ Get OrderedDict with TH2F of every quantity of chip in prefix, or
+        None if the chip was not filled yet. """
+
+        maps = self._maps.get((coordinate, prefix))
+        if maps is None:
+            return None
+
+        return maps['histograms']
 
     def fill_maps(self, fits, coordinate, prefix):
 
-        """ Make 2d maps of one MPA. """
-
-        for fit in fits:
-            try:
-                numbering = fit.get_numbering()
-            except TypeError:
-                raise TypeError('Couldn\'t fill map for MPA number {0}. Maybe '
-                                'the geometry is not defined for this MPA?'
-                                .format(fit.get_numbering()))
-
-            self._histogram_c[-1].Fill(self._get_x(numbering),
-                                   self._get_y(numbering), fit.get_c())
-            self._histogram_c_err[-1].Fill(self._get_x(numbering),
-                                       self._get_y(numbering), fit.get_c_err())
-            self._histogram_mu[-1].Fill(self._get_x(numbering),
-                                    self._get_y(numbering), fit.get_mu())
-            self._histogram_mu_err[-1].Fill(self._get_x(numbering),
-                                        self._get_y(numbering), fit.get_mu_err())
-            self._histogram_sigma[-1].Fill(self._get_x(numbering),
-                                       self._get_y(numbering), fit.get_sigma())
-            self._histogram_sigma_err[-1].Fill(self._get_x(numbering),
-                                           self._get_y(numbering),
-                                           fit.get_sigma_err())
-            self._histogram_chi2[-1].Fill(self._get_x(numbering),
-                                      self._get_y(numbering), fit.get_chi2())
-            self._histogram_ndf[-1].Fill(self._get_x(numbering),
-                                     self._get_y(numbering), fit.get_ndf())
+        """ Make 2d maps of one MPA. fits is either a FitTable or a list of
+        ToolboxFits. Only bins whose values changed are updated. """
+
+        if not isinstance(fits, FitTable):
+            table = FitTable()
+            for fit in fits:
+                table.append(*fit.get_values())
+            fits = table
+
+        maps = self._get_maps(coordinate, prefix)
+        histograms = maps['histograms']
+        values = maps['values']
+        dirty = self._dirty.setdefault((coordinate, prefix), set())
+
+        columns = [fits.get_column(column) for column, _, _ in QUANTITIES]
+        for row, numbering in enumerate(fits.get_column('numbering')):
+            numbering = int(numbering)
+            bin_x, bin_y = self._get_bin(numbering)
+            new = tuple(column[row] for column in columns)
+            old = values.get(numbering)
+            if new == old:
+                continue
+            for idx, (column, _, _) in enumerate(QUANTITIES):
+                if old is None or new[idx] != old[idx]:
+                    histograms[column].SetBinContent(bin_x, bin_y, new[idx])
+                    dirty.add(column)
+            values[numbering] = new
+
+        for column in dirty:
+            histograms[column].SetEntries(len(values))
+        self._dirty_combined[prefix].update(dirty)
 
         self._draw_save(coordinate, prefix)
 
-    def _chdir(self, directory, rootfile):
+    def _save_pdf(self, canvas, filename, directory):
 
-        """ Change directory on file system and in ROOT file. """
+        """ Save canvas as *.pdf in directory; 2d maps are part of the
+        summary. """
 
-        # Change directory in rootfile
-        if not rootfile.GetDirectory(directory):
-            rootfile.mkdir(directory)
-        rootfile.cd(directory)
-
-        # Change directory on filesystem
-        if not path.exists(directory):
-            makedirs(directory)
-        chdir(directory)
+        filename = path.join(directory, filename)
+        if self.renderer is not None:
+            self.renderer.add(canvas, filename, summary=True)
+        else:
+            save_pdf(canvas, filename)
 
+    @timed('Floorplan._draw_save')
     def _draw_save(self, coordinate, prefix):
 
-        """ Draw and save map in TFile and as *.pdf. """
+        """ Draw and save maps of chip which changed in TFile and as *.pdf.
+        """
 
-        self._canvas = TCanvas()
         gStyle.SetOptStat(0000000)
 
-        # Open TFile
-        rootfile = TFile(self.s_rootfile, 'UPDATE')
-
-        cwd = getcwd()
-
-        # Go into directory if it is defined
-        if self.directory:
-            self._chdir(self.directory, rootfile)
-
-        self._cosmetics()
-
-        self._canvas.cd()
-        #self._histogram_c[-1].GetZaxis().SetRangeUser(6000, 10000)
-        self._histogram_c[-1].Draw('COLZ')
-        self._canvas.SaveAs('{0}_c.pdf'.format(self.name))
-        self._histogram_c[-1].Write()
-        self._map_c[prefix].cd(self._get_mpa_coordinate(coordinate))
-        self._histogram_c[-1].Draw('COLZ')
-
-        self._canvas.cd()
-        #self._histogram_c_err[-1].GetZaxis().SetRangeUser(0, 300)
-        self._histogram_c_err[-1].Draw('COLZ')
-        self._canvas.SaveAs('{0}_c_err.pdf'.format(self.name))
-        self._histogram_c_err[-1].Write()
-        self._map_c_err[prefix].cd(self._get_mpa_coordinate(coordinate))
-        self._histogram_c_err[-1].Draw('COLZ')
-
-        self._canvas.cd()
-        self._histogram_mu[-1].GetZaxis().SetRangeUser(30, 170)
-        self._histogram_mu[-1].Draw('COLZ')
-        self._canvas.SaveAs('{0}_mu.pdf'.format(self.name))
-        self._histogram_mu[-1].Write()
-        self._map_mu[prefix].cd(self._get_mpa_coordinate(coordinate))
-        self._histogram_mu[-1].Draw('COLZ')
-
-        self._canvas.cd()
-        self._histogram_mu_err[-1].GetZaxis().SetRangeUser(0, 0.1)
-        self._histogram_mu_err[-1].Draw('COLZ')
-        self._canvas.SaveAs('{0}_mu_err.pdf'.format(self.name))
-        self._histogram_mu_err[-1].Write()
-        self._map_mu_err[prefix].cd(self._get_mpa_coordinate(coordinate))
-        self._histogram_mu_err[-1].Draw('COLZ')
-
-        self._canvas.cd()
-        self._histogram_sigma[-1].GetZaxis().SetRangeUser(1, 7)
-        self._histogram_sigma[-1].Draw('COLZ')
-        self._canvas.SaveAs('{0}_sigma.pdf'.format(self.name))
-        self._histogram_sigma[-1].Write()
-        self._map_sigma[prefix].cd(self._get_mpa_coordinate(coordinate))
-        self._histogram_sigma[-1].Draw('COLZ')
-
-        self._canvas.cd()
-        self._histogram_sigma_err[-1].GetZaxis().SetRangeUser(0, 0.1)
-        self._histogram_sigma_err[-1].Draw('COLZ')
-        self._canvas.SaveAs('{0}_sigma_err.pdf'.format(self.name))
-        self._histogram_sigma_err[-1].Write()
-        self._map_sigma_err[prefix].cd(self._get_mpa_coordinate(coordinate))
-        self._histogram_sigma_err[-1].Draw('COLZ')
-
-        self._canvas.cd()
-        self._histogram_chi2[-1].GetZaxis().SetRangeUser(0e6, 50e6)
-        self._histogram_chi2[-1].Draw('COLZ')
-        self._canvas.SaveAs('{0}_chi2.pdf'.format(self.name))
-        self._histogram_chi2[-1].Write()
-        self._map_chi2[prefix].cd(self._get_mpa_coordinate(coordinate))
-        self._histogram_chi2[-1].Draw('COLZ')
-
-        self._canvas.cd()
-        self._histogram_ndf[-1].Draw('COLZ')
-        self._canvas.SaveAs('{0}_ndf.pdf'.format(self.name))
-        self._histogram_ndf[-1].Write()
-        self._map_ndf[prefix].cd(self._get_mpa_coordinate(coordinate))
-        self._histogram_ndf[-1].Draw('COLZ')
-
-        # Go back to original working directories
-        if self.directory:
-            rootfile.cd()
-            chdir(cwd)
-
-        # Save complete map when coordinate is 5;
-        # this is not completely sane, but good enough
-        if coordinate == 5:
-            self._chdir('{0}/all'
-                        .format('/'.join(self.directory.split('/')[:-1])),
-                        rootfile)
-            for idx in range(0, 2):
-                if idx == 0:
-                    prefix = 'pre'
-                else:
-                    prefix = 'post'
-                self._map_c[idx].Write()
-                self._map_c[idx].SaveAs('{0}_all_{1}_c.pdf'
-                                        .format(self.name, prefix))
-                self._map_c_err[idx].Write()
-                self._map_c_err[idx].SaveAs('{0}_all_{1}_c_err.pdf'
-                                            .format(self.name, prefix))
-                self._map_mu[idx].Write()
-                self._map_mu[idx].SaveAs('{0}_all_{1}_mu.pdf'
-                                         .format(self.name, prefix))
-                self._map_mu_err[idx].Write()
-                self._map_mu_err[idx].SaveAs('{0}_all_{1}_mu_err.pdf'
-                                             .format(self.name, prefix))
-                self._map_sigma[idx].Write()
-                self._map_sigma[idx].SaveAs('{0}_all_{1}_sigma.pdf'
-                                            .format(self.name, prefix))
-                self._map_sigma_err[idx].Write()
-                self._map_sigma_err[idx].SaveAs('{0}_all_{1}_sigma_err.pdf'
-                                                .format(self.name, prefix))
-                self._map_chi2[idx].Write()
-                self._map_chi2[idx].SaveAs('{0}_all_{1}_chi2.pdf'
-                                           .format(self.name, prefix))
-                self._map_ndf[idx].Write()
-                self._map_ndf[idx].SaveAs('{0}_all_{1}_ndf.pdf'
-                                          .format(self.name, prefix))
-
-            # Go back to original working directories
-            if self.directory:
-                rootfile.cd()
-                chdir(cwd)
-
-        # Close TFile
-        rootfile.Close()
+        # Write maps through output of owner; without one, open and close
+        # the ROOT file at the end
+        output = self.output
+        if output is None:
+            output = RootOutput(self.s_rootfile)
+
+        histograms = self._maps[(coordinate, prefix)]['histograms']
+        dirty = self._dirty.pop((coordinate, prefix), set())
+        pad = self._get_mpa_coordinate(coordinate)
+        for column, _, _ in QUANTITIES:
+            if column not in dirty:
+                continue
+            histogram = histograms[column]
+            canvas = self._get_canvas()
+            canvas.cd()
+            histogram.Draw('COLZ')
+            self._save_pdf(canvas, '{0}_{1}.pdf'.format(self.name, column),
+                           self.directory)
+            output.write(histogram, self.directory, overwrite=True)
+            self._get_combined(column, prefix).GetPad(pad).Modified()
+
+        # Save combined map once all chips of the assembly are filled
+        self._filled[prefix].add(coordinate)
+        if self._filled[prefix].issuperset(self._layout.get_chips()):
+            self._save_combined(prefix, output)
+
+        if self.output is None:
+            output.close()
+
+    def _save_combined(self, idx, output):
+
+        """ Draw and save combined maps of all chips which changed in TFile
+        and as *.pdf. """
+
+        directory_all = '{0}/all'.format(
+            '/'.join(self.directory.split('/')[:-1]))
+        for column, _, _ in QUANTITIES:
+            if column not in self._dirty_combined[idx]:
+                continue
+            canvas = self._get_combined(column, idx)
+            canvas.Update()
+            output.write(canvas, directory_all, overwrite=True)
+            self._save_pdf(canvas, '{0}_all_{1}_{2}.pdf'
+                           .format(self.name, PREFIXES[idx], column),
+                           directory_all)
+
+        self._dirty_combined[idx] = set()
 
     def _get_mpa_coordinate(self, coordinate):
 
-        """ Return physical coordinate of MPA on MaPSA assembly. """
-
-        if coordinate == 0:
-            return 1
-        if coordinate == 1:
-            return 2
-        if coordinate == 2:
-            return 3
-        if coordinate == 3:
-            return 6
-        if coordinate == 4:
-            return 5
-        if coordinate == 5:
-            return 4
-        else:
-            return -1
+        """ Return physical coordinate of MPA on assembly, i.e. its pad on the
+        combined maps. """
+
+        return self._layout.get_pad(coordinate)
 
-    def _cosmetics(self):
+    def _cosmetics(self, histograms):
 
         """ Do cosmetics on 2d maps. """
 
-        # Set 16 ticks on x axis and 3 ticks on y axis
-        self._histogram_c[-1].GetXaxis().SetNdivisions(16, 0, 0)
-        self._histogram_c[-1].GetYaxis().SetNdivisions(3, 0, 0)
-        self._histogram_c_err[-1].GetXaxis().SetNdivisions(16, 0, 0)
-        self._histogram_c_err[-1].GetYaxis().SetNdivisions(3, 0, 0)
-        self._histogram_mu[-1].GetXaxis().SetNdivisions(16, 0, 0)
-        self._histogram_mu[-1].GetYaxis().SetNdivisions(3, 0, 0)
-        self._histogram_mu_err[-1].GetXaxis().SetNdivisions(16, 0, 0)
-        self._histogram_mu_err[-1].GetYaxis().SetNdivisions(3, 0, 0)
-        self._histogram_sigma[-1].GetXaxis().SetNdivisions(16, 0, 0)
-        self._histogram_sigma[-1].GetYaxis().SetNdivisions(3, 0, 0)
-        self._histogram_sigma_err[-1].GetXaxis().SetNdivisions(16, 0, 0)
-        self._histogram_sigma_err[-1].GetYaxis().SetNdivisions(3, 0, 0)
-        self._histogram_chi2[-1].GetXaxis().SetNdivisions(16, 0, 0)
-        self._histogram_chi2[-1].GetYaxis().SetNdivisions(3, 0, 0)
-        self._histogram_ndf[-1].GetXaxis().SetNdivisions(16, 0, 0)
-        self._histogram_ndf[-1].GetYaxis().SetNdivisions(3, 0, 0)
+        for column, _, z_range in QUANTITIES:
+            histogram = histograms[column]
 
-        # Make ticks cross whole grid
-        #self._histogram_sigma[-1].GetXaxis().SetTickLength(1.)
-        #self._histogram_sigma[-1].GetYaxis().SetTickLength(1.)
+            # Set one tick per pixel on x and y axis
+            histogram.GetXaxis().SetNdivisions(self._bins_x, 0, 0)
+            histogram.GetYaxis().SetNdivisions(self._bins_y, 0, 0)
 
+            if z_range is not None:
+                histogram.GetZaxis().SetRangeUser(*z_range)
+
+        # Make ticks cross whole grid
+        #histograms['sigma'].GetXaxis().SetTickLength(1.)
+        #histograms['sigma'].GetYaxis().SetTickLength(1.)
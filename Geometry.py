@@ -0,0 +1,103 @@
+#!/usr/bin/env python2
+
+""" Declarative description of an assembly of chips, loaded from a JSON file.
+Every chip has a coordinate, which identifies it in the analysis, a pad, which
+is its position on the combined map, and a pixel grid, given as list of rows
+from top to bottom. Every row is a [start, stop, step] range of pixel numbers,
+so the orientation of a chip is given by the direction of its ranges. """
+
+import json
+from os import path
+from ToolboxHelper import check_if_file_exists
+
+# Geometry of MaPSA assembly with 3x2 MPAs, used by default
+DEFAULT_GEOMETRY = path.join(path.dirname(path.abspath(__file__)),
+                             'mapsa.json')
+
+
+class Geometry(object):
+
+    """ Declarative description of an assembly of chips. """
+
+    def __init__(self, s_geometryfile=DEFAULT_GEOMETRY):
+
+        """ Initialize object variables from geometry file. """
+
+        check_if_file_exists(s_geometryfile)
+        with open(s_geometryfile) as f_in:
+            description = json.load(f_in)
+
+        self.s_geometryfile = s_geometryfile
+        self.name = description.get('name', '')
+        self._columns = int(description['layout']['columns'])
+        self._rows = int(description['layout']['rows'])
+
+        # Chips, keyed by coordinate
+        self._chips = {}
+        for chip in description['chips']:
+            coordinate = int(chip['coordinate'])
+            if coordinate in self._chips:
+                raise ValueError('Chip {0} is defined twice in {1}.'
+                                 .format(coordinate, s_geometryfile))
+            pad = int(chip['pad'])
+            if pad not in range(1, self._columns*self._rows+1):
+                raise ValueError('Pad {0} of chip {1} is outside of the '
+                                 '{2}x{3} layout in {4}.'
+                                 .format(pad, coordinate, self._columns,
+                                         self._rows, s_geometryfile))
+            self._chips[coordinate] = {
+                'pad': pad,
+                'pixels': [list(range(*row)) for row in chip['pixels']]}
+
+    def get_chips(self):
+
+        """ Get sorted list of coordinates of all chips. """
+
+        return sorted(self._chips)
+
+    def get_pixels(self, coordinate):
+
+        """ Get pixel grid of chip, as list of rows of pixel numbers. """
+
+        return self._get_chip(coordinate)['pixels']
+
+    def get_numbering(self, coordinate=None):
+
+        """ Get sorted list of pixel numbers of chip, or of all chips if
+        coordinate is None. """
+
+        if coordinate is not None:
+            chips = [self._get_chip(coordinate)]
+        else:
+            chips = self._chips.values()
+
+        return sorted(set(pixel for chip in chips
+                          for row in chip['pixels'] for pixel in row))
+
+    def get_pad(self, coordinate):
+
+        """ Get pad of chip on combined map. """
+
+        return self._get_chip(coordinate)['pad']
+
+    def get_columns(self):
+
+        """ Get number of columns of combined map. """
+
+        return self._columns
+
+    def get_rows(self):
+
+        """ Get number of rows of combined map. """
+
+        return self._rows
+
+    def _get_chip(self, coordinate):
+
+        """ Get description of chip, raise error if it is not defined. """
+
+        try:
+            return self._chips[coordinate]
+        except KeyError:
+            raise ValueError('Chip {0} is not defined in geometry {1}.'
+                             .format(coordinate, self.s_geometryfile))
@@ -0,0 +1,264 @@
+#!/usr/bin/env python2
+
+""" Read measurement TGraphs of a calibration file into NumPy arrays without
+PyROOT. Calibration files are read with uproot 3, the last version which
+supports Python 2, or from a columnar cache in a *.npz file made with
+write_npz(); PyROOT is only used if neither is available. """
+
+import numpy as np
+from Logger import LGR
+from ToolboxHelper import check_if_file_exists
+
+
+def _load_uproot():
+
+    """ Return uproot 3 module, or None if it is not installed. Newer
+    versions have another interface and are also not used. """
+
+    try:
+        import uproot  # pylint: disable=import-error
+    except ImportError:
+        return None
+
+    version = getattr(uproot, '__version__', '')
+    if version.split('.')[0] != '3':
+        LGR.info('uproot {0} is not supported, only uproot 3.'
+                 .format(version))
+        return None
+
+    return uproot
+
+
+class GraphReader(object):
+
+    """ Read measurement TGraphs of a calibration file into NumPy arrays.
+    All TGraphs of a file are read at once and kept, selections are served
+    from memory. """
+
+    def __init__(self, path_file):
+
+        """ Initialize object variables. """
+
+        self._path = path_file
+
+        # Pixel numbers and 2d (pixels x thresholds) arrays of all TGraphs
+        self._numbering = None
+        self._x = None
+        self._y = None
+
+    def get_path(self):
+
+        """ Get path of calibration file. """
+
+        return self._path
+
+    def get_available_graphs(self):
+
+        """ Get sorted list of pixel numbers of all measurement TGraphs in the
+        file. """
+
+        self._load()
+
+        return [int(numbering) for numbering in self._numbering]
+
+    def read(self, pixels):
+
+        """ Return pixel numbers and 2d arrays of x and y values of the
+        measurements of pixels, one row per pixel. """
+
+        self._load()
+        selection = self._get_rows(pixels)
+
+        return list(pixels), self._x[selection], self._y[selection]
+
+    def write_store(self, store, pixels):
+
+        """ Create CurveStore for pixels and write x values and measurements
+        into it. TGraphs are read one by one and written straight into their
+        rows, so the file is never held in memory as a whole; of a columnar
+        cache, only one array is loaded at a time. If the reader holds the
+        arrays of the file already, they are copied and released. """
+
+        pixels = list(pixels)
+        if self._numbering is not None:
+            selection = self._get_rows(pixels)
+            store.create(pixels, self._x.shape[1])
+            self._write_rows(store, 'x', selection, self._x)
+            self._write_rows(store, 'measurements', selection, self._y)
+            self.release()
+            return
+
+        check_if_file_exists(self._path)
+        if self._path.endswith('.npz'):
+            LGR.info('Write TGraphs from columnar cache {0} into curve '
+                     'store.'.format(self._path))
+            with np.load(self._path) as f_in:
+                selection = self._get_rows(pixels, f_in['numbering'])
+                a_x = f_in['x']
+                store.create(pixels, a_x.shape[1])
+                self._write_rows(store, 'x', selection, a_x)
+                del a_x
+                self._write_rows(store, 'measurements', selection,
+                                 f_in['y'])
+            return
+
+        rows = dict((pixel, row) for row, pixel in enumerate(pixels))
+        filled = set()
+        for pixel, a_x, a_y in self._iter_graphs(set(pixels)):
+            if not filled:
+                store.create(pixels, len(a_x))
+                plane_x = store.get_plane('x')
+                plane_y = store.get_plane('measurements')
+            if len(a_x) != plane_x.shape[1]:
+                raise ValueError('TGraphs in {0} don\'t have the same number '
+                                 'of points.'.format(self._path))
+            plane_x[rows[pixel]] = a_x
+            plane_y[rows[pixel]] = a_y
+            filled.add(pixel)
+
+        missing = [pixel for pixel in pixels if pixel not in filled]
+        if missing:
+            raise ValueError('No TGraphs for pixels {0} in {1}.'
+                             .format(missing, self._path))
+
+    def _write_rows(self, store, plane, selection, values):
+
+        """ Write rows selection of 2d array values into plane of CurveStore,
+        one row after the other. """
+
+        a_plane = store.get_plane(plane)
+        for row_store, row in enumerate(selection):
+            a_plane[row_store] = values[row]
+
+    def release(self):
+
+        """ Free arrays of all TGraphs; they are loaded again when they are
+        needed. """
+
+        self._numbering = None
+        self._x = None
+        self._y = None
+
+    def _get_rows(self, pixels, numbering=None):
+
+        """ Return rows of pixels in arrays with pixel numbers numbering, by
+        default the ones of the reader. """
+
+        if numbering is None:
+            numbering = self._numbering
+        rows = dict((int(number), row)
+                    for row, number in enumerate(numbering))
+        missing = [pixel for pixel in pixels if pixel not in rows]
+        if missing:
+            raise ValueError('No TGraphs for pixels {0} in {1}.'
+                             .format(missing, self._path))
+
+        return [rows[pixel] for pixel in pixels]
+
+    def write_npz(self, s_npzfile):
+
+        """ Write all TGraphs of the file into a columnar cache, which can be
+        read by a GraphReader without uproot or PyROOT. """
+
+        self._load()
+        np.savez(s_npzfile, numbering=self._numbering, x=self._x, y=self._y)
+        LGR.info('Wrote {0} TGraphs of {1} into {2}.'
+                 .format(len(self._numbering), self._path, s_npzfile))
+
+    def _load(self):
+
+        """ Load all TGraphs of file, unless they are loaded already. """
+
+        if self._numbering is not None:
+            return
+
+        check_if_file_exists(self._path)
+        if self._path.endswith('.npz'):
+            LGR.info('Load TGraphs from columnar cache {0}.'
+                     .format(self._path))
+            with np.load(self._path) as f_in:
+                self._set(f_in['numbering'], f_in['x'], f_in['y'])
+            return
+
+        points = dict((pixel, (a_x, a_y))
+                      for pixel, a_x, a_y in self._iter_graphs())
+        numbering = sorted(points)
+        lengths = set(len(points[pixel][0]) for pixel in numbering)
+        if len(lengths) > 1:
+            raise ValueError('TGraphs in {0} don\'t have the same number of '
+                             'points: {1}.'.format(self._path,
+                                                   sorted(lengths)))
+
+        self._set(numbering, [points[pixel][0] for pixel in numbering],
+                  [points[pixel][1] for pixel in numbering])
+
+    def _set(self, numbering, a_x, a_y):
+
+        """ Set pixel numbers and 2d arrays of x and y values. """
+
+        self._numbering = np.asarray(numbering, dtype=int)
+        self._x = np.asarray(a_x, dtype=float).reshape(len(numbering), -1)
+        self._y = np.asarray(a_y, dtype=float).reshape(len(numbering), -1)
+
+    def _iter_graphs(self, pixels=None):
+
+        """ Yield (pixel, x, y) of the measurement TGraphs of pixels in the
+        calibration file, or of all of them with None, one by one. """
+
+        uproot = _load_uproot()
+        if uproot is not None:
+            LGR.info('Load TGraphs from {0} with uproot.'.format(self._path))
+            return self._iter_uproot(uproot, pixels)
+
+        LGR.info('uproot 3 is not available, load TGraphs from {0} with '
+                 'PyROOT.'.format(self._path))
+        return self._iter_root(pixels)
+
+    def _iter_uproot(self, uproot, pixels):
+
+        """ Yield (pixel, x, y) of TGraphs of pixels, read with uproot. """
+
+        f_in = uproot.open(self._path)
+
+        # Keys are byte strings name;cycle; without cycle, the latest one is
+        # read
+        names = set(key.decode('utf-8').split(';')[0] for key in f_in.keys(
+            filterclass=lambda cls: cls.__name__ == 'TGraph'))
+
+        for name in sorted(names):
+            # Measurement TGraphs are named after their pixel number
+            if not name.isdigit():
+                continue
+            if pixels is not None and int(name) not in pixels:
+                continue
+            graph = f_in[name]
+            yield (int(name), np.asarray(graph.xvalues, dtype=float),
+                   np.asarray(graph.yvalues, dtype=float))
+
+    def _iter_root(self, pixels):
+
+        """ Yield (pixel, x, y) of TGraphs of pixels, read with PyROOT. """
+
+        from ROOT import TFile, TGraph  # pylint: disable=import-error
+
+        f_in = TFile(self._path, 'READ')
+        if f_in.IsZombie():
+            raise IOError('Couldn\'t open ROOT file {0}.'.format(self._path))
+
+        try:
+            for name in sorted(set(key.GetName()
+                                   for key in f_in.GetListOfKeys())):
+                if not name.isdigit():
+                    continue
+                if pixels is not None and int(name) not in pixels:
+                    continue
+                graph = f_in.Get(name)
+                if isinstance(graph, TGraph):
+                    n_points = graph.GetN()
+                    yield (int(name),
+                           np.fromiter(graph.GetX(), dtype=float,
+                                       count=n_points),
+                           np.fromiter(graph.GetY(), dtype=float,
+                                       count=n_points))
+        finally:
+            f_in.Close()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python2
+
+""" Timers and counters to see where time and memory of a run go. Stages are
+timed with the context manager INS.timer(name) or the decorator timed(name),
+counters are increased with INS.count(name, value). Optionally, every
+outermost stage is profiled with cProfile and its peak memory is traced with
+tracemalloc, or, where tracemalloc is not available as with Python 2, taken
+from the growth of the maximum resident set size. """
+
+import json
+import cProfile
+from os import getpid, path, makedirs
+from functools import wraps
+from contextlib import contextmanager
+from timeit import default_timer
+from Logger import LGR
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def _get_max_rss():
+
+    """ Get maximum resident set size of the current process in bytes. """
+
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+
+class Instrumentation(object):
+
+    """ Timers and counters to see where time and memory of a run go. """
+
+    def __init__(self):
+
+        """ Initialize object variables. """
+
+        self._profile_dir = ''
+        self._trace_memory = False
+        self._tracemalloc = None
+        self.reset()
+
+    def reset(self):
+
+        """ Reset all timers, counters and profiles. """
+
+        # Per stage: number of calls, total time in seconds and peak of
+        # traced memory in bytes
+        self._timers = {}
+        self._counters = {}
+        self._profiles = {}
+        self._stack = []
+
+    def set_profiling(self, profile_dir):
+
+        """ Profile every outermost stage with cProfile and write the
+        profiles to profile_dir when write_profiles() is called. With an
+        empty profile_dir, profiling is switched off. """
+
+        self._profile_dir = profile_dir
+
+    def set_memory_tracing(self, trace_memory):
+
+        """ Trace peak memory of every outermost stage with tracemalloc. If
+        tracemalloc is not available, which is the case with Python 2, the
+        peak memory of a stage is how much it grew the maximum resident set
+        size. This misses memory which stays below the maximum of an earlier
+        stage, but needs no tracing. """
+
+        if trace_memory and self._tracemalloc is None:
+            try:
+                import tracemalloc
+                self._tracemalloc = tracemalloc
+            except ImportError:
+                if resource is None:
+                    LGR.warning('Neither tracemalloc nor resource are '
+                                'available, memory is not traced.')
+                    return
+
+        self._trace_memory = trace_memory
+
+    @contextmanager
+    def timer(self, name):
+
+        """ Time block as stage name. Nested stages are timed as well, but
+        only outermost stages are profiled and traced. """
+
+        outermost = not self._stack
+        self._stack.append(name)
+
+        profile = None
+        if outermost and self._profile_dir:
+            profile = self._profiles.setdefault(name, cProfile.Profile())
+            profile.enable()
+        tracing = outermost and self._trace_memory
+        memory_start = 0
+        if tracing and self._tracemalloc is None:
+            memory_start = _get_max_rss()
+        elif tracing:
+            if not self._tracemalloc.is_tracing():
+                self._tracemalloc.start()
+            # reset_peak only exists since Python 3.9
+            if hasattr(self._tracemalloc, 'reset_peak'):
+                self._tracemalloc.reset_peak()
+                memory_start = self._tracemalloc.get_traced_memory()[0]
+            else:
+                self._tracemalloc.clear_traces()
+
+        start = default_timer()
+        try:
+            yield
+        finally:
+            elapsed = default_timer()-start
+            if profile is not None:
+                profile.disable()
+            peak = 0
+            if tracing and self._tracemalloc is None:
+                peak = _get_max_rss()-memory_start
+            elif tracing:
+                peak = self._tracemalloc.get_traced_memory()[1] - \
+                    memory_start
+            self._stack.pop()
+
+            timer = self._timers.setdefault(name, {'calls': 0,
+                                                   'seconds': 0.,
+                                                   'peak_memory': 0})
+            timer['calls'] += 1
+            timer['seconds'] += elapsed
+            timer['peak_memory'] = max(timer['peak_memory'], peak)
+
+    def count(self, name, value=1):
+
+        """ Increase counter name by value. """
+
+        self._counters[name] = self._counters.get(name, 0)+value
+
+    def get_stats(self):
+
+        """ Get dictionary with timers and counters, e.g. to send them from a
+        worker process to the main process. """
+
+        stats = {'timers': dict((name, dict(timer))
+                                for name, timer in self._timers.items()),
+                 'counters': dict(self._counters)}
+        if resource is not None:
+            # Maximum resident set size, in kB on Linux
+            stats['max_rss_kb'] = \
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        return stats
+
+    def merge(self, stats):
+
+        """ Add timers and counters of stats, e.g. from a worker process. """
+
+        for name, other in stats['timers'].items():
+            timer = self._timers.setdefault(name, {'calls': 0,
+                                                   'seconds': 0.,
+                                                   'peak_memory': 0})
+            timer['calls'] += other['calls']
+            timer['seconds'] += other['seconds']
+            timer['peak_memory'] = max(timer['peak_memory'],
+                                       other['peak_memory'])
+        for name, value in stats['counters'].items():
+            self.count(name, value)
+
+    def write_profiles(self):
+
+        """ Write cProfile profile of every stage into profile directory, as
+        <stage>.<pid>.prof, which can be read with pstats. """
+
+        if not self._profile_dir or not self._profiles:
+            return
+
+        if not path.exists(self._profile_dir):
+            makedirs(self._profile_dir)
+        for name, profile in self._profiles.items():
+            profile.dump_stats(path.join(self._profile_dir, '{0}.{1}.prof'
+                                         .format(name, getpid())))
+        LGR.info('Wrote {0} profiles into {1}.'
+                 .format(len(self._profiles), self._profile_dir))
+        self._profiles = {}
+
+    def get_summary(self):
+
+        """ Get summary table of timers and counters as string. """
+
+        lines = ['{0:<32} {1:>7} {2:>11} {3:>11} {4:>10}'
+                 .format('Stage', 'Calls', 'Total [s]', 'Mean [s]',
+                         'Peak [MB]')]
+        for name, timer in sorted(self._timers.items(),
+                                  key=lambda item: -item[1]['seconds']):
+            lines.append('{0:<32} {1:>7} {2:>11.3f} {3:>11.4f} {4:>10.1f}'
+                         .format(name, timer['calls'], timer['seconds'],
+                                 timer['seconds']/max(timer['calls'], 1),
+                                 timer['peak_memory']/1024.**2))
+        for name, value in sorted(self._counters.items()):
+            lines.append('{0:<32} {1:>7}'.format(name, value))
+
+        return '\n'.join(lines)
+
+    def log_summary(self):
+
+        """ Log summary table of timers and counters. """
+
+        LGR.info('Summary of run:\n{0}'.format(self.get_summary()))
+
+    def dump(self, s_jsonfile):
+
+        """ Write timers and counters into JSON file. """
+
+        with open(s_jsonfile, 'w') as f_out:
+            json.dump(self.get_stats(), f_out, indent=2, sort_keys=True)
+        LGR.info('Wrote statistics of run to {0}.'.format(s_jsonfile))
+
+
+# Instrumentation of the current process, to be imported by other modules
+INS = Instrumentation()
+
+
+def timed(name):
+
+    """ Decorator timing every call of a function as stage name. """
+
+    def decorator(function):
+
+        """ Wrap function in timer. """
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+
+            """ Call function in timer. """
+
+            with INS.timer(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
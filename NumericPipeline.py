@@ -0,0 +1,196 @@
+#!/usr/bin/env python2
+
+""" Numeric part of the S-curve analysis without PyROOT: read measurements
+with a GraphReader, integrate and normalize them to S-curves and fit them with
+a ToolboxArray. There are no plots and no ROOT output, only fits, so ROOT is
+never imported if the GraphReader doesn't need it. """
+
+from Logger import LGR
+from Instrumentation import INS, timed
+from FitTable import FitTable
+from GraphReader import GraphReader
+from ToolboxArray import ToolboxArray
+from CurveStore import CurveStore
+from Geometry import Geometry
+from ToolboxHelper import check_if_object
+
+
+class NumericPipeline(object):
+
+    """ Numeric part of the S-curve analysis without PyROOT. Stages have the
+    same names as in SCurve. """
+
+    def __init__(self, path):
+
+        """ Initialize class variables. path is a calibration file or a
+        columnar cache written by GraphReader.write_npz(). """
+
+        self._reader = GraphReader(path)
+
+        # Geometry of assembly, which defines the pixel numbers
+        self._geometry = Geometry()
+
+        # List of pixels which are processed
+        # This can be any combination of pixel numbers of the Geometry
+        self._s_graphs = self._geometry.get_numbering()
+
+        self._array = ToolboxArray()
+        self._fits = FitTable()
+
+        # With 'batch', fits are made with a BatchFitter, with 'estimate',
+        # Gaussian parameters are only estimated
+        self._fit_mode = 'batch'
+        self._shared_sigma = False
+
+        # Prefix of memory-mapped CurveStore holding the curves; curves are
+        # kept in memory if empty
+        self._store_prefix = ''
+
+    def get_graphs(self):
+
+        """ Get list of pixels which are processed. """
+
+        return self._s_graphs
+
+    def set_graphs(self, graphs):
+
+        """ Set list of pixels which are processed. This can be any
+        combination of pixel numbers of the Geometry of the assembly.
+        Whenever this is done, the arrays and fits are reset. """
+
+        # Make sure that graphs is a list
+        check_if_object(graphs, list)
+
+        # Filter out all numbers which are not pixels of the assembly
+        valid = set(self._geometry.get_numbering())
+        self._s_graphs = [graph for graph in graphs if graph in valid]
+
+        self._array = ToolboxArray()
+        self._fits = FitTable()
+
+    def set_geometry_file(self, s_geometryfile):
+
+        """ Set file with Geometry of assembly, which defines the pixel
+        numbers. """
+
+        self._geometry = Geometry(s_geometryfile)
+
+    def get_fit_mode(self):
+
+        """ Get fit mode. """
+
+        return self._fit_mode
+
+    def set_fit_mode(self, fit_mode):
+
+        """ Set fit mode: with batch, all pixels are fitted at once with a
+        BatchFitter; with estimate, Gaussian parameters are estimated from
+        the peak region, like the array backend of SCurve does. """
+
+        if fit_mode not in ['batch', 'estimate']:
+            raise ValueError('Unknown fit mode {0}, use either batch or '
+                             'estimate.'.format(fit_mode))
+
+        self._fit_mode = fit_mode
+
+    def set_shared_sigma(self, shared_sigma):
+
+        """ Set whether all pixels share sigma in batch fits. """
+
+        self._shared_sigma = bool(shared_sigma)
+
+    def set_store(self, prefix):
+
+        """ Keep measurements, integrated curves and S-curves in a
+        memory-mapped CurveStore in
+        <prefix>.dat and <prefix>.json instead of in memory. This is meant
+        for campaigns with too many pixels to keep all curves in memory. With
+        an empty prefix, curves are kept in memory. """
+
+        self._store_prefix = prefix
+
+    @timed('NumericPipeline.retrieve_graphs')
+    def retrieve_graphs(self):
+
+        """ Read measurements of selected pixels into arrays. """
+
+        LGR.info('Retrieve measurements from {0}.'
+                 .format(self._reader.get_path()))
+        if self._store_prefix:
+            store = CurveStore(self._store_prefix)
+            self._reader.write_store(store, self._s_graphs)
+            self._array.fill_store(store)
+        else:
+            _, a_x, a_y = self._reader.read(self._s_graphs)
+            self._array.fill_arrays(a_x, a_y)
+            self._array.fill_numbering(list(self._s_graphs))
+        INS.count('graphs_read', len(self._s_graphs))
+
+    @timed('NumericPipeline.make_s_curve')
+    def make_s_curve(self):
+
+        """ Integrate and normalize measurements to get S-curves. """
+
+        LGR.info('Integrate and normalize measurements to get S-curves.')
+        self._array.integrate_graphs()
+        self._array.normalize()
+
+    @timed('NumericPipeline.fit_gaussian')
+    def fit_gaussian(self):
+
+        """ Fit Gaussian on measurements. """
+
+        LGR.info('Fit Gaussian on measurements.')
+        if self._fit_mode == 'batch':
+            fits = self._array.fit_batch('gaus', self._get_groups())
+        else:
+            fits = self._array.fit('gaus')
+        self._fits.extend(fits.get_columns())
+        INS.count('fits', len(fits))
+
+    @timed('NumericPipeline.fit_scurve')
+    def fit_scurve(self):
+
+        """ Fit error function on normalized S-curves. """
+
+        LGR.info('Fit error function on S-curves.')
+        fits = self._array.fit_batch('erf', self._get_groups())
+        self._fits.extend(fits.get_columns())
+        INS.count('fits', len(fits))
+
+    def _get_groups(self):
+
+        """ Return groups of pixels sharing sigma in batch fits, or None if
+        every pixel has its own sigma. """
+
+        if not self._shared_sigma:
+            return None
+
+        return [0]*len(self._s_graphs)
+
+    def build_graphs(self, s_graphs, pixels):
+
+        """ Build TGraphs of measurements or S-curves of pixels, e.g. to draw
+        them. Only these TGraphs are built, which needs PyROOT. """
+
+        rows = dict((pixel, row) for row, pixel in enumerate(self._s_graphs))
+        missing = [pixel for pixel in pixels if pixel not in rows]
+        if missing:
+            raise ValueError('Pixels {0} are not processed.'.format(missing))
+
+        return self._array.get_graphs(s_graphs,
+                                      [rows[pixel] for pixel in pixels])
+
+    def get_fit_table(self):
+
+        """ Get FitTable with values of all fits. """
+
+        return self._fits
+
+    def write_fits(self, s_npzfile):
+
+        """ Write fits into *.npz file, see FitTable.write_npz(). """
+
+        self._fits.write_npz(s_npzfile)
+        LGR.info('Wrote {0} fits into {1}.'.format(len(self._fits),
+                                                    s_npzfile))
@@ -0,0 +1,291 @@
+#!/usr/bin/env python2
+
+""" Process the jobs of a Campaign while their calibration files are fetched
+from remote storage. Files are fetched ahead by threads, which only wait for
+I/O, while the fits run in worker processes, so fetching file N+1 overlaps
+with fitting file N. At most a given number of fetched files wait for a
+worker, and at most one job per worker is in flight, so a slow worker holds
+back fetching instead of filling the local disk. """
+
+import shutil
+import threading
+import traceback
+from os import path, makedirs, remove
+from time import sleep
+from timeit import default_timer
+from multiprocessing import Pool
+from Queue import Queue, Empty
+from Logger import LGR
+from Instrumentation import INS
+from ToolboxHelper import load_root
+
+
+def _run_job(args):
+
+    """ Process job with process function of (process, job) and return
+    (result, error), where error is the traceback of an exception, so that
+    the main process learns about failed jobs from the callback. This is a
+    module level function so that it can be sent to worker processes. """
+
+    process, job = args
+    try:
+        return process(job), None
+    except Exception:  # pylint: disable=broad-except
+        return None, traceback.format_exc()
+
+
+class LocalStore(object):
+
+    """ Stand-in for remote storage, backed by a local directory. Every fetch
+    copies the file and can be delayed by latency seconds, to emulate
+    network storage in tests. """
+
+    def __init__(self, directory, latency=0.):
+
+        """ Initialize object variables. """
+
+        self._directory = directory.rstrip('/')
+        self._latency = latency
+
+    def fetch(self, name, destination):
+
+        """ Copy file name of store to local path destination. """
+
+        if self._latency > 0:
+            sleep(self._latency)
+        source = path.join(self._directory, name)
+        if not path.isfile(source):
+            raise IOError('The file {0} does not exist.'.format(source))
+        shutil.copyfile(source, destination)
+
+
+class RootStore(object):
+
+    """ Remote storage read through ROOT, e.g. eos with root:// paths. """
+
+    def __init__(self, prefix=''):
+
+        """ Initialize object variables. prefix is put in front of the names
+        of files, e.g. root://eosuser.cern.ch//eos/user/... """
+
+        self._prefix = prefix
+
+    def fetch(self, name, destination):
+
+        """ Copy file name of store to local path destination. """
+
+        source = '{0}{1}'.format(self._prefix, name)
+        if not load_root().TFile.Cp(source, destination, False):
+            raise IOError('Couldn\'t copy {0} to {1}.'.format(source,
+                                                               destination))
+
+
+class Orchestrator(object):
+
+    """ Process the jobs of a Campaign while their calibration files are
+    fetched from a store. The paths of the jobs are names of files in the
+    store. """
+
+    def __init__(self, campaign, store, cache_dir):
+
+        """ Initialize object variables. Fetched files are kept in cache_dir
+        until their job is processed. """
+
+        self._campaign = campaign
+        self._store = store
+        self._cache_dir = cache_dir.rstrip('/')
+
+        # Number of threads fetching files, and number of fetched files which
+        # may wait for a worker
+        self._fetchers = 2
+        self._prefetch = 2
+
+        # Statistics of fetches, updated by the fetch threads
+        self._lock = threading.Lock()
+        self._fetched = 0
+        self._fetched_bytes = 0
+        self._fetch_seconds = 0.
+
+        # Local paths of all files which are fetched, removed at the end of
+        # the run even if it fails
+        self._local_files = []
+
+    def set_fetchers(self, fetchers):
+
+        """ Set number of threads fetching files. """
+
+        if fetchers < 1:
+            raise ValueError('Number of fetchers needs to be at least 1, not '
+                             '{0}.'.format(fetchers))
+
+        self._fetchers = fetchers
+
+    def set_prefetch(self, prefetch):
+
+        """ Set number of fetched files which may wait for a worker. Fetching
+        stops once this many files wait. """
+
+        if prefetch < 1:
+            raise ValueError('Number of prefetched files needs to be at least '
+                             '1, not {0}.'.format(prefetch))
+
+        self._prefetch = prefetch
+
+    def run(self):
+
+        """ Fetch files and process jobs of campaign, then collect their
+        results in the campaign. If fetching or a job fails, the fetch threads
+        are stopped and all fetched files are removed before the error is
+        raised. """
+
+        jobs = self._campaign.get_jobs()
+        workers = min(self._campaign.get_workers(), max(len(jobs), 1))
+        LGR.info('Process {0} jobs with {1} workers, fetching with {2} '
+                 'threads.'.format(len(jobs), workers, self._fetchers))
+
+        if not path.exists(self._cache_dir):
+            makedirs(self._cache_dir)
+        self._campaign.prepare()
+
+        # Jobs to fetch, and fetched jobs waiting for a worker; the latter is
+        # bounded, so fetch threads block once it is full
+        pending = Queue()
+        for idx, job in enumerate(jobs):
+            pending.put((idx, job))
+        ready = Queue(maxsize=self._prefetch)
+        stop = threading.Event()
+
+        # Workers are forked before fetch threads are started, since forking
+        # a process with running threads can copy locks held by them
+        pool = Pool(processes=workers)
+        fetchers = []
+        for _ in range(min(self._fetchers, max(len(jobs), 1))):
+            fetcher = threading.Thread(target=self._fetch_jobs,
+                                       args=(pending, ready, stop))
+            fetcher.daemon = True
+            fetcher.start()
+            fetchers.append(fetcher)
+
+        # One job per worker is in flight; the slot is freed and the fetched
+        # file removed once the job is done
+        slots = threading.BoundedSemaphore(workers)
+        process = self._campaign.get_process()
+        try:
+            handles = []
+            for _ in range(len(jobs)):
+                with INS.timer('Orchestrator.wait_input'):
+                    idx, job_local, error = ready.get()
+                if error is not None:
+                    raise IOError('Couldn\'t fetch {0}: {1}'
+                                  .format(jobs[idx]['path'], error))
+                with INS.timer('Orchestrator.wait_worker'):
+                    slots.acquire()
+                handles.append((idx, pool.apply_async(
+                    _run_job, ((process, job_local),),
+                    callback=self._get_callback(job_local['path'], slots))))
+
+            results = [None]*len(jobs)
+            for idx, handle in handles:
+                result, error = handle.get()
+                if error is not None:
+                    raise RuntimeError('Job for {0} failed:\n{1}'
+                                       .format(jobs[idx]['path'], error))
+                # Results refer to the file in the store, not the local copy
+                job, fits, stats = result
+                job['path'] = jobs[idx]['path']
+                results[idx] = (job, fits, stats)
+        finally:
+            self._stop_fetchers(fetchers, pending, ready, stop)
+            pool.close()
+            pool.join()
+            self._remove_local_files()
+
+        INS.count('files_fetched', self._fetched)
+        INS.count('bytes_fetched', self._fetched_bytes)
+        LGR.info('Fetched {0} files in {1:.1f} s of fetch time.'
+                 .format(self._fetched, self._fetch_seconds))
+        self._campaign.collect(results)
+
+    def _fetch_jobs(self, pending, ready, stop):
+
+        """ Fetch files of pending jobs and put (index, job with local path,
+        error) into ready, until all jobs are fetched or stop is set. This
+        runs in a fetch thread. """
+
+        while not stop.is_set():
+            try:
+                item = pending.get_nowait()
+            except Empty:
+                return
+            # Sentinel put by _stop_fetchers()
+            if item is None:
+                return
+            idx, job = item
+
+            job_local = dict(job)
+            job_local['path'] = path.join(
+                self._cache_dir, '{0}_{1}'.format(idx,
+                                                  path.basename(job['path'])))
+            with self._lock:
+                self._local_files.append(job_local['path'])
+            error = None
+            start = default_timer()
+            try:
+                self._store.fetch(job['path'], job_local['path'])
+            except Exception as exc:  # pylint: disable=broad-except
+                # Main thread raises the error, otherwise it would wait for
+                # this job forever
+                error = exc
+            seconds = default_timer()-start
+
+            if error is None:
+                with self._lock:
+                    self._fetched += 1
+                    self._fetched_bytes += path.getsize(job_local['path'])
+                    self._fetch_seconds += seconds
+                LGR.info('Fetched {0} in {1:.2f} s.'.format(job['path'],
+                                                            seconds))
+
+            # Block while enough files wait for a worker
+            ready.put((idx, job_local, error))
+
+    def _stop_fetchers(self, fetchers, pending, ready, stop):
+
+        """ Stop fetch threads: put one sentinel per thread into pending, and
+        take fetched files out of ready until all threads have exited, so
+        that threads blocked on the full queue can finish. """
+
+        stop.set()
+        for _ in fetchers:
+            pending.put(None)
+        while any(fetcher.is_alive() for fetcher in fetchers):
+            try:
+                ready.get(timeout=0.1)
+            except Empty:
+                continue
+
+    def _remove_local_files(self):
+
+        """ Remove fetched files which are left, e.g. of jobs which were never
+        processed because another job failed. """
+
+        with self._lock:
+            local_files, self._local_files = self._local_files, []
+        for path_file in local_files:
+            if path.exists(path_file):
+                remove(path_file)
+
+    def _get_callback(self, path_file, slots):
+
+        """ Return callback for a finished job, which removes its fetched
+        file path_file and frees its slot. """
+
+        def callback(_):
+
+            """ Remove fetched file and free slot. """
+
+            if path.exists(path_file):
+                remove(path_file)
+            slots.release()
+
+        return callback
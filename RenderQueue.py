@@ -0,0 +1,120 @@
+#!/usr/bin/env python2
+
+""" Queue for rendering canvases as *.pdf after the numeric work is done. """
+
+from os import makedirs, path
+from multiprocessing import Pool
+from Logger import LGR
+from Instrumentation import INS
+
+# Render policies; with 'summary', only 2d maps are rendered
+POLICIES = ['none', 'summary', 'all']
+
+
+def save_pdf(canvas, filename):
+
+    """ Save canvas as filename, creating its directory if needed. """
+
+    directory = path.dirname(filename)
+    if directory and not path.exists(directory):
+        try:
+            makedirs(directory)
+        except OSError:
+            # Directory might have been created by another process meanwhile
+            if not path.isdir(directory):
+                raise
+    canvas.SaveAs(filename)
+
+
+def _save_pdf(job):
+
+    """ Save canvas of (canvas, filename) job. This is a module level function
+    so that it can be sent to worker processes. """
+
+    save_pdf(*job)
+
+
+class RenderQueue(object):
+
+    """ Queue for rendering canvases as *.pdf after the numeric work is done.
+    Canvases are cloned when they are added, so they are rendered in the state
+    they have at that time. """
+
+    def __init__(self, policy='all', workers=1):
+
+        """ Initialize object variables. """
+
+        self._queue = []
+        self.set_policy(policy)
+        self.set_workers(workers)
+
+    def get_policy(self):
+
+        """ Get render policy. """
+
+        return self._policy
+
+    def set_policy(self, policy):
+
+        """ Set render policy, either none, summary or all. """
+
+        if policy not in POLICIES:
+            raise ValueError('Unknown render policy {0}, use one of {1}.'
+                             .format(policy, ', '.join(POLICIES)))
+
+        self._policy = policy
+
+    def get_workers(self):
+
+        """ Get number of worker processes used to render. """
+
+        return self._workers
+
+    def set_workers(self, workers):
+
+        """ Set number of worker processes used to render. With one worker,
+        canvases are rendered in the current process. """
+
+        if workers < 1:
+            raise ValueError('Number of workers needs to be at least 1, not '
+                             '{0}.'.format(workers))
+
+        self._workers = workers
+
+    def add(self, canvas, filename, summary=False):
+
+        """ Add canvas to queue, if the render policy selects it. summary marks
+        canvases which are part of the summary, i.e. 2d maps. """
+
+        if self._policy == 'none':
+            return
+        if self._policy == 'summary' and not summary:
+            return
+
+        self._queue.append((canvas.Clone(), path.abspath(filename)))
+
+    def drain(self):
+
+        """ Render all canvases in queue. """
+
+        if not self._queue:
+            return
+
+        LGR.info('Render {0} plots.'.format(len(self._queue)))
+
+        if self._workers == 1:
+            for job in self._queue:
+                _save_pdf(job)
+        else:
+            pool = Pool(processes=min(self._workers, len(self._queue)))
+            try:
+                pool.map(_save_pdf, self._queue)
+            finally:
+                pool.close()
+                pool.join()
+
+        INS.count('pdfs_written', len(self._queue))
+        INS.count('pdf_bytes', sum(path.getsize(filename)
+                                   for _, filename in self._queue
+                                   if path.exists(filename)))
+        self._queue = []
@@ -0,0 +1,104 @@
+#!/usr/bin/env python2
+
+""" Single writer for the output ROOT file. The file is opened once, writes
+are buffered per directory and only written to the file when the buffer is
+flushed, i.e. at explicit checkpoints or when the file is closed. """
+
+from collections import OrderedDict
+from Logger import LGR
+from Instrumentation import INS
+from ToolboxHelper import load_root
+
+
+class RootOutput(object):
+
+    """ Single writer for the output ROOT file. """
+
+    def __init__(self, s_rootfile):
+
+        """ Initialize object variables. """
+
+        self.s_rootfile = s_rootfile
+        self._rootfile = None
+
+        # Objects to be written, per directory in ROOT file
+        self._buffer = OrderedDict()
+
+    def write(self, objects, directory='', overwrite=False):
+
+        """ Buffer objects to be written into directory of ROOT file. The
+        objects are cloned, so that they are written in the state they have
+        now, even if they are changed before the buffer is flushed. With
+        overwrite, objects replace objects of the same name in the directory
+        instead of being written as a new cycle, e.g. for maps which are
+        updated several times. """
+
+        if not isinstance(objects, list):
+            objects = [objects]
+
+        buf = self._buffer.setdefault(directory, [])
+        for obj in objects:
+            clone = obj.Clone(obj.GetName())
+            # Histograms would otherwise be attached to the current directory
+            if clone.InheritsFrom('TH1'):
+                clone.SetDirectory(0)
+            # Older state of object in buffer doesn't need to be written
+            if overwrite:
+                buf[:] = [(buffered, overwritten)
+                          for buffered, overwritten in buf
+                          if not overwritten or
+                          buffered.GetName() != clone.GetName()]
+            buf.append((clone, overwrite))
+
+    def flush(self):
+
+        """ Write all buffered objects into ROOT file. """
+
+        if not self._buffer:
+            return
+
+        root = load_root()
+        if self._rootfile is None:
+            self._rootfile = root.TFile(self.s_rootfile, 'UPDATE')
+            if self._rootfile.IsZombie():
+                raise IOError('Couldn\'t open ROOT file {0}.'
+                              .format(self.s_rootfile))
+
+        n_objects = 0
+        n_bytes = 0
+        for directory, objects in self._buffer.items():
+            # Change directory in rootfile
+            if directory:
+                if not self._rootfile.GetDirectory(directory):
+                    self._rootfile.mkdir(directory)
+                self._rootfile.cd(directory)
+            else:
+                self._rootfile.cd()
+
+            for obj, overwrite in objects:
+                if overwrite:
+                    n_bytes += obj.Write('', root.TObject.kOverwrite)
+                else:
+                    n_bytes += obj.Write()
+            n_objects += len(objects)
+
+        LGR.debug('Wrote {0} objects into {1}.'
+                  .format(n_objects, self.s_rootfile))
+        INS.count('root_objects', n_objects)
+        INS.count('root_bytes', n_bytes)
+
+        self._buffer = OrderedDict()
+        self._rootfile.Flush()
+
+        # Don't leave ROOT file as current directory, otherwise new
+        # histograms are attached to it
+        root.gROOT.cd()
+
+    def close(self):
+
+        """ Flush buffer and close ROOT file. """
+
+        self.flush()
+        if self._rootfile is not None:
+            self._rootfile.Close()
+            self._rootfile = None
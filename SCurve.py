@@ -8,9 +8,14 @@ Take calibration measurement and integrate, to get S-curves.
 from os import system
 from ROOT import TFile, TGraph, gROOT  # pylint: disable=import-error
 from Logger import LGR
+from Instrumentation import INS, timed
 from ToolboxTGraph import ToolboxTGraph
-from ToolboxHelper import check_if_object
+from ToolboxHelper import check_if_object, get_mtime
 from Floorplan import Floorplan
+from Geometry import Geometry
+from RootOutput import RootOutput
+from RenderQueue import RenderQueue
+from FitCache import FitCache
 
 gROOT.SetBatch(True)
 
@@ -20,8 +25,18 @@ class SCurve(object):
 
     gROOT.SetBatch(True)
 
-    # 2d maps object
-    _floorplan = Floorplan()
+    # 2d maps object, shared by all SCurve objects which don't have their
+    # own; only created when maps are made, see _get_floorplan()
+    _floorplan = None
+
+    # Geometry of assembly used as long as there are no 2d maps, see
+    # _get_layout()
+    _default_layout = None
+
+    # Cache with measurement TGraphs, keyed by (path, mtime, pixel); holds the
+    # TGraphs of one ROOT file only, whose (path, mtime) is stored separately
+    _graph_cache = {}
+    _graph_cache_file = None
 
     def __init__(self, path):
 
@@ -30,34 +45,118 @@ class SCurve(object):
         # Path to ROOT file
         self._path = path
 
+        # 2d maps object of this SCurve, see set_floorplan()
+        self._own_floorplan = None
+
         # List of names of TGraphs to be drawn
-        # This can be any combination of numbers between 0 and 47
-        self._s_graphs = range(0, 48)
+        # This can be any combination of pixel numbers of the Geometry
+        self._s_graphs = self._get_layout().get_numbering()
 
-        # List with all ToolboxTGraph objects
+        # ToolboxTGraph object, which keeps what is computed for every pixel
+        # of the ROOT file it was filled from
         self._toolbox_graph = ToolboxTGraph()
+        self._toolbox_graph.select(self._s_graphs)
+        self._toolbox_file = None
 
-    def retrieve_graphs(self):
+        # Output ROOT file, kept open for the whole run
+        self._output = None
 
-        """ Retrieve TGraphs. """
+        # Queue for plots, rendered once the numeric work is done
+        self._renderer = RenderQueue()
+        self._toolbox_graph.renderer = self._renderer
+
+    @timed('SCurve.retrieve_graphs')
+    def retrieve_graphs(self, draw=True):
+
+        """ Retrieve TGraphs. Only TGraphs of pixels which were not retrieved
+        before are filled into the ToolboxTGraph object. Unless draw is
+        False, they are plotted as well, see draw_measurements(). """
 
         LGR.info('Retrieve TGraphs from ROOT file.')
-        # Open ROOT file
-        f_in = TFile(self._path, 'READ')
+        key_file = self._load_graphs()
+
+        # Everything computed from an older version of the file is dropped
+        if key_file != self._toolbox_file:
+            self._toolbox_graph.reset()
+            self._toolbox_graph.select(self._s_graphs)
+            self._toolbox_file = key_file
 
-        # Get TGraphs from ROOT file and fill list in ToolboxTGraph object
+        # Get TGraphs from cache and fill them into ToolboxTGraph object; use
+        # clones, since the TGraphs are changed later on, e.g. by fits
+        missing = self._toolbox_graph.get_missing(self._s_graphs)
         graphs = []
-        for s_graph in self._s_graphs:
-            graph = f_in.Get(str(s_graph))
+        for s_graph in missing:
+            graph = self._graph_cache.get(key_file + (s_graph,))
             check_if_object(graph, TGraph)
-            graphs.append(graph)
+            graphs.append(graph.Clone())
+
+        if missing:
+            self._toolbox_graph.fill_graphs(graphs, missing)
 
-        self._toolbox_graph.fill_graphs(graphs)
-        self._toolbox_graph.fill_numbering(self._s_graphs)
+        if draw:
+            self.draw_measurements()
+
+    def draw_measurements(self):
+
+        """ Plot retrieved TGraphs. """
 
         LGR.info('Create plot with original TGraphs.')
         self._draw_save('Gaussian', ['measurements'])
 
+    def _load_graphs(self):
+
+        """ Load all measurement TGraphs from ROOT file into cache, unless
+        they are cached already. If the path or the modification time of the
+        ROOT file changed, the cache is evicted first. Returns (path, mtime)
+        part of the cache keys. """
+
+        key_file = (self._path, get_mtime(self._path))
+        if key_file == SCurve._graph_cache_file:
+            return key_file
+
+        LGR.info('Load TGraphs from {0} into cache.'.format(self._path))
+        self._graph_cache.clear()
+
+        # Open ROOT file
+        f_in = TFile(self._path, 'READ')
+        if f_in.IsZombie():
+            raise IOError('Couldn\'t open ROOT file {0}.'.format(self._path))
+
+        # Measurement TGraphs are named after their pixel number
+        names = set(key.GetName() for key in f_in.GetListOfKeys())
+        for name in names:
+            if not name.isdigit():
+                continue
+            graph = f_in.Get(name)
+            if isinstance(graph, TGraph):
+                self._graph_cache[key_file + (int(name),)] = graph
+
+        f_in.Close()
+        SCurve._graph_cache_file = key_file
+        INS.count('graphs_read', len(self._graph_cache))
+
+        return key_file
+
+    @classmethod
+    def clear_graph_cache(cls):
+
+        """ Evict all TGraphs from cache, so that the next call of
+        retrieve_graphs reads them from the ROOT file again. """
+
+        cls._graph_cache.clear()
+        cls._graph_cache_file = None
+
+    def get_available_graphs(self):
+
+        """ Get sorted list of pixel numbers of all measurement TGraphs in the
+        ROOT file. """
+
+        key_file = self._load_graphs()
+
+        return sorted(key[-1] for key in self._graph_cache
+                      if key[:-1] == key_file)
+
+    @timed('SCurve.fit_gaussian')
     def fit_gaussian(self):
 
         """ Fit Gaussian on TGraph. """
@@ -66,20 +165,106 @@ class SCurve(object):
         self._toolbox_graph.fit('gaus', ['measurements'])
         self._draw_save('Gaussian_fit', ['measurements'])
 
+    @timed('SCurve.fit_scurve')
+    def fit_scurve(self, mode='erf'):
+
+        """ Fit error function on normalized S-curve, with initial values
+        computed in closed form from the S-curve. With mode moments, the
+        parameters are estimated from the moments of the S-curve instead, which
+        is much faster but less precise. Use either this or fit_gaussian, since
+        the 2d maps show all fits. """
+
+        if mode == 'erf':
+            LGR.info('Fit error function on S-curve.')
+            self._toolbox_graph.fit('erf', ['scurves'])
+        elif mode == 'moments':
+            LGR.info('Estimate S-curve parameters from moments.')
+            self._toolbox_graph.estimate(['scurves'])
+        else:
+            raise ValueError('Unknown S-curve fit mode {0}, use either erf or '
+                             'moments.'.format(mode))
+        self._draw_save('S-curve_fit', ['scurves'])
+
+    def get_fits(self):
+
+        """ Get list with ToolboxFits. """
+
+        return self._toolbox_graph.get_fits()
+
+    def get_fit_table(self):
+
+        """ Get FitTable with values of all fits. """
+
+        return self._toolbox_graph.get_fit_table()
+
+    def fill_fits(self, fits):
+
+        """ Fill fits, given as FitTable or list of ToolboxFits, e.g. fits
+        made in another process, so that maps can be made without fitting
+        again. """
+
+        self._toolbox_graph.fill_fits(fits)
+
+    @timed('SCurve.make_maps')
     def make_maps(self, coordinate, prefix):
 
         """ Make 2d maps of MPA, showing fit characteristics. """
 
         LGR.info('Make 2d maps.')
         self.set_name('map')
-        if coordinate in [0, 1, 2]:
-            geometry = [range(32, 48), range(31, 15, -1), range(0, 16)]
-        else:
-            geometry = [range(15, -1, -1), range(16, 32), range(47, 31, -1)]
-        self._floorplan.set_geometry(geometry, prefix)
-        self._floorplan.fill_maps(self._toolbox_graph.get_fits(), coordinate,
-                                  prefix)
 
+        # Maps are written and rendered with the settings of this SCurve; what
+        # was filled into another ROOT file is not in this one
+        floorplan = self._get_floorplan()
+        if floorplan.s_rootfile != self._toolbox_graph.s_rootfile:
+            floorplan.reset()
+        floorplan.directory = self._toolbox_graph.directory
+        floorplan.name = self._toolbox_graph.name
+        floorplan.s_rootfile = self._toolbox_graph.s_rootfile
+        floorplan.output = self._output
+        floorplan.renderer = self._renderer
+
+        geometry = floorplan.get_layout().get_pixels(coordinate)
+        floorplan.set_geometry(geometry, prefix)
+        floorplan.fill_maps(self._toolbox_graph.get_fit_table(), coordinate,
+                            prefix)
+
+    def set_floorplan(self, floorplan):
+
+        """ Set 2d maps object filled by this SCurve instead of the one shared
+        by all SCurve objects, e.g. so that the maps of every Campaign start
+        empty. SCurve objects filling the same combined maps need to get the
+        same Floorplan. """
+
+        self._own_floorplan = floorplan
+
+    def _get_layout(self):
+
+        """ Get Geometry of assembly, which is the one of the 2d maps once
+        they exist. """
+
+        if self._own_floorplan is not None:
+            return self._own_floorplan.get_layout()
+        if SCurve._floorplan is not None:
+            return SCurve._floorplan.get_layout()
+        if SCurve._default_layout is None:
+            SCurve._default_layout = Geometry()
+
+        return SCurve._default_layout
+
+    def _get_floorplan(self):
+
+        """ Get 2d maps object of this SCurve, or the shared one, creating it
+        if needed. """
+
+        if self._own_floorplan is not None:
+            return self._own_floorplan
+        if SCurve._floorplan is None:
+            SCurve._floorplan = Floorplan()
+
+        return SCurve._floorplan
+
+    @timed('SCurve.make_s_curve')
     def make_s_curve(self):
 
         """ Call a sequence of functions to get the S-curves. """
@@ -110,17 +295,73 @@ class SCurve(object):
     def set_graphs(self, graphs):
 
         """ Set list of graphs to be drawn. This can be any combination of
-        numbers between 0 and 47. Whenever this is done, the list of TGraphs is
-        reset. """
+        pixel numbers of the Geometry of the assembly. Whenever this is done,
+        the fits are reset, but TGraphs, S-curves and fits of single pixels
+        are kept, so pixels which were processed before are not processed
+        again. """
 
         # Make sure that graphs is a list
         check_if_object(graphs, list)
 
-        # Filter out all numbers outside 0 and 47
-        self._s_graphs = filter(lambda y: y in range(0, 48), graphs)
+        # Filter out all numbers which are not pixels of the assembly
+        valid = set(self._get_layout().get_numbering())
+        self._s_graphs = [graph for graph in graphs if graph in valid]
+
+        # Select view on pixels in ToolboxTGraph
+        self._toolbox_graph.select(self._s_graphs)
+
+    def get_backend(self):
+
+        """ Get backend used for integration, normalization and fits. """
+
+        return self._toolbox_graph.backend
+
+    def set_backend(self, backend):
+
+        """ Set backend used for integration, normalization and fits. With
+        'root', every TGraph is processed point by point; with 'array', all
+        selected pixels are processed at once as NumPy arrays and Gaussian
+        parameters are estimated instead of fitted with Minuit; with 'batch',
+        all selected pixels are processed as NumPy arrays and fitted at once
+        with a BatchFitter. """
+
+        if backend not in ['root', 'array', 'batch']:
+            raise ValueError('Unknown backend {0}, use either root, array or '
+                             'batch.'.format(backend))
+
+        self._toolbox_graph.backend = backend
+
+    def get_shared_sigma(self):
+
+        """ Get whether all pixels of the MPA share sigma in batch fits. """
+
+        return self._toolbox_graph.shared_sigma
+
+    def set_shared_sigma(self, shared_sigma):
+
+        """ Set whether all pixels of the MPA share sigma in batch fits, i.e.
+        whether the noise is fitted per MPA instead of per pixel. Only has an
+        effect with the batch backend. """
+
+        self._toolbox_graph.shared_sigma = bool(shared_sigma)
 
-        # Reset ToolboxTGraph
-        self._toolbox_graph.reset()
+    def set_fit_cache(self, s_cachefile, max_entries=100000):
+
+        """ Use persistent cache in s_cachefile for fits, so that TGraphs
+        which were fitted in an earlier run are not fitted again. """
+
+        if self._toolbox_graph.fit_cache is not None:
+            self._toolbox_graph.fit_cache.close()
+
+        self._toolbox_graph.fit_cache = FitCache(s_cachefile, max_entries)
+
+    def set_geometry_file(self, s_geometryfile):
+
+        """ Set file with Geometry of assembly, which defines the pixel grid
+        of every chip and the layout of the combined maps. Unless this SCurve
+        has its own 2d maps object, this affects all SCurve objects. """
+
+        self._get_floorplan().set_layout(Geometry(s_geometryfile))
 
     def get_directory(self):
 
@@ -133,7 +374,6 @@ class SCurve(object):
         """ Set directory where plots and ROOT files are stored in. """
 
         self._toolbox_graph.directory = s_dir.rstrip('/')
-        self._floorplan.directory = s_dir.rstrip('/')
 
     def get_name(self):
 
@@ -153,7 +393,6 @@ class SCurve(object):
                                        self._s_graphs[-1])
 
         self._toolbox_graph.name = s_name
-        self._floorplan.name = s_name
 
     def _get_title(self, s_name):
 
@@ -184,5 +423,56 @@ class SCurve(object):
             system('mkdir -p {0}'
                    .format('/'.join(s_rootfile.split('/')[:-1])))
 
+        # Close output of previous ROOT file
+        if self._output is not None:
+            self._output.close()
+
+        self._output = RootOutput(s_rootfile)
         self._toolbox_graph.s_rootfile = s_rootfile
-        self._floorplan.s_rootfile = s_rootfile
+        self._toolbox_graph.output = self._output
+
+    def get_render_policy(self):
+
+        """ Get render policy. """
+
+        return self._renderer.get_policy()
+
+    def set_render_policy(self, policy, workers=1):
+
+        """ Set render policy: with none, no *.pdf files are rendered; with
+        summary, only 2d maps are rendered; with all, every plot is rendered.
+        Plots are rendered with workers processes when render() or close() is
+        called. """
+
+        self._renderer.set_policy(policy)
+        self._renderer.set_workers(workers)
+
+    @timed('SCurve.render')
+    def render(self):
+
+        """ Render all plots queued so far. """
+
+        self._renderer.drain()
+
+    @timed('SCurve.flush')
+    def flush(self):
+
+        """ Write everything buffered so far into output ROOT file. """
+
+        if self._output is not None:
+            self._output.flush()
+
+    @timed('SCurve.close')
+    def close(self):
+
+        """ Write everything buffered into output ROOT file and close it, and
+        render all queued plots. This needs to be called once all plots are
+        made. """
+
+        self.render()
+        if self._toolbox_graph.fit_cache is not None:
+            self._toolbox_graph.fit_cache.close()
+            self._toolbox_graph.fit_cache = None
+        if self._output is not None:
+            self._output.close()
+            self._output = None
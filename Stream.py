@@ -0,0 +1,246 @@
+#!/usr/bin/env python2
+
+""" Process calibration measurements while the DAQ is still writing them.
+An input directory is watched for calibration files; new files and new pixel
+TGraphs in files which grew are processed as soon as the files are stable,
+and the 2d maps are updated after every arrival. """
+
+import re
+from os import listdir, stat, path
+from time import time, sleep
+from Logger import LGR
+from Instrumentation import INS
+from SCurve import SCurve
+from Floorplan import Floorplan
+from Geometry import Geometry, DEFAULT_GEOMETRY
+from FitTable import FitTable, COLUMNS
+from Constants import STAGES
+
+# Name of calibration files written by the DAQ
+PATTERN_FILE = re.compile(r'^backup_({0})Calibration__MPA(\d+)\.root$'
+                          .format('|'.join(STAGES)))
+
+
+class Stream(object):
+
+    """ Process calibration measurements while the DAQ is still writing them.
+    A file is only read once its size and modification time didn't change
+    for settle_time seconds, so that half-written files are not opened. """
+
+    def __init__(self, input_dir, output):
+
+        """ Initialize object variables. """
+
+        self._input_dir = input_dir
+        self._output = output.rstrip('/')
+
+        self._poll_interval = 1.
+        self._settle_time = 2.
+
+        # Backend and render policy used by SCurve
+        self._backend = 'root'
+        self._render_policy = 'all'
+
+        # Path to persistent fit cache; no cache if empty
+        self._fit_cache = ''
+
+        # Geometry of assembly, which defines the pixels of every chip
+        self._geometry_file = DEFAULT_GEOMETRY
+        self._geometry = Geometry(self._geometry_file)
+
+        # 2d maps of this stream, filled by all its SCurve objects
+        self._floorplan = Floorplan(self._geometry)
+
+        # (size, mtime) of every calibration file at the last poll and when
+        # it was processed the last time
+        self._seen = {}
+        self._processed = {}
+
+        # Processed pixels and their fits, per (MPA, stage)
+        self._pixels = {}
+        self._fits = {}
+
+    def set_poll_interval(self, poll_interval):
+
+        """ Set time in seconds between two polls of the input directory. """
+
+        self._poll_interval = poll_interval
+
+    def set_settle_time(self, settle_time):
+
+        """ Set time in seconds a file must not have changed before it is
+        read. """
+
+        self._settle_time = settle_time
+
+    def set_backend(self, backend):
+
+        """ Set backend used by SCurve. """
+
+        self._backend = backend
+
+    def set_render_policy(self, policy):
+
+        """ Set render policy used by SCurve. """
+
+        self._render_policy = policy
+
+    def set_fit_cache(self, s_cachefile):
+
+        """ Set path to persistent fit cache. """
+
+        self._fit_cache = s_cachefile
+
+    def set_geometry_file(self, s_geometryfile):
+
+        """ Set file with Geometry of assembly used for 2d maps and to decide
+        when the assembly is complete. """
+
+        self._geometry_file = s_geometryfile
+        self._geometry = Geometry(s_geometryfile)
+        self._floorplan = Floorplan(self._geometry)
+
+    def get_rootfile(self):
+
+        """ Get name of output ROOT file. """
+
+        return '{0}/out.root'.format(self._output)
+
+    def get_fit_table(self, mpa, stage):
+
+        """ Get FitTable with fits of all processed pixels of MPA in
+        stage. """
+
+        return self._fits.get((mpa, stage), FitTable())
+
+    def is_complete(self):
+
+        """ Return whether all pixels of all chips were processed in all
+        stages. """
+
+        for mpa in self._geometry.get_chips():
+            pixels = set(pixel for row in self._geometry.get_pixels(mpa)
+                         for pixel in row)
+            for stage in range(0, len(STAGES)):
+                if not pixels.issubset(self._pixels.get((mpa, stage), [])):
+                    return False
+
+        return True
+
+    def run(self, timeout=None):
+
+        """ Poll input directory until all pixels of the assembly are
+        processed, or until nothing arrived for timeout seconds. """
+
+        LGR.info('Watch {0} for calibration files.'.format(self._input_dir))
+
+        last_arrival = time()
+        while True:
+            if self.poll():
+                last_arrival = time()
+            if self.is_complete():
+                LGR.info('All chips are complete.')
+                break
+            if timeout is not None and time()-last_arrival > timeout:
+                LGR.info('Nothing arrived for {0} s, stop watching.'
+                         .format(timeout))
+                break
+            sleep(self._poll_interval)
+
+        INS.log_summary()
+
+    def poll(self):
+
+        """ Look for new or changed calibration files once and process those
+        which are stable. Returns number of processed files. """
+
+        n_processed = 0
+        for filename in sorted(listdir(self._input_dir)):
+            match = PATTERN_FILE.match(filename)
+            if match is None:
+                continue
+
+            path_file = path.join(self._input_dir, filename)
+            try:
+                stat_file = stat(path_file)
+            except OSError:
+                # File was removed in the meantime
+                continue
+            state = (stat_file.st_size, stat_file.st_mtime)
+
+            # Only read files which didn't change since the last poll and
+            # for at least settle_time seconds
+            stable = self._seen.get(path_file) == state and \
+                time()-stat_file.st_mtime >= self._settle_time
+            self._seen[path_file] = state
+            if not stable or self._processed.get(path_file) == state:
+                continue
+
+            mpa = int(match.group(2))
+            stage = STAGES.index(match.group(1))
+            if self._process(path_file, mpa, stage):
+                self._processed[path_file] = state
+                n_processed += 1
+
+        return n_processed
+
+    def _process(self, path_file, mpa, stage):
+
+        """ Process pixels of file which were not processed yet and update
+        2d maps of MPA. Returns False if the file couldn't be read, so that
+        it is tried again at the next poll. """
+
+        name = '{0}_{1}'.format(mpa, STAGES[stage])
+        scurve = SCurve(path_file)
+        try:
+            available = scurve.get_available_graphs()
+        except IOError as exc:
+            LGR.warning('Skip {0} for now: {1}'.format(path_file, exc))
+            return False
+
+        done = self._pixels.setdefault((mpa, stage), set())
+        valid = set(self._geometry.get_numbering())
+        pixels = [pixel for pixel in available
+                  if pixel not in done and pixel in valid]
+        if not pixels:
+            return True
+
+        LGR.info('Process {0} new pixels of MPA {1} {2}.'
+                 .format(len(pixels), mpa, STAGES[stage]))
+
+        scurve.set_floorplan(self._floorplan)
+        scurve.set_backend(self._backend)
+        scurve.set_render_policy(self._render_policy)
+        if self._fit_cache:
+            scurve.set_fit_cache(self._fit_cache)
+        scurve.set_directory('{0}/{1}'.format(self._output, name))
+        scurve.set_rootfile(self.get_rootfile())
+
+        scurve.set_graphs(pixels)
+        scurve.retrieve_graphs()
+        scurve.make_s_curve()
+        scurve.fit_gaussian()
+        self._add_fits(mpa, stage, scurve.get_fit_table())
+        done.update(pixels)
+
+        # Maps show all pixels processed so far
+        scurve.set_graphs(sorted(done))
+        scurve.fill_fits(self._fits[(mpa, stage)])
+        scurve.make_maps(mpa, stage)
+        scurve.close()
+
+        return True
+
+    def _add_fits(self, mpa, stage, fits):
+
+        """ Add fits to fits of MPA in stage, replacing older fits of the same
+        pixels. """
+
+        table = self._fits.get((mpa, stage), FitTable())
+        new = set(fits.get_column('numbering'))
+        keep = [numbering not in new
+                for numbering in table.get_column('numbering')]
+
+        merged = table.select(keep)
+        merged.extend(dict((col, fits.get_column(col)) for col in COLUMNS))
+        self._fits[(mpa, stage)] = merged
@@ -0,0 +1,549 @@
+#!/usr/bin/env python2
+
+""" Toolbox class for batched operations on measurements stored in NumPy
+arrays. All selected pixels sit in one 2d (pixels x thresholds) array, so
+integration, normalization and parameter estimation run over all pixels at
+once. TGraphs are only built when they are requested for drawing or saving,
+so ROOT is only imported then. The arrays can live in a memory-mapped
+CurveStore, which integration and normalization then write in place. """
+
+from math import log, pi, sqrt
+from array import array
+import numpy as np
+from Logger import LGR
+from FitTable import FitTable, STATUS_ESTIMATED, STATUS_FAILED, ATTEMPTS
+from BatchFitter import BatchFitter, MODELS
+from ToolboxHelper import check_if_object
+
+
+class ToolboxArray(object):
+
+    """ Toolbox class for batched operations on measurements stored in NumPy
+    arrays. """
+
+    def __init__(self):
+
+        """ Initialize object variables. """
+
+        # 2d arrays with shape (pixels, thresholds)
+        self._x = None
+        self._measurements = None
+        self._integrated = None
+        self._scurves = None
+        self._numbering = []
+
+        # CurveStore holding the arrays, if any
+        self._store = None
+
+    def fill_graphs(self, graphs):
+
+        """ Fill 2d arrays with the points of the TGraphs. All TGraphs need to
+        have the same number of points. """
+
+        from ROOT import TGraph  # pylint: disable=import-error
+
+        check_if_object(graphs, list)
+        if not graphs:
+            raise ValueError('Can\'t fill arrays from empty list of TGraphs.')
+
+        n_points = graphs[0].GetN()
+        a_x = np.empty((len(graphs), n_points))
+        a_y = np.empty((len(graphs), n_points))
+        for idx, graph in enumerate(graphs):
+            check_if_object(graph, TGraph)
+            if graph.GetN() != n_points:
+                raise ValueError('TGraph {0} has {1} points, expected {2}.'
+                                 .format(idx, graph.GetN(), n_points))
+            a_x[idx] = np.fromiter(graph.GetX(), dtype=float, count=n_points)
+            a_y[idx] = np.fromiter(graph.GetY(), dtype=float, count=n_points)
+
+        self.fill_arrays(a_x, a_y)
+
+    def fill_arrays(self, a_x, a_y):
+
+        """ Fill 2d arrays with x and y values of measurements. """
+
+        a_x = np.atleast_2d(np.asarray(a_x, dtype=float))
+        a_y = np.atleast_2d(np.asarray(a_y, dtype=float))
+        if a_x.shape != a_y.shape:
+            raise ValueError('Arrays of x ({0}) and y ({1}) values don\'t '
+                             'have the same shape.'
+                             .format(a_x.shape, a_y.shape))
+
+        self._x = a_x
+        self._measurements = a_y
+        self._integrated = None
+        self._scurves = None
+        self._store = None
+
+    def fill_store(self, store):
+
+        """ Use arrays of a CurveStore: measurements are read from it and
+        integrated curves and S-curves are written into it, without copies in
+        memory. """
+
+        self._x = store.get_plane('x')
+        self._measurements = store.get_plane('measurements')
+        self._integrated = None
+        self._scurves = None
+        self._numbering = store.get_numbering()
+        self._store = store
+
+    def fill_scurves(self, a_scurves):
+
+        """ Fill 2d array with S-curves, e.g. ones which were integrated
+        before. If measurements are filled, the shapes need to match. """
+
+        a_scurves = np.array(np.atleast_2d(a_scurves), dtype=float)
+        if self._measurements is not None and \
+           a_scurves.shape != self._measurements.shape:
+            raise ValueError('Array of S-curves ({0}) doesn\'t have the '
+                             'shape of the measurements ({1}).'
+                             .format(a_scurves.shape,
+                                     self._measurements.shape))
+
+        self._scurves = a_scurves
+
+    def fill_numbering(self, numbering):
+
+        """ Fill list with numbering of pixels. """
+
+        check_if_object(numbering, list)
+        self._numbering = numbering
+
+    def integrate_graphs(self):
+
+        """ Integrate measurements of all pixels at once to get S-curves.
+        Segments are added up in the same order as in
+        ToolboxTGraph.integrate_graphs, so the values are identical. In a
+        CurveStore, the integrated curves are kept in their own plane;
+        otherwise, they are only kept until they are normalized. """
+
+        self._check_filled()
+
+        a_y = self._measurements
+        segments = 1./2*(a_y[:, 1:]+a_y[:, :-1])*np.diff(self._x, axis=1)
+        if self._store is not None:
+            self._integrated = self._store.get_plane('integrated')
+            self._integrated[:, 0] = 0.
+            np.cumsum(segments, axis=1, out=self._integrated[:, 1:])
+            self._scurves = self._store.get_plane('scurves')
+            self._scurves[:] = self._integrated
+        else:
+            self._scurves = np.zeros_like(self._measurements)
+            np.cumsum(segments, axis=1, out=self._scurves[:, 1:])
+
+    def normalize(self):
+
+        """ Normalize S-curves of all pixels at once, in place.
+        First point is at y=1., last point is at y=0. """
+
+        if self._scurves is None:
+            raise ValueError('S-curves need to be integrated before they can '
+                             'be normalized.')
+
+        # Last point of every S-curve needed for normalization; pixels with a
+        # vanishing integral are set to 0, like safe_divide does
+        y_n = self._scurves[:, -1:].copy()
+        valid = y_n != 0
+        np.divide(self._scurves, y_n, out=self._scurves,
+                  where=np.broadcast_to(valid, self._scurves.shape))
+        np.negative(self._scurves, out=self._scurves)
+        self._scurves[~valid[:, 0]] = 0.
+
+    def fit(self, distribution):
+
+        """ Estimate parameters of distribution for the measurements of all
+        pixels at once. Instead of running Minuit for every pixel, the
+        parameters are estimated from the peak region and the area of the
+        measurement, and errors, chi square and NDF are evaluated for the
+        resulting function. Curves without signal get mu in the middle of the
+        range, sigma 1 and status STATUS_FAILED. Returns FitTable with one
+        row per pixel. """
+
+        self._check_filled()
+        if distribution != 'gaus':
+            raise ValueError('Don\'t know how to estimate parameters of {0}.'
+                             .format(distribution))
+
+        a_x = self._x
+        a_y = self._measurements
+        n_points = a_x.shape[1]
+
+        # Mean from points above half maximum, sigma from full width at half
+        # maximum; both are insensitive to noise in the tails
+        half = a_y.max(axis=1)/2.
+        above = a_y >= half[:, None]
+        weights = np.where(above, a_y, 0.)
+        total = weights.sum(axis=1)
+        valid = total > 0
+        total[~valid] = 1.
+        mu = (weights*a_x).sum(axis=1)/total
+        fwhm = self._get_crossing(a_x, a_y, half, above, False) - \
+            self._get_crossing(a_x, a_y, half, above, True)
+        sigma = fwhm/(2*sqrt(2*log(2)))
+        sigma[sigma <= 0] = 1.
+
+        # Curves without signal, e.g. of dead pixels, start in the middle of
+        # the range like in estimate_moments()
+        mu[~valid] = a_x[~valid, n_points//2]
+        sigma[~valid] = 1.
+
+        # The constant is chosen such that the Gaussian has the same area as
+        # the measurement
+        area = (1./2*(a_y[:, 1:]+a_y[:, :-1])*np.diff(a_x, axis=1)).sum(axis=1)
+        constant = area/(sqrt(2*pi)*sigma)
+
+        # Jacobian of gaus with respect to constant, mu and sigma
+        pull = (a_x-mu[:, None])/sigma[:, None]
+        gauss = np.exp(-1./2*pull**2)
+        model = constant[:, None]*gauss
+        jacobian = np.empty(a_x.shape+(3,))
+        jacobian[:, :, 0] = gauss
+        jacobian[:, :, 1] = model*pull/sigma[:, None]
+        jacobian[:, :, 2] = model*pull**2/sigma[:, None]
+
+        chi2 = ((a_y-model)**2).sum(axis=1)
+        ndf = max(n_points-3, 0)
+
+        # Covariance from linearized problem; since TGraphs carry no errors,
+        # scale with chi2/ndf
+        hessian = np.einsum('pni,pnj->pij', jacobian, jacobian)
+        covariance = np.zeros_like(hessian)
+        inverted = np.ones(len(hessian), dtype=bool)
+        for idx in range(len(hessian)):
+            try:
+                covariance[idx] = np.linalg.inv(hessian[idx])
+            except np.linalg.LinAlgError:
+                inverted[idx] = False
+                LGR.warning('Can\'t invert Hessian for pixel {0}.'
+                            .format(self._get_numbering(idx)))
+        if ndf > 0:
+            covariance *= (chi2/ndf)[:, None, None]
+        errors = np.sqrt(np.abs(np.diagonal(covariance, axis1=1, axis2=2)))
+
+        return FitTable({'numbering': [self._get_numbering(idx)
+                                       for idx in range(len(a_y))],
+                         'c': constant,
+                         'c_err': errors[:, 0],
+                         'mu': mu,
+                         'mu_err': errors[:, 1],
+                         'sigma': sigma,
+                         'sigma_err': errors[:, 2],
+                         'chi2': chi2,
+                         'ndf': np.full(len(a_y), ndf),
+                         'status': np.where(valid, STATUS_ESTIMATED,
+                                            STATUS_FAILED),
+                         'cov_status': np.where(inverted, 1, 0)})
+
+    def fit_batch(self, distribution, groups=None):
+
+        """ Fit distribution to all pixels at once with a BatchFitter. gaus is
+        fitted to the measurements, starting from the estimates of fit(), erf
+        to the normalized S-curves, starting from closed-form estimates.
+        groups gives for every pixel the group whose pixels share sigma, e.g.
+        the same number for all pixels of a chip; with None, every pixel has
+        its own sigma.
+
+        Pixels whose fit fails, i.e. doesn't converge or gives parameters or
+        errors which aren't finite, go through the retry ladder in ATTEMPTS,
+        each pixel with its own sigma: a fit starting from the moments of the
+        curve with more iterations, a fit of the points around the peak, and
+        finally the initial values as estimate. Returns FitTable with one row
+        per pixel. """
+
+        self._check_filled()
+        if distribution == 'gaus':
+            a_x = self._x
+            a_y = self._measurements
+            estimates = self.fit(distribution).to_numpy()
+            seeds = np.stack([estimates['c'], estimates['mu'],
+                              estimates['sigma']], axis=1)
+        elif distribution == 'erf':
+            if self._scurves is None:
+                raise ValueError('S-curves need to be integrated before they '
+                                 'can be fitted.')
+            a_y = self._scurves
+            a_x = np.tile(np.arange(a_y.shape[1], dtype=float),
+                          (len(a_y), 1))
+            seeds = self._estimate_scurves(a_x, a_y)
+        else:
+            raise ValueError('Don\'t know how to fit {0} in batch.'
+                             .format(distribution))
+
+        if groups is not None and len(groups) != len(a_y):
+            raise ValueError('Got {0} groups for {1} pixels.'
+                             .format(len(groups), len(a_y)))
+
+        fitter = BatchFitter(distribution)
+        result = self._fit_rows(fitter, a_x, a_y, seeds, groups)
+
+        failed = np.flatnonzero(~result['good'])
+        for attempt in range(2, len(ATTEMPTS)+1):
+            if not len(failed):
+                break
+            LGR.warning('Batch fit of pixels {0} failed, retry with attempt '
+                        '{1} ({2}).'.format(
+                            [self._get_numbering(idx) for idx in failed],
+                            attempt, ATTEMPTS[attempt-1]))
+            retry = self._retry(fitter, attempt, a_x[failed], a_y[failed],
+                                seeds[failed])
+            for key, values in retry.items():
+                result[key][failed] = values
+            failed = failed[~retry['good']]
+
+        params = result['params']
+        errors = result['errors']
+        return FitTable({'numbering': [self._get_numbering(idx)
+                                       for idx in range(len(a_y))],
+                         'c': params[:, 0],
+                         'c_err': errors[:, 0],
+                         'mu': params[:, 1],
+                         'mu_err': errors[:, 1],
+                         'sigma': params[:, 2],
+                         'sigma_err': errors[:, 2],
+                         'chi2': result['chi2'],
+                         'ndf': result['ndf'],
+                         'status': result['status'],
+                         'cov_status': result['cov_status'],
+                         'edm': result['edm'],
+                         'attempts': result['attempts']})
+
+    def _fit_rows(self, fitter, a_x, a_y, seeds, groups=None):
+
+        """ Fit rows with fitter and return dictionary with arrays of
+        parameters, errors, chi square, NDF, status, covariance status, EDM
+        and attempts of every row, and whether its fit is good, i.e. needs no
+        retry. Degenerate fits get status STATUS_FAILED and aren't retried,
+        since no attempt can do better. """
+
+        # Failed fits are caught below, so NumPy doesn't need to warn
+        with np.errstate(all='ignore'):
+            params, errors, chi2, ndf, converged = \
+                fitter.fit(a_x, a_y, seeds, groups)
+            edm = fitter.get_edm(a_x, a_y, params, groups)
+        finite = np.isfinite(errors).all(axis=1)
+        degenerate = fitter.is_degenerate(a_y, params)
+
+        return {'params': params,
+                'errors': errors,
+                'chi2': chi2,
+                'ndf': ndf.astype(float),
+                'status': np.where(degenerate, float(STATUS_FAILED),
+                                   np.where(converged, 0., 1.)),
+                'cov_status': np.where(finite, 3., 0.),
+                'edm': edm,
+                'attempts': np.ones(len(a_y)),
+                'good': degenerate | (converged & finite &
+                                      np.isfinite(params).all(axis=1))}
+
+    def _retry(self, fitter, attempt, a_x, a_y, seeds):
+
+        """ Return result of attempt of the retry ladder in ATTEMPTS for rows
+        whose fit failed, see _fit_rows(). seeds are the initial values of
+        the failed fit. """
+
+        name = ATTEMPTS[attempt-1]
+        if name == 'reseeded':
+            retry = BatchFitter(fitter.distribution, 4*fitter.max_iterations,
+                                fitter.tolerance)
+            result = self._fit_rows(
+                retry, a_x, a_y,
+                self.estimate_moments(fitter.distribution, a_x, a_y))
+        elif name == 'restricted':
+            moments = self.estimate_moments(fitter.distribution, a_x, a_y)
+            rows = np.arange(len(a_y))[:, None]
+            window = self.get_window(a_x, moments)
+            result = self._fit_rows(fitter, a_x[rows, window],
+                                    a_y[rows, window], moments)
+        else:
+            # Initial values are kept as estimate
+            with np.errstate(all='ignore'):
+                model = MODELS[fitter.distribution](a_x, seeds)[0]
+                edm = fitter.get_edm(a_x, a_y, seeds)
+            result = {'params': seeds,
+                      'errors': np.zeros_like(seeds),
+                      'chi2': ((a_y-model)**2).sum(axis=1),
+                      'ndf': np.full(len(a_y), max(a_y.shape[1]-3, 0.)),
+                      'status': np.full(len(a_y), float(STATUS_ESTIMATED)),
+                      'cov_status': np.zeros(len(a_y)),
+                      'edm': edm,
+                      'attempts': np.ones(len(a_y)),
+                      'good': np.ones(len(a_y), dtype=bool)}
+
+        result['attempts'][:] = attempt
+        return result
+
+    def estimate_moments(self, distribution, a_x, a_y):
+
+        """ Return initial values (pixels, 3) of distribution from the moments
+        of the curves: of the measurement for gaus, of the derivative of the
+        S-curve for erf. """
+
+        if distribution == 'gaus':
+            const = a_y.max(axis=1)
+            a_w = np.clip(a_y, 0., None)
+            a_xw = a_x
+        else:
+            const = a_y[:, -1]-a_y[:, 0]
+            a_w = np.clip(np.diff(a_y, axis=1)*np.sign(const)[:, None], 0.,
+                          None)
+            a_xw = (a_x[:, 1:]+a_x[:, :-1])/2.
+
+        total = a_w.sum(axis=1)
+        valid = total > 0
+        total[~valid] = 1.
+        mu = (a_w*a_xw).sum(axis=1)/total
+        sigma = np.sqrt((a_w*(a_xw-mu[:, None])**2).sum(axis=1)/total)
+
+        # Curves without signal start in the middle of the range
+        mu[~valid] = a_x[~valid, a_x.shape[1]//2]
+        sigma = np.where(valid, np.maximum(sigma, 1e-3), 1.)
+
+        return np.stack([const, mu, sigma], axis=1)
+
+    def get_window(self, a_x, seeds, n_sigma=3.):
+
+        """ Return indices (pixels, points) of the points within n_sigma
+        sigma around mu of seeds. All pixels get the same number of points,
+        which is at least 7 or all points. """
+
+        n_points = a_x.shape[1]
+        spacing = np.abs(np.diff(a_x, axis=1)).mean(axis=1)
+        with np.errstate(all='ignore'):
+            center = np.abs(a_x-seeds[:, 1:2]).argmin(axis=1)
+            half = np.ceil(n_sigma*np.abs(seeds[:, 2])/spacing)
+        half = half[np.isfinite(half)]
+        length = n_points
+        if len(half):
+            length = int(min(max(2*np.median(half)+1, 7), n_points))
+        center[~np.isfinite(seeds[:, 1])] = n_points//2
+        start = np.clip(center-length//2, 0, n_points-length)
+
+        return start[:, None] + np.arange(length)[None, :]
+
+    def _estimate_scurves(self, a_x, a_y):
+
+        """ Return initial values (pixels, 3) of ERF_FORMULA for S-curves,
+        computed like ToolboxTGraph._estimate_scurve: c is the height of the
+        plateau, mu the 50% crossing and sigma half the distance between the
+        16% and 84% crossings. """
+
+        const = a_y[:, -1]-a_y[:, 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            a_frac = np.where(const[:, None] != 0,
+                              (a_y-a_y[:, :1])/const[:, None], 0.)
+
+        crossings = []
+        for level in [0.5, 0.16, 0.84]:
+            level = np.full(len(a_y), level)
+            crossings.append(self._get_crossing(
+                a_x, a_frac, level, a_frac >= level[:, None], True))
+        mu = crossings[0]
+        sigma = np.maximum((crossings[2]-crossings[1])/2., 1e-3)
+
+        # Flat S-curves start in the middle of the range
+        flat = const == 0
+        mu[flat] = a_x[flat, a_x.shape[1]//2]
+        sigma[flat] = 1.
+
+        return np.stack([const, mu, sigma], axis=1)
+
+    def get_graphs(self, s_graphs, rows=None):
+
+        """ Build TGraphs according to the values passed. With rows, TGraphs
+        are only built for the pixels in these rows, e.g. the ones which are
+        drawn. """
+
+        check_if_object(s_graphs, list)
+        if rows is None and self._measurements is not None:
+            rows = range(len(self._measurements))
+
+        graphs = []
+        for s_graph in s_graphs:
+            if s_graph == 'measurements' and self._measurements is not None:
+                graphs += self._make_graphs(self._x[rows],
+                                            self._measurements[rows])
+            if s_graph == 'scurves' and self._scurves is not None:
+                # S-curves are drawn against the point number
+                a_pts = np.tile(np.arange(self._scurves.shape[1], dtype=float),
+                                (len(rows), 1))
+                graphs += self._make_graphs(a_pts, self._scurves[rows])
+
+        # If list is not empty, return list, otherwise throw error
+        if graphs:
+            return graphs
+        else:
+            raise ValueError('Don\'t know what list of TGraphs to use.')
+
+    def get_measurements(self):
+
+        """ Get 2d array with measurements. """
+
+        return self._measurements
+
+    def get_integrated(self):
+
+        """ Get 2d array with integrated curves, if they are kept in a
+        CurveStore. """
+
+        return self._integrated
+
+    def get_scurves(self):
+
+        """ Get 2d array with S-curves. """
+
+        return self._scurves
+
+    def _make_graphs(self, a_x, a_y):
+
+        """ Return list of TGraphs built from rows of 2d arrays. """
+
+        from ROOT import TGraph  # pylint: disable=import-error
+
+        graphs = []
+        for row_x, row_y in zip(a_x, a_y):
+            graphs.append(TGraph(len(row_x), array('d', row_x),
+                                 array('d', row_y)))
+        return graphs
+
+    def _get_crossing(self, a_x, a_y, level, above, rising):
+
+        """ Return x value where every row of a_y crosses level, interpolated
+        linearly between neighbouring points. With rising, the first crossing
+        from below is returned, otherwise the last crossing from above. above
+        is the boolean array a_y >= level. """
+
+        rows = np.arange(len(a_y))
+        n_points = a_y.shape[1]
+        if rising:
+            idx_in = np.argmax(above, axis=1)
+            idx_out = np.maximum(idx_in-1, 0)
+        else:
+            idx_in = n_points-1-np.argmax(above[:, ::-1], axis=1)
+            idx_out = np.minimum(idx_in+1, n_points-1)
+
+        y_in = a_y[rows, idx_in]
+        y_out = a_y[rows, idx_out]
+        x_in = a_x[rows, idx_in]
+        x_out = a_x[rows, idx_out]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frac = np.where(y_in != y_out, (y_in-level)/(y_in-y_out), 0.)
+
+        return x_in+frac*(x_out-x_in)
+
+    def _get_numbering(self, idx):
+
+        """ Return numbering of pixel in row idx, or -1 if it is unknown. """
+
+        try:
+            return self._numbering[idx]
+        except IndexError:
+            return -1
+
+    def _check_filled(self):
+
+        """ Raise error if there are no measurements. """
+
+        if self._measurements is None:
+            raise ValueError('No measurements filled into ToolboxArray.')
@@ -6,94 +6,187 @@ Data class to store Gaussian fit values.
 """
 
 from Logger import LGR
+from FitTable import FitTable, COLUMNS, DEFAULTS
 
 
 class ToolboxFit(object):
 
-    """ Data class to store Gaussian fit values. """
+    """ Data class to store Gaussian fit values. The values are stored in a
+    row of a FitTable, ToolboxFit is only a view on this row. """
 
-    def __init__(self, fit=None, numbering=None):
+    __slots__ = ('_table', '_row')
 
-        """ Initialize class variables. """
+    def __init__(self, fit=None, numbering=None, result=None):
+
+        """ Initialize class variables. result is the TFitResultPtr of the
+        fit, which holds the status of the fit, of the covariance matrix and
+        the EDM. """
 
         # Overloaded constructor, both fit and numbering need to be given,
-        # or neither of them
+        # or neither of them; either way, the ToolboxFit gets its own table
+        self._table = FitTable()
         if fit is not None and numbering is not None:
-            self._numbering = numbering
-            self._constant = fit.GetParameter(0)
-            self._constant_error = fit.GetParError(0)
-            self._mu = fit.GetParameter(1)
-            self._mu_error = fit.GetParError(1)
-            self._sigma = fit.GetParameter(2)
-            self._sigma_error = fit.GetParError(2)
-            self._chi2 = fit.GetChisquare()
-            self._ndf = fit.GetNDF()
+            status, cov_status, edm = get_fit_status(result)
+            self._row = self._table.append(numbering,
+                                           fit.GetParameter(0),
+                                           fit.GetParError(0),
+                                           fit.GetParameter(1),
+                                           fit.GetParError(1),
+                                           fit.GetParameter(2),
+                                           fit.GetParError(2),
+                                           fit.GetChisquare(),
+                                           fit.GetNDF(),
+                                           status, cov_status, edm)
         elif fit is None and numbering is None:
-            self._numbering = -1
-            self._constant = 0.
-            self._constant_error = 0.
-            self._mu = 0.
-            self._mu_error = 0.
-            self._sigma = 0.
-            self._sigma_error = 0.
-            self._chi2 = 0.
-            self._ndf = 0.
+            self._row = self._table.append(-1, 0., 0., 0., 0., 0., 0., 0., 0.)
         else:
             raise RuntimeError('An instance of ToolboxFit was created without '
                                'either defining both numbering and fit or '
                                'defining neither of them.')
 
+    @classmethod
+    def from_values(cls, numbering, c, c_err, mu, mu_err, sigma, sigma_err,
+                    chi2, ndf, status=DEFAULTS['status'],
+                    cov_status=DEFAULTS['cov_status'], edm=DEFAULTS['edm'],
+                    attempts=DEFAULTS['attempts']):
+
+        """ Return ToolboxFit filled with values instead of a ROOT fit
+        function, e.g. for parameters that were estimated without Minuit. """
+
+        table = FitTable()
+        row = table.append(numbering, c, c_err, mu, mu_err, sigma, sigma_err,
+                           chi2, ndf, status, cov_status, edm, attempts)
+        return cls.view(table, row)
+
+    @classmethod
+    def view(cls, table, row):
+
+        """ Return ToolboxFit showing row of FitTable table. """
+
+        fit = cls.__new__(cls)
+        fit._table = table
+        fit._row = row
+        return fit
+
+    def __getstate__(self):
+
+        """ Return state for pickling, since there is no __dict__. """
+
+        return self._table, self._row
+
+    def __setstate__(self, state):
+
+        """ Restore state after unpickling. """
+
+        self._table, self._row = state
+
+    def get_values(self):
+
+        """ Return list of all values, in the order of the columns of
+        FitTable. """
+
+        return [self._table.get_value(col, self._row) for col in COLUMNS]
+
     def get_numbering(self):
 
         """ Return numbering of fit, which can be used to locate it e.g. in a
         2d map. """
 
-        return self._numbering
+        return int(self._table.get_value('numbering', self._row))
 
     def get_c(self):
 
         """ Return constant. """
 
-        return self._constant
+        return self._table.get_value('c', self._row)
 
     def get_c_err(self):
 
         """ Return error on constant. """
 
-        return self._constant_error
+        return self._table.get_value('c_err', self._row)
 
     def get_mu(self):
 
         """ Return mu. """
 
-        return self._mu
+        return self._table.get_value('mu', self._row)
 
     def get_mu_err(self):
 
         """ Return error on mu. """
 
-        return self._mu_error
+        return self._table.get_value('mu_err', self._row)
 
     def get_sigma(self):
 
         """ Return sigma. """
 
-        return self._sigma
+        return self._table.get_value('sigma', self._row)
 
     def get_sigma_err(self):
 
         """ Return error on sigma. """
 
-        return self._sigma_error
+        return self._table.get_value('sigma_err', self._row)
 
     def get_chi2(self):
 
         """ Return chi square. """
 
-        return self._chi2
+        return self._table.get_value('chi2', self._row)
 
     def get_ndf(self):
 
         """ Return number of degrees of freedom for chi square fit. """
 
-        return self._ndf
+        return int(self._table.get_value('ndf', self._row))
+
+    def get_status(self):
+
+        """ Return status of fit; 0 if it converged, STATUS_ESTIMATED if the
+        parameters were estimated instead of fitted. """
+
+        return int(self._table.get_value('status', self._row))
+
+    def get_cov_status(self):
+
+        """ Return status of covariance matrix, like in Minuit; 3 if it is
+        accurate, -1 if it is unknown. """
+
+        return int(self._table.get_value('cov_status', self._row))
+
+    def get_edm(self):
+
+        """ Return estimated distance to minimum. """
+
+        return self._table.get_value('edm', self._row)
+
+    def get_attempts(self):
+
+        """ Return number of attempts of the retry ladder needed for fit. """
+
+        return int(self._table.get_value('attempts', self._row))
+
+    def set_attempts(self, attempts):
+
+        """ Set number of attempts of the retry ladder needed for fit. """
+
+        self._table.set_value('attempts', self._row, attempts)
+
+
+def get_fit_status(result):
+
+    """ Return (status, covariance status, EDM) of TFitResultPtr result, or
+    the defaults of FitTable if there is no result. """
+
+    if result is None:
+        return DEFAULTS['status'], DEFAULTS['cov_status'], DEFAULTS['edm']
+
+    # The pointer converts to the status even if there is no TFitResult, e.g.
+    # if the TGraph has no points
+    fit_result = result.Get()
+    if not fit_result:
+        return int(result), 0, 0.
+
+    return int(result), fit_result.CovMatrixStatus(), fit_result.Edm()
@@ -2,14 +2,12 @@
 
 """ Toolbox helper functions. """
 
-from os.path import isfile
+from os.path import isfile, getmtime
+from array import array
 from inspect import getsourcelines
 from collections import defaultdict
-from ROOT import TFile, gROOT  # pylint: disable=import-error
 from Logger import LGR
 
-gROOT.SetBatch(True)
-
 
 def check_if_list(lst, length_min=-1, length_max=-1):
 
@@ -43,11 +41,61 @@ def check_if_file_exists(path_file):
     return True
 
 
+def get_mtime(path_file):
+
+    """ Return modification time of file, or None if the file resides on eos
+    and can't be checked. """
+
+    if path_file.startswith('root://'):
+        return None
+    return getmtime(path_file)
+
+
+def cumulative_integral(graph):
+
+    """ Return array with integral of TGraph from first point up to every
+    point, using triangles like ToolboxTGraph._integral(). graph only needs
+    GetN(), GetX() and GetY(), so the x and y buffers are pulled out once and
+    every partial integral is computed in one pass. """
+
+    n_points = graph.GetN()
+    a_int = array('d', [])
+    if n_points == 0:
+        return a_int
+
+    buf_x = graph.GetX()
+    buf_y = graph.GetY()
+
+    integral = 0.
+    a_int.append(integral)
+    for point in range(1, n_points):
+        # Add new triangle segment to integral of previous point
+        integral += 1./2*(buf_y[point]+buf_y[point-1]) * \
+            (buf_x[point]-buf_x[point-1])
+        a_int.append(integral)
+
+    return a_int
+
+
+def load_root():
+
+    """ Import ROOT in batch mode and return it. Importing ROOT takes
+    seconds, so modules which only need it for some operations call this
+    when they need it instead of importing it at module level. """
+
+    import ROOT  # pylint: disable=import-error
+    ROOT.gROOT.SetBatch(True)
+
+    return ROOT
+
+
 def check_if_tree_exists(path_file, path_tree):
 
     """ Check if TTree exists in TFile. """
 
-    file_in = TFile(path_file)
+    # ROOT is only imported when it is needed, so that numeric runs don't
+    # have to load it
+    file_in = load_root().TFile(path_file)
     # pyROOT does not allow try/except, so make it in a non pythonic way
     if not file_in.Get(path_tree):
         raise ValueError('TTree {0} does not exist in {1}.'
@@ -1,17 +1,36 @@
 #!/usr/bin/env python2
 
-""" Toolbox classes for various operations on ROOT TGraphs. """
+""" Toolbox classes for various operations on ROOT TGraphs. The TGraphs,
+S-curves and fits are kept per pixel, and every operation works on a view of
+selected pixels, so that pixels which are part of several views are only
+integrated, normalized and fitted once. """
 
-from os import makedirs, chdir, getcwd, path
+from os import path
+from math import erf, sqrt
 from array import array
-from ROOT import TFile, TGraph, TCanvas, TLegend  # pylint: disable=import-error
-from ROOT import Double, gStyle, gROOT
+import numpy as np
+from ROOT import TGraph, TCanvas  # pylint: disable=import-error
+from ROOT import TF1, Double, gStyle, gROOT, SetOwnership
 from Logger import LGR
+from Instrumentation import INS, timed
 from ToolboxFit import ToolboxFit
-from ToolboxHelper import check_if_object, safe_divide
+from FitTable import FitTable, STATUS_ESTIMATED, ATTEMPTS
+from ToolboxArray import ToolboxArray
+from BatchFitter import MODELS
+from RootOutput import RootOutput
+from RenderQueue import save_pdf
+from ToolboxHelper import check_if_object, safe_divide, cumulative_integral
 
 gROOT.SetBatch(True)
 
+# Error function describing normalized S-curves; [0] is the height of the
+# plateau, [1] the threshold and [2] the noise
+ERF_FORMULA = '[0]*0.5*(1+TMath::Erf((x-[1])/(sqrt(2)*[2])))'
+
+# Curves kept for every pixel: measurement, integrated S-curve and normalized
+# S-curve
+KINDS = ['measurements', 'integral', 'scurve']
+
 class ToolboxTGraph(object):
 
     """ Toolbox class for various operations on ROOT TGraphs. """
@@ -24,24 +43,67 @@ class ToolboxTGraph(object):
         self.directory = ''
         self.name = ''
 
-        # Define list of TGraphs; if constructor is called with list of
-        # TGraphs, fill them into the list
-        self._measurements = []
-        if graphs is not None:
-            fill_graphs(graphs)
+        # RootOutput through which TGraphs are written
+        self.output = None
+
+        # RenderQueue through which plots are rendered
+        self.renderer = None
+
+        # FitCache with fits of earlier runs
+        self.fit_cache = None
+
+        # Backend for numeric operations; 'root' walks through the TGraphs
+        # point by point, 'array' processes all TGraphs at once in a
+        # ToolboxArray and only builds TGraphs when they are drawn or saved,
+        # 'batch' does the same but fits all TGraphs at once with a
+        # BatchFitter
+        self.backend = 'root'
+
+        # Whether all TGraphs share sigma in batch fits
+        self.shared_sigma = False
+
+        # State of every pixel, keyed by pixel number: 'graphs' and 'rows'
+        # hold TGraph and (x, y) arrays of every kind of curve in KINDS, as
+        # far as they are computed, 'fits' holds ToolboxFits keyed by
+        # distribution and kind of curve. These stay in memory; ROOT needs
+        # TGraphs owning their points, so a CurveStore wouldn't help here,
+        # see CurveStore
+        self._pixels = {}
+
+        # View of selected pixels; S-curves of the view are normalized once
+        # normalize() is called
         self._numbering = []
-        if numbering is not None:
-            fill_numbering(numbering)
-        self._scurves = []
-        self._fits = []
+        self._normalized = False
+        self._fits = FitTable()
+
+        # Titles changed for drawing, restored when the view changes; keyed
+        # by (id of TGraph, axis)
+        self._titles = {}
+
+        # If constructor is called with list of TGraphs, select them
+        if graphs is not None:
+            if numbering is None:
+                numbering = range(len(graphs))
+            self.fill_graphs(graphs, numbering)
+            self.select(numbering)
         self._clear()
 
     def _clear(self):
 
-        """ Initializes/clears ROOT objects. """
+        """ Initializes/clears ROOT objects. The canvas is only created when
+        something is drawn, see _get_canvas(). """
 
-        self._canvas = TCanvas()
-        self._legend = TLegend(0.9, 0.2, 1.00, 0.9)
+        self._canvas = None
+        self._legend = None
+
+    def _get_canvas(self):
+
+        """ Get canvas, creating it if needed. """
+
+        if self._canvas is None:
+            self._canvas = TCanvas()
+
+        return self._canvas
 
     def create_graph(self, name, title, coordinate_x):
 
@@ -49,22 +111,56 @@ class ToolboxTGraph(object):
 
         pass
 
-    def fill_graphs(self, graphs):
+    def fill_graphs(self, graphs, numbering):
 
-        """ Fill list of TGraphs with graphs. """
+        """ Fill measurement TGraphs of pixels in numbering. Anything computed
+        for these pixels before is dropped. """
 
-        # Check all objects before filling the list
+        # Check all objects before filling them in
         check_if_object(graphs, list)
+        check_if_object(numbering, list)
+        if len(graphs) != len(numbering):
+            raise ValueError('Got {0} TGraphs for {1} pixels.'
+                             .format(len(graphs), len(numbering)))
         for graph in graphs:
             check_if_object(graph, TGraph)
-            self._measurements.append(graph)
 
-    def fill_numbering(self, numbering):
+        for pixel, graph in zip(numbering, graphs):
+            self._pixels[pixel] = {'graphs': {'measurements': graph},
+                                   'rows': {},
+                                   'fits': {}}
+
+    def select(self, numbering):
 
-        """ Fill list with numbering of TGraphs. """
+        """ Select view on pixels in numbering; all further operations work
+        on these pixels. Whatever was computed for pixels before is kept, so
+        only pixels which were never part of a view are integrated,
+        normalized and fitted. The fits of the view are reset. """
 
         check_if_object(numbering, list)
-        self._numbering = numbering
+
+        # TGraphs of the view are drawn as they were filled in
+        for (_, axis), (graph, title) in self._titles.items():
+            if axis:
+                graph.GetXaxis().SetTitle(title)
+            else:
+                graph.SetTitle(title)
+        self._titles = {}
+        for pixel in numbering:
+            for graph in self._pixels.get(pixel, {}).get('graphs',
+                                                         {}).values():
+                graph.GetListOfFunctions().Delete()
+
+        self._numbering = list(numbering)
+        self._normalized = False
+        self._fits = FitTable()
+
+    def get_missing(self, numbering):
+
+        """ Get pixels in numbering whose measurement is not filled yet. """
+
+        return [pixel for pixel in numbering
+                if not self._has(pixel, 'measurements')]
 
     def draw_graphs(self, s_graphs):
 
@@ -72,7 +168,7 @@ class ToolboxTGraph(object):
 
         graphs = self._get_graphs(s_graphs)
 
-        self._canvas.cd()
+        self._get_canvas().cd()
         same = ''
         for idx, graph in enumerate(graphs):
             #graph.Draw('AC* {0}'.format(same))
@@ -81,28 +177,45 @@ class ToolboxTGraph(object):
 
     def integrate_graphs(self, s_graphs):
 
-        """ Integrate TGraphs to get S-curves. """
+        """ Integrate measurements of view to get S-curves. Pixels which were
+        integrated before are not integrated again. """
 
-        graphs = self._get_graphs(s_graphs)
+        if s_graphs != ['measurements']:
+            raise ValueError('Only measurements can be integrated, not {0}.'
+                             .format(s_graphs))
 
-        for graph in graphs:
+        missing = [pixel for pixel in self._numbering
+                   if self._has(pixel, 'measurements') and
+                   not self._has(pixel, 'integral')]
+        INS.count('integrals_reused', len(self._numbering)-len(missing))
+        self._normalized = False
+        if not missing:
+            return
+
+        if self.backend in ['array', 'batch']:
+            toolbox = ToolboxArray()
+            toolbox.fill_arrays(*self._get_rows(missing, 'measurements'))
+            toolbox.integrate_graphs()
+            self._set_rows(missing, 'integral', toolbox.get_scurves())
+            return
 
-            integral = 0
+        for pixel in missing:
+            graph = self._get_graph(pixel, 'measurements')
 
             # Need arrays for TGraph constructor
             a_pts = array('d', range(0, graph.GetN()))
-            a_int = array('d', [])
+            a_int = self._cumulative_integral(graph)
 
-            for point in a_pts:
+            self._pixels[pixel]['graphs']['integral'] = \
+                TGraph(len(a_pts), a_pts, a_int)
 
-                # Calculate the integral, this is done for every point, and the
-                # calculation is mostly the same; if performance becomes an
-                # issue, one can consider only calculating the new piece of the
-                # integral instead of the whole thing
-                integral = self._integral(graph, 0, point)
-                a_int.append(integral)
+    def _cumulative_integral(self, graph):
 
-            self._scurves.append(TGraph(len(a_pts), a_pts, a_int))
+        """ Return array with integral of TGraph from first point up to every
+        point, computed in one pass by cumulative_integral(). This gives the
+        same values as calling _integral(graph, 0, point) for every point. """
+
+        return cumulative_integral(graph)
 
     def _integral(self, graph, x_lo, x_hi):
 
@@ -134,13 +247,26 @@ class ToolboxTGraph(object):
 
     def normalize(self):
 
-        """ Normalize S-curves.
+        """ Normalize S-curves of view. Pixels which were normalized before
+        are not normalized again.
         First point is at y=1., last point is at y=0.  """
 
-        # List to store normalize graps
-        graphs_normalized = []
+        missing = [pixel for pixel in self._numbering
+                   if self._has(pixel, 'integral') and
+                   not self._has(pixel, 'scurve')]
+        self._normalized = True
+        if not missing:
+            return
+
+        if self.backend in ['array', 'batch']:
+            toolbox = ToolboxArray()
+            toolbox.fill_scurves(self._get_rows(missing, 'integral')[1])
+            toolbox.normalize()
+            self._set_rows(missing, 'scurve', toolbox.get_scurves())
+            return
 
-        for graph in self._scurves:
+        for pixel in missing:
+            graph = self._get_graph(pixel, 'integral')
 
             # Last point of TGraph needed for normalization
             x_N = Double()
@@ -161,34 +287,280 @@ class ToolboxTGraph(object):
                 # Normalize to 1 and invert
                 a_nrm.append(-safe_divide(y_n1, y_N))
 
+            self._pixels[pixel]['graphs']['scurve'] = \
+                TGraph(len(a_pts), a_pts, a_nrm)
 
-            graphs_normalized.append(TGraph(len(a_pts), a_pts, a_nrm))
+    def fit(self, distribution, s_graphs):
 
-        # Overwrite class member list
-        self._scurves = graphs_normalized
+        """ Fit distribution over TGraphs. distribution is either a function
+        known to ROOT, e.g. gaus, or erf, which fits ERF_FORMULA to normalized
+        S-curves, with initial values computed in closed form from the
+        S-curve. With the batch backend, gaus on measurements and erf on
+        S-curves are fitted for all TGraphs at once. Pixels which were fitted
+        before keep their fit, unless sigma is shared by all pixels of the
+        view, which makes their fits depend on each other. """
+
+        items = self._get_items(s_graphs)
+        reuse = not (self.backend == 'batch' and self.shared_sigma)
+        missing = [(pixel, kind) for pixel, kind in items
+                   if not reuse or
+                   (distribution, kind) not in self._pixels[pixel]['fits']]
+        fitted = set(missing)
+        kinds = set(kind for _, kind in missing)
+        pixels = [pixel for pixel, _ in missing]
+
+        fits = None
+        if self.backend == 'batch' and kinds == set(['measurements']) and \
+           distribution == 'gaus':
+            toolbox = self._get_array(pixels)
+            fits = toolbox.fit_batch(distribution,
+                                     self._get_groups(len(pixels)))
+        elif self.backend == 'batch' and distribution == 'erf' and \
+                kinds in [set(['integral']), set(['scurve'])]:
+            toolbox = self._get_array(pixels)
+            toolbox.fill_scurves(self._get_rows(pixels, kinds.pop())[1])
+            fits = toolbox.fit_batch(distribution,
+                                     self._get_groups(len(pixels)))
+        elif self.backend == 'array' and kinds == set(['measurements']) and \
+                distribution == 'gaus':
+            fits = self._get_array(pixels).fit(distribution)
+
+        if fits is not None:
+            for row, (pixel, kind) in enumerate(missing):
+                fit = ToolboxFit.view(fits, row)
+                self._attach_function(self._get_graph(pixel, kind),
+                                      distribution, fit)
+                self._pixels[pixel]['fits'][(distribution, kind)] = fit
+            INS.count('fits', len(fits))
+            missing = []
+
+        for pixel, kind in missing:
+            graph = self._get_graph(pixel, kind)
+
+            # Take fit from cache if the same TGraph was fitted before
+            if self.fit_cache is not None:
+                key = self.fit_cache.get_key(graph, distribution, 'QS')
+                fit = self.fit_cache.get(key, pixel)
+                if fit is not None:
+                    self._attach_function(graph, distribution, fit)
+                    self._pixels[pixel]['fits'][(distribution, kind)] = fit
+                    INS.count('fits_cached')
+                    continue
+
+            fit = self._fit_graph(graph, distribution, pixel)
+            self._pixels[pixel]['fits'][(distribution, kind)] = fit
+            INS.count('fits')
+
+            if self.fit_cache is not None:
+                self.fit_cache.put(key, fit)
+
+        # New fits are written into the cache at once
+        if self.fit_cache is not None:
+            self.fit_cache.flush()
+
+        self._fill_view_fits(items, distribution, fitted)
 
-    def fit(self, distribution, s_graphs):
+        # If there is only one fit, show stats
+        if len(items) == 1:
+            gStyle.SetOptFit(1111111)
+        else:
+            gStyle.SetOptFit(0000000)
 
-        """ Fit Gaussian distribution over TGraphs. """
+    def estimate(self, s_graphs):
 
-        graphs = self._get_graphs(s_graphs)
+        """ Estimate parameters of ERF_FORMULA for normalized S-curves from
+        their moments, without fitting. This is meant for fast triage runs;
+        errors on the parameters are not estimated and set to 0. Pixels which
+        were estimated before keep their estimate. """
 
-        for idx, graph in enumerate(graphs):
-            try:
-                numbering = self._numbering[idx]
-            except IndexError:
-                numbering = -1
-            graph.Fit(distribution, 'Q')
-            graph.GetFunction(distribution).SetLineColor(4)
-            self._fits.append(ToolboxFit(graph.GetFunction(distribution),
-                              numbering))
+        items = self._get_items(s_graphs)
+        missing = [(pixel, kind) for pixel, kind in items
+                   if ('moments', kind) not in self._pixels[pixel]['fits']]
 
-        # If there is only one fit, show stats
-        if len(graphs) == 1:
+        for pixel, kind in missing:
+            graph = self._get_graph(pixel, kind)
+            a_x, a_y = self._get_points(graph)
+            c, mu, sigma = self._get_moments_scurve(a_x, a_y)
+            chi2 = 0.
+            for x_n, y_n in zip(a_x, a_y):
+                chi2 += (y_n - c*1./2*(1+erf((x_n-mu)/(sqrt(2)*sigma))))**2
+
+            fit = ToolboxFit.from_values(pixel, c, 0., mu, 0., sigma, 0.,
+                                         chi2, max(len(a_x)-3, 0),
+                                         STATUS_ESTIMATED, 0)
+            self._attach_function(graph, 'erf', fit)
+            self._pixels[pixel]['fits'][('moments', kind)] = fit
+            INS.count('estimates')
+
+        self._fill_view_fits(items, 'moments', set(missing), 'erf')
+
+        # If there is only one estimate, show stats
+        if len(items) == 1:
             gStyle.SetOptFit(1111111)
         else:
             gStyle.SetOptFit(0000000)
 
+    def _fit_graph(self, graph, distribution, pixel):
+
+        """ Fit distribution over TGraph and return ToolboxFit. A fit fails if
+        it doesn't converge, has no accurate covariance matrix or parameters
+        which aren't finite. Failed fits of gaus and erf are retried with the
+        ladder in ATTEMPTS: with initial values from the moments of the
+        curve, within 3 sigma around its peak, and finally the initial values
+        are taken as estimate. """
+
+        if distribution == 'erf':
+            seeds = self._estimate_scurve(graph)
+        else:
+            # ROOT computes initial values of functions it knows itself
+            seeds = None
+        fit, good = self._try_fit(graph, distribution, pixel, seeds)
+        if good or distribution not in ['gaus', 'erf']:
+            return fit
+
+        a_x, a_y = self._get_points(graph)
+        moments = ToolboxArray().estimate_moments(
+            distribution, np.array([a_x]), np.array([a_y]))
+        window = ToolboxArray().get_window(np.array([a_x]), moments)[0]
+        for attempt in range(2, len(ATTEMPTS)):
+            LGR.warning('Fit of {0} to pixel {1} failed, retry with attempt '
+                        '{2} ({3}).'.format(distribution, pixel, attempt,
+                                            ATTEMPTS[attempt-1]))
+            INS.count('fit_retries')
+            if ATTEMPTS[attempt-1] == 'restricted':
+                fit, good = self._try_fit(graph, distribution, pixel,
+                                          moments[0], (a_x[window[0]],
+                                                       a_x[window[-1]]))
+            else:
+                fit, good = self._try_fit(graph, distribution, pixel,
+                                          moments[0])
+            if good:
+                fit.set_attempts(attempt)
+                return fit
+
+        # Initial values are kept as estimate
+        LGR.warning('All fits of {0} to pixel {1} failed, keep initial '
+                    'values.'.format(distribution, pixel))
+        INS.count('fit_fallbacks')
+        if seeds is None:
+            seeds = moments[0]
+        c, mu, sigma = [float(value) for value in seeds]
+        model = MODELS[distribution](np.array([a_x]),
+                                     np.array([[c, mu, sigma]]))[0][0]
+        chi2 = float(((np.array(a_y)-model)**2).sum())
+        fit = ToolboxFit.from_values(pixel, c, 0., mu, 0., sigma, 0., chi2,
+                                     max(len(a_x)-3, 0), STATUS_ESTIMATED, 0,
+                                     fit.get_edm(), len(ATTEMPTS))
+        graph.GetListOfFunctions().Delete()
+        self._attach_function(graph, distribution, fit)
+
+        return fit
+
+    def _try_fit(self, graph, distribution, pixel, seeds, window=None):
+
+        """ Fit distribution over TGraph, starting from seeds unless they are
+        None, and within window (x_lo, x_hi) unless it is None. Return
+        ToolboxFit and whether the fit is good. """
+
+        function = self._create_function(distribution, graph)
+        option = 'QS'
+        if seeds is not None:
+            function.SetParameters(*[float(value) for value in seeds])
+            # ROOT overwrites initial values of functions it knows without B
+            if distribution != 'erf':
+                option += 'B'
+        if window is not None:
+            function.SetRange(*window)
+            option += 'R'
+        result = graph.Fit(function, option)
+
+        fitted = graph.GetFunction(function.GetName())
+        if not fitted:
+            return ToolboxFit.from_values(pixel, 0., 0., 0., 0., 0., 0., 0.,
+                                          0, int(result), 0), False
+        fitted.SetLineColor(4)
+        fit = ToolboxFit(fitted, pixel, result)
+        values = fit.get_values()[1:8]
+
+        return fit, (fit.get_status() == 0 and fit.get_cov_status() == 3 and
+                     all(np.isfinite(values)))
+
+    def _fill_view_fits(self, items, key, fitted, distribution=None):
+
+        """ Append fits of (pixel, kind) items, stored under key, to fits of
+        view. Functions of fits which were made before are attached to the
+        TGraphs again, since they are removed when the view changes. """
+
+        for pixel, kind in items:
+            fit = self._pixels[pixel]['fits'][(key, kind)]
+            if (pixel, kind) not in fitted:
+                self._attach_function(self._get_graph(pixel, kind),
+                                      distribution or key, fit)
+                INS.count('fits_reused')
+            self._fits.append(*fit.get_values())
+
+    def _get_points(self, graph):
+
+        """ Return lists with x and y values of TGraph. """
+
+        n_points = graph.GetN()
+        buf_x = graph.GetX()
+        buf_y = graph.GetY()
+
+        return ([buf_x[point] for point in range(n_points)],
+                [buf_y[point] for point in range(n_points)])
+
+    def _estimate_scurve(self, graph):
+
+        """ Return initial values (c, mu, sigma) of ERF_FORMULA for S-curve.
+        c is the height of the plateau, mu the point where the S-curve crosses
+        50% of it and sigma half the distance between the 16% and 84%
+        crossings, which is one standard deviation for an error function. """
+
+        a_x, a_y = self._get_points(graph)
+        c = a_y[-1]-a_y[0]
+        if not c:
+            return c, a_x[len(a_x)//2], 1.
+
+        a_frac = [(y_n-a_y[0])/c for y_n in a_y]
+        mu = self._get_crossing(a_x, a_frac, 0.5)
+        sigma = (self._get_crossing(a_x, a_frac, 0.84) -
+                 self._get_crossing(a_x, a_frac, 0.16))/2.
+
+        return c, mu, max(sigma, 1e-3)
+
+    def _get_moments_scurve(self, a_x, a_y):
+
+        """ Return (c, mu, sigma) of S-curve from moments of its derivative,
+        which is a Gaussian for an error function. """
+
+        c = a_y[-1]-a_y[0]
+        if not c or len(a_x) < 2:
+            return c, a_x[len(a_x)//2], 1.
+
+        # Weight centers of segments with increase of S-curve in segment
+        weights = [(a_y[point+1]-a_y[point])/c for point in range(len(a_x)-1)]
+        centers = [(a_x[point+1]+a_x[point])/2. for point in range(len(a_x)-1)]
+        sum_w = sum(weights)
+        mu = sum(w*x_n for w, x_n in zip(weights, centers))/sum_w
+        var = sum(w*(x_n-mu)**2 for w, x_n in zip(weights, centers))/sum_w
+
+        return c, mu, max(sqrt(abs(var)), 1e-3)
+
+    def _get_crossing(self, a_x, a_frac, level):
+
+        """ Return x value where a_frac first reaches level, interpolated
+        linearly between neighbouring points. """
+
+        for point in range(1, len(a_x)):
+            if a_frac[point] >= level:
+                if a_frac[point] == a_frac[point-1]:
+                    return a_x[point]
+                return a_x[point-1] + (level-a_frac[point-1]) * \
+                    (a_x[point]-a_x[point-1])/(a_frac[point]-a_frac[point-1])
+
+        return a_x[-1]
+
     def set_title(self, title, s_graphs):
 
         """ Set title of TGraph. """
@@ -196,6 +568,8 @@ class ToolboxTGraph(object):
         graphs = self._get_graphs(s_graphs)
 
         # Only change first TGraph in list, since this one defines axes
+        self._titles.setdefault((id(graphs[0]), False),
+                                (graphs[0], graphs[0].GetTitle()))
         graphs[0].SetTitle(title)
 
     def set_axis_title(self, axis_x, s_graphs):
@@ -205,6 +579,8 @@ class ToolboxTGraph(object):
         graphs = self._get_graphs(s_graphs)
 
         # Only change first TGraph in list, since this one defines axes
+        self._titles.setdefault((id(graphs[0]), True),
+                                (graphs[0], graphs[0].GetXaxis().GetTitle()))
         graphs[0].GetXaxis().SetTitle(axis_x)
 
     def _add_legend(self):
@@ -215,72 +591,196 @@ class ToolboxTGraph(object):
 
     def _get_graphs(self, s_graphs):
 
-        """ Get list of TGraphs according to the values passed. """
+        """ Get list of TGraphs of view according to the values passed. """
+
+        return [self._get_graph(pixel, kind)
+                for pixel, kind in self._get_items(s_graphs)]
+
+    def _get_items(self, s_graphs):
+
+        """ Get list of (pixel, kind) of TGraphs of view according to the
+        values passed; S-curves are the integrated or, once the view is
+        normalized, the normalized ones. """
 
         check_if_object(s_graphs, list)
 
         # Find out what list of graphs are requested
-        graphs = []
+        items = []
         for s_graph in s_graphs:
             if s_graph == 'measurements':
-                graphs += self._measurements
-            if s_graph == 'scurves':
-                graphs += self._scurves
+                kind = 'measurements'
+            elif s_graph == 'scurves':
+                kind = 'scurve' if self._normalized else 'integral'
+            else:
+                continue
+            items += [(pixel, kind) for pixel in self._numbering
+                      if self._has(pixel, kind)]
 
         # If list is not empty, return list, otherwise throw error
-        if graphs:
-            return graphs
+        if items:
+            return items
         else:
             raise ValueError('Don\'t know what list of TGraphs to use.')
 
+    def _has(self, pixel, kind):
+
+        """ Return whether curve of kind is known for pixel. """
+
+        state = self._pixels.get(pixel)
+        return state is not None and \
+            (kind in state['graphs'] or kind in state['rows'])
+
+    def _get_graph(self, pixel, kind):
+
+        """ Get TGraph of kind for pixel; with the array backends, it is only
+        built here, when it is needed for the first time. """
+
+        state = self._pixels[pixel]
+        if kind not in state['graphs']:
+            a_x, a_y = state['rows'][kind]
+            state['graphs'][kind] = TGraph(len(a_x), array('d', a_x),
+                                           array('d', a_y))
+
+        return state['graphs'][kind]
+
+    def _get_rows(self, pixels, kind):
+
+        """ Get 2d (pixels x points) arrays of x and y values of curves of
+        kind for pixels. """
+
+        a_x = []
+        a_y = []
+        for pixel in pixels:
+            state = self._pixels[pixel]
+            if kind not in state['rows']:
+                graph = state['graphs'][kind]
+                n_points = graph.GetN()
+                state['rows'][kind] = (
+                    np.fromiter(graph.GetX(), dtype=float, count=n_points),
+                    np.fromiter(graph.GetY(), dtype=float, count=n_points))
+            a_x.append(state['rows'][kind][0])
+            a_y.append(state['rows'][kind][1])
+
+        return np.array(a_x), np.array(a_y)
+
+    def _set_rows(self, pixels, kind, a_y):
+
+        """ Set rows of S-curves of kind for pixels from 2d array; S-curves
+        are drawn against the point number. """
+
+        a_pts = np.arange(a_y.shape[1], dtype=float)
+        for pixel, row in zip(pixels, a_y):
+            self._pixels[pixel]['rows'][kind] = (a_pts, row)
+
+    def _get_array(self, pixels):
+
+        """ Get ToolboxArray filled with measurements of pixels. """
+
+        toolbox = ToolboxArray()
+        toolbox.fill_arrays(*self._get_rows(pixels, 'measurements'))
+        toolbox.fill_numbering(list(pixels))
+
+        return toolbox
+
+    def _get_groups(self, n_pixels):
+
+        """ Return groups of pixels sharing sigma in batch fits, or None if
+        every pixel has its own sigma. """
+
+        if not self.shared_sigma:
+            return None
+
+        return [0]*n_pixels
+
+    def _attach_function(self, graph, distribution, fit):
+
+        """ Attach function with parameters of fit to TGraph, so that it is
+        drawn like the result of TGraph::Fit(). """
+
+        function = self._create_function(distribution, graph)
+        function.SetParameters(fit.get_c(), fit.get_mu(), fit.get_sigma())
+        function.SetParError(0, fit.get_c_err())
+        function.SetParError(1, fit.get_mu_err())
+        function.SetParError(2, fit.get_sigma_err())
+        function.SetChisquare(fit.get_chi2())
+        function.SetNDF(fit.get_ndf())
+        function.SetLineColor(4)
+
+        # TGraph owns its list of functions
+        SetOwnership(function, False)
+        graph.GetListOfFunctions().Add(function)
+
+    def _create_function(self, distribution, graph):
+
+        """ Return TF1 of distribution over range of TGraph. """
+
+        x_lo = graph.GetX()[0]
+        x_hi = graph.GetX()[graph.GetN()-1]
+        if distribution == 'erf':
+            return TF1('scurve', ERF_FORMULA, x_lo, x_hi)
+
+        return TF1(distribution, distribution, x_lo, x_hi)
+
     def get_fits(self):
 
-        """ Get list with ToolboxFits. """
+        """ Get list with ToolboxFits, which are views on the rows of the
+        FitTable. """
 
-        return self._fits
+        return [ToolboxFit.view(self._fits, row)
+                for row in range(len(self._fits))]
 
-    def save(self, s_graphs):
+    def get_fit_table(self):
 
-        """ Save TGraph in TFile and as *.pdf. """
+        """ Get FitTable with values of all fits. """
 
-        graphs = self._get_graphs(s_graphs)
+        return self._fits
 
-        # Open TFile
-        rootfile = TFile(self.s_rootfile, 'UPDATE')
+    def fill_fits(self, fits):
 
-        # Go into directory if it is defined
-        if self.directory:
-            cwd = getcwd()
+        """ Fill FitTable with fits, given either as a FitTable or as a list
+        of ToolboxFits. """
 
-            # Change directory in rootfile
-            if not rootfile.GetDirectory(self.directory):
-                rootfile.mkdir(self.directory)
-            rootfile.cd(self.directory)
+        if isinstance(fits, FitTable):
+            self._fits.extend(fits.get_columns())
+            return
 
-            # Change directory on filesystem
-            if not path.exists(self.directory):
-                makedirs(self.directory)
-            chdir(self.directory)
+        check_if_object(fits, list)
+        for fit in fits:
+            check_if_object(fit, ToolboxFit)
+            self._fits.append(*fit.get_values())
 
-        self._canvas.SaveAs('{0}.pdf'.format(self.name))
-        for graph in graphs:
-            graph.Write()
+    @timed('ToolboxTGraph.save')
+    def save(self, s_graphs):
 
-        # Go back to original working directories
-        if self.directory:
-            rootfile.cd()
-            chdir(cwd)
+        """ Save TGraph in TFile and as *.pdf. """
+
+        graphs = self._get_graphs(s_graphs)
 
-        # Close TFile
-        rootfile.Close()
+        # Render plot through render queue of owner; without one, render it
+        # right away
+        filename = path.join(self.directory, '{0}.pdf'.format(self.name))
+        if self.renderer is not None:
+            self.renderer.add(self._get_canvas(), filename)
+        else:
+            save_pdf(self._get_canvas(), filename)
+
+        # Write TGraphs through output of owner; without one, open and close
+        # the ROOT file right away
+        if self.output is not None:
+            self.output.write(graphs, self.directory)
+        else:
+            output = RootOutput(self.s_rootfile)
+            output.write(graphs, self.directory)
+            output.close()
 
         self._clear()
 
     def reset(self):
 
-        """ Reset all TGraphs. """
+        """ Reset all TGraphs and everything computed from them. """
 
-        self._measurements = []
+        self._pixels = {}
         self._numbering = []
-        self._scurves = []
-        self._fits = []
+        self._normalized = False
+        self._fits = FitTable()
+        self._titles = {}
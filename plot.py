@@ -1,44 +1,211 @@
 #!/usr/bin/env python2
 
-""" Plot TGraphs from measurement before and after integrating. """
+""" Plot TGraphs from measurement before and after integrating, and make 2d
+maps of the fits. Calibration files are given as globs, or listed in a JSON
+manifest; MPA and stage of a file are taken from its name
+backup_<stage>Calibration__MPA<mpa>.root unless the manifest gives them.
+Without either, the files of MPAs 0 to 5 in ../MAPSA_Software/plots are
+processed. With --shard, every run writes a partial result, and --merge
+makes the combined maps from the partial results of all shards. """
 
-from SCurve import SCurve
-from ROOT import gROOT
+import re
+import glob
+import json
+import argparse
+from os import path
+from multiprocessing import cpu_count
+from Logger import LGR
+from Campaign import Campaign
+from Constants import STAGES, STEPS
+from RenderQueue import POLICIES
+
+# Name of calibration files, with the stage and the MPA
+INPUT_PATTERN = 'backup_{0}Calibration__MPA{1}.root'
+INPUT_REGEX = re.compile(r'backup_({0})Calibration__MPA(\d+)\.root$'
+                         .format('|'.join(STAGES)))
+
+
+def parse_input(path_file):
+
+    """ Return (MPA, index of stage) of calibration file path_file, taken
+    from its name. """
+
+    match = INPUT_REGEX.search(path_file)
+    if match is None:
+        raise ValueError('Can\'t tell MPA and stage from name of {0}, it '
+                         'needs to end in {1}.'
+                         .format(path_file, INPUT_PATTERN.format('<stage>',
+                                                                 '<mpa>')))
+
+    return int(match.group(2)), STAGES.index(match.group(1))
+
+
+def parse_stage(stage):
+
+    """ Return index of stage, given as name or index. """
+
+    if stage in STAGES:
+        return STAGES.index(stage)
+
+    try:
+        index = int(stage)
+    except (TypeError, ValueError):
+        index = None
+    if index not in range(0, len(STAGES)):
+        raise ValueError('Unknown stage {0}, use one of {1} or their index.'
+                         .format(stage, ', '.join(STAGES)))
+
+    return index
+
+
+def get_inputs(globs, manifest, directory, mpas):
+
+    """ Return list of (path, MPA, index of stage) of calibration files.
+    Files are given by globs, or by a JSON manifest with a list of objects
+    with keys path and optionally mpa and stage (name or index); without
+    either, the files of mpas in directory are used. """
+
+    inputs = []
+    if manifest:
+        with open(manifest) as f_in:
+            entries = json.load(f_in)
+        for entry in entries:
+            if 'mpa' in entry and 'stage' in entry:
+                mpa, stage = int(entry['mpa']), parse_stage(entry['stage'])
+            else:
+                mpa, stage = parse_input(entry['path'])
+            inputs.append((entry['path'], mpa, stage))
+
+    for pattern in globs:
+        paths = sorted(glob.glob(pattern))
+        if not paths:
+            LGR.warning('No calibration files match {0}.'.format(pattern))
+        inputs.extend((path_file,) + parse_input(path_file)
+                      for path_file in paths)
+
+    if not manifest and not globs:
+        inputs = [('{0}/{1}'.format(directory.rstrip('/'),
+                                    INPUT_PATTERN.format(prefix, mpa)),
+                   mpa, idx)
+                  for mpa in mpas for idx, prefix in enumerate(STAGES)]
+
+    return inputs
+
+
+def report_plan(campaign):
+
+    """ Log the jobs which would be processed, without processing them. """
+
+    jobs = campaign.get_jobs()
+    LGR.info('Dry run: {0} jobs, steps {1}.'
+             .format(len(jobs), ', '.join(campaign.get_steps())))
+    for job in jobs:
+        LGR.info('MPA {0} {1}: {2}{3} -> {4}'
+                 .format(job['mpa'], STAGES[job['stage']], job['path'],
+                         '' if path.isfile(job['path']) else ' (missing)',
+                         job['directory']))
+
+
+def _parse_shard(shard):
+
+    """ Parse shard given as INDEX/COUNT. """
+
+    try:
+        index, count = [int(value) for value in shard.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('Shard {0} is not of the form '
+                                         'INDEX/COUNT.'.format(shard))
+
+    return index, count
 
-gROOT.SetBatch(True)
 
 if __name__ == '__main__':
 
+    PARSER = argparse.ArgumentParser(description=__doc__)
+    PARSER.add_argument('inputs', nargs='*',
+                        help='globs of calibration files')
+    PARSER.add_argument('--manifest', default='',
+                        help='JSON file listing calibration files')
+    PARSER.add_argument('--path', default='../MAPSA_Software/plots',
+                        help='directory of calibration files if neither '
+                        'inputs nor manifest are given')
+    PARSER.add_argument('--mpas', nargs='*', type=int, default=range(0, 6),
+                        help='MPAs in path if neither inputs nor manifest '
+                        'are given')
+    PARSER.add_argument('--output', default='output28_test',
+                        help='directory for plots and ROOT file')
+    PARSER.add_argument('--pixels', type=int, default=None,
+                        help='number of pixels processed all together; all '
+                        'pixels of the geometry by default')
+    PARSER.add_argument('--pixels-single', nargs='*', type=int,
+                        default=range(0, 6),
+                        help='pixels processed individually')
+    PARSER.add_argument('--steps', nargs='+', choices=STEPS, default=STEPS,
+                        help='steps which are run')
+    PARSER.add_argument('--backend', default='root',
+                        choices=['root', 'array', 'batch'],
+                        help='backend of SCurve')
+    PARSER.add_argument('--shared-sigma', action='store_true',
+                        help='share sigma of all pixels of an MPA in batch '
+                        'fits')
+    PARSER.add_argument('--numeric', action='store_true',
+                        help='only fit, without plots and ROOT output')
+    PARSER.add_argument('--render-policy', default='all', choices=POLICIES,
+                        help='which plots are rendered')
+    PARSER.add_argument('--workers', type=int, default=cpu_count(),
+                        help='number of worker processes')
+    PARSER.add_argument('--fit-cache', default='',
+                        help='persistent fit cache')
+    PARSER.add_argument('--geometry', default='',
+                        help='JSON file with geometry of assembly')
+    PARSER.add_argument('--stats', default='',
+                        help='JSON file with statistics of run')
+    PARSER.add_argument('--shard', type=_parse_shard, default=(0, 1),
+                        help='only process shard INDEX/COUNT of the jobs, '
+                        'counting from 0')
+    PARSER.add_argument('--merge', nargs='+', default=[],
+                        help='globs of partial results of shards to merge, '
+                        'instead of processing calibration files')
+    PARSER.add_argument('--dry-run', action='store_true',
+                        help='only report the jobs which would be processed')
+    ARGS = PARSER.parse_args()
+
+    CAMPAIGN = Campaign(ARGS.output)
+    try:
+        CAMPAIGN.set_workers(ARGS.workers)
+        CAMPAIGN.set_shard(*ARGS.shard)
+        CAMPAIGN.set_steps(ARGS.steps)
+        INPUTS = get_inputs(ARGS.inputs, ARGS.manifest, ARGS.path, ARGS.mpas)
+
+        # All individual pixels, and all pixels together
+        CAMPAIGN.set_pixels(ARGS.pixels_single, None if ARGS.pixels is None
+                            else range(0, ARGS.pixels))
+        CAMPAIGN.set_backend(ARGS.backend)
+        CAMPAIGN.set_shared_sigma(ARGS.shared_sigma)
+        CAMPAIGN.set_numeric(ARGS.numeric)
+        CAMPAIGN.set_render_policy(ARGS.render_policy)
+        CAMPAIGN.set_fit_cache(ARGS.fit_cache)
+        CAMPAIGN.set_geometry_file(ARGS.geometry)
+        CAMPAIGN.set_stats(ARGS.stats)
+        for PATH_FILE, MPA, STAGE in INPUTS:
+            CAMPAIGN.add_job(PATH_FILE, MPA, STAGE)
+    except (ValueError, IOError) as exc:
+        PARSER.error(exc)
 
-    for mpa in range(0, 6):
-        for idx, prefix in enumerate(['pre', 'post']):
-
-            print 'Processing MPA {0} {1}'.format(mpa, prefix)
-
-            path = '../MAPSA_Software/plots'
-            scurve = SCurve('{}/backup_{}Calibration__MPA{}.root'
-                            .format(path, prefix, mpa))
-            output = 'output28_test'
-            name = '{}_{}'.format(mpa, prefix)
-
-            scurve.set_directory('{0}/{1}'.format(output, name))
-            scurve.set_rootfile('{0}/out.root'.format(output, name))
-
-            pixels = 48
-            # All individual pixels
-            for pixel in range(0, 6):
-                scurve.set_graphs([pixel])
-                scurve.retrieve_graphs()
-                scurve.make_s_curve()
-                scurve.fit_gaussian()
-
-            # All pixels together
-            #l = range(1, 15)
-            #l.extend(range(17, 31))
-            #l.extend(range(33, 47))
-            l = range(0, pixels)
-            scurve.set_graphs(l)
-            scurve.retrieve_graphs()
-            scurve.make_s_curve()
-            scurve.fit_gaussian()
-            scurve.make_maps(mpa, idx)
+    if ARGS.merge:
+        PARTIALS = sorted(set(PARTIAL for PATTERN in ARGS.merge
+                              for PARTIAL in glob.glob(PATTERN)))
+        if ARGS.dry_run:
+            LGR.info('Dry run: merge {0} partial results: {1}'
+                     .format(len(PARTIALS), ', '.join(PARTIALS)))
+        else:
+            CAMPAIGN.merge(PARTIALS)
+    elif ARGS.dry_run:
+        report_plan(CAMPAIGN)
+    elif not CAMPAIGN.get_jobs():
+        LGR.warning('Shard {0}/{1} has no jobs.'.format(*ARGS.shard))
+        # Merging needs the partial result of every shard, even if it's empty
+        if ARGS.shard[1] > 1:
+            CAMPAIGN.run()
+    else:
+        CAMPAIGN.run()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python2
+
+""" Tests of FitExport, which has to read back exactly the fits of the
+selected MPAs, stages and runs. Run with python -m unittest discover -p
+'test_*.py'. The tests need pyarrow and are skipped without it. """
+
+import shutil
+import tempfile
+import unittest
+from FitTable import FitTable
+from FitExport import FitExport
+
+try:
+    import pyarrow  # pylint: disable=import-error,unused-import
+except ImportError:
+    pyarrow = None
+
+
+def make_table(n_fits, mu):
+
+    """ Return FitTable with n_fits fits, numbered from 0, with mean mu. """
+
+    table = FitTable()
+    for pixel in range(n_fits):
+        table.append(pixel, 1., 0.1, mu, 0.2, 3., 0.3, 10., 97)
+
+    return table
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+class TestFitExport(unittest.TestCase):
+
+    """ Write fits of several runs and read selections back. """
+
+    def setUp(self):
+
+        """ Write fits of two runs of two MPAs into a new dataset. """
+
+        self.directory = tempfile.mkdtemp()
+        self.export = FitExport(self.directory)
+        for run, mu in [('run1', 40.), ('run2', 60.)]:
+            for mpa in [0, 1]:
+                self.export.write(make_table(4, mu), mpa, 'pre', run,
+                                  'backup_preCalibration__MPA{0}.root'
+                                  .format(mpa))
+
+    def tearDown(self):
+
+        """ Remove dataset. """
+
+        shutil.rmtree(self.directory)
+
+    def test_run(self):
+
+        """ Only fits of the selected run are read. """
+
+        data = self.export.read(run='run2')
+
+        self.assertEqual(len(data['pixel']), 8)
+        self.assertEqual(set(data['run']), set(['run2']))
+        self.assertEqual(set(data['mu']), set([60.]))
+
+    def test_run_and_mpa(self):
+
+        """ Selections on partitions and runs are combined. """
+
+        data = self.export.read(mpa=1, stage=0, run=['run1'])
+
+        self.assertEqual(len(data['pixel']), 4)
+        self.assertEqual(set(data['mpa']), set([1]))
+        self.assertEqual(set(data['mu']), set([40.]))
+
+    def test_all(self):
+
+        """ Without selection, fits of all runs are read. """
+
+        data = self.export.read()
+
+        self.assertEqual(len(data['pixel']), 16)
+        self.assertEqual(sorted(set(data['run'])), ['run1', 'run2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
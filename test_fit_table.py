@@ -0,0 +1,80 @@
+#!/usr/bin/env python2
+
+""" Tests of FitTable, whose NumPy views have to stay valid while fits are
+appended. Run with python -m unittest discover -p 'test_*.py'. """
+
+import unittest
+from FitTable import FitTable, COLUMNS, DEFAULTS
+
+
+def make_table(n_fits, const=1.):
+
+    """ Return FitTable with n_fits fits, numbered from 0, with constant
+    const. """
+
+    table = FitTable()
+    for pixel in range(n_fits):
+        table.append(pixel, const, 0.1, 40., 0.2, 3., 0.3, 10., 97)
+
+    return table
+
+
+class TestFitTable(unittest.TestCase):
+
+    """ Append, extend and export fits. """
+
+    def test_views_survive_growth(self):
+
+        """ Arrays returned by to_numpy() keep their values once the table
+        grows. """
+
+        table = make_table(3)
+        columns = table.to_numpy()
+        for pixel in range(1000):
+            table.append(pixel, 7., 0., 0., 0., 0., 0., 0., 0)
+
+        self.assertEqual(list(columns['c']), [1.]*3)
+        self.assertEqual(list(columns['numbering']), [0., 1., 2.])
+        self.assertEqual(len(table), 1003)
+        self.assertEqual(table.get_value('c', 2), 1.)
+        self.assertEqual(table.get_value('c', 1002), 7.)
+
+    def test_extend_defaults(self):
+
+        """ Columns in DEFAULTS may be missing when extending. """
+
+        columns = dict((col, values) for col, values in
+                       make_table(4).to_numpy().items()
+                       if col not in DEFAULTS)
+        table = make_table(2)
+        table.extend(columns)
+
+        self.assertEqual(len(table), 6)
+        for col, value in DEFAULTS.items():
+            self.assertEqual(list(table.get_column(col)), [value]*6)
+
+    def test_select(self):
+
+        """ Rows are selected by number or by mask. """
+
+        table = make_table(5)
+        mask = table.to_numpy()['numbering'] >= 3
+
+        self.assertEqual(list(table.select(mask).get_column('numbering')),
+                         [3., 4.])
+        self.assertEqual(list(table.select([0, 4]).get_column('numbering')),
+                         [0., 4.])
+        self.assertEqual(len(table.select([])), 0)
+
+    def test_out_of_range(self):
+
+        """ Rows beyond the fits raise IndexError, even if the arrays have
+        room for them. """
+
+        table = make_table(3)
+        self.assertRaises(IndexError, table.get_value, 'c', 3)
+        self.assertEqual(sorted(table.to_numpy()), sorted(COLUMNS))
+
+
+if __name__ == '__main__':
+    unittest.main()
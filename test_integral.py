@@ -0,0 +1,133 @@
+#!/usr/bin/env python2
+
+""" Regression tests of the cumulative integral of TGraphs, which has to give
+the same values as integrating every range from the first point on its own.
+Run with python -m unittest discover -p 'test_*.py'. The comparison with
+ToolboxTGraph._integral() needs ROOT and is skipped without it. """
+
+import random
+import unittest
+from array import array
+from ToolboxHelper import cumulative_integral
+
+try:
+    import ROOT  # pylint: disable=import-error
+except ImportError:
+    ROOT = None
+
+
+class StubGraph(object):
+
+    """ Stand-in for TGraph, with the methods cumulative_integral() needs. """
+
+    def __init__(self, a_x, a_y):
+
+        """ Initialize object variables. """
+
+        self._x = array('d', a_x)
+        self._y = array('d', a_y)
+
+    def GetN(self):  # pylint: disable=invalid-name
+
+        """ Return number of points. """
+
+        return len(self._x)
+
+    def GetX(self):  # pylint: disable=invalid-name
+
+        """ Return x values. """
+
+        return self._x
+
+    def GetY(self):  # pylint: disable=invalid-name
+
+        """ Return y values. """
+
+        return self._y
+
+
+def get_points(n_points, uniform, seed=0):
+
+    """ Return lists of x and y values of random points; x values are evenly
+    spaced if uniform, otherwise they grow by random steps. """
+
+    rng = random.Random(seed)
+    if uniform:
+        a_x = [float(point) for point in range(n_points)]
+    else:
+        a_x = [0.]
+        for _ in range(n_points-1):
+            a_x.append(a_x[-1]+rng.uniform(0.01, 5.))
+
+    return a_x, [rng.uniform(0., 1000.) for _ in range(n_points)]
+
+
+def integral(a_x, a_y, x_lo, x_hi):
+
+    """ Return integral of points from x_lo to x_hi, summed like
+    ToolboxTGraph._integral(). """
+
+    result = 0.
+    for point in range(x_lo, min(x_hi, len(a_x)-1)):
+        result += 1./2*(a_y[point+1]+a_y[point])*(a_x[point+1]-a_x[point])
+
+    return result
+
+
+class TestCumulativeIntegral(unittest.TestCase):
+
+    """ Compare cumulative integral with integrals of single ranges. """
+
+    def test_uniform(self):
+
+        """ Evenly spaced points. """
+
+        self._check_stub(*get_points(256, True))
+
+    def test_non_uniform(self):
+
+        """ Unevenly spaced points. """
+
+        for seed in range(5):
+            self._check_stub(*get_points(100, False, seed))
+
+    def test_short(self):
+
+        """ Graphs without points or with a single point. """
+
+        self.assertEqual(list(cumulative_integral(StubGraph([], []))), [])
+        self.assertEqual(list(cumulative_integral(StubGraph([1.], [2.]))),
+                         [0.])
+
+    @unittest.skipIf(ROOT is None, 'ROOT is not installed')
+    def test_root(self):
+
+        """ ToolboxTGraph._cumulative_integral() against _integral() on
+        TGraphs. """
+
+        from ToolboxTGraph import ToolboxTGraph
+
+        toolbox = ToolboxTGraph()
+        for uniform in [True, False]:
+            a_x, a_y = get_points(100, uniform)
+            graph = ROOT.TGraph(len(a_x), array('d', a_x), array('d', a_y))
+            a_int = toolbox._cumulative_integral(  # pylint: disable=W0212
+                graph)
+            for point in range(len(a_x)):
+                self.assertEqual(
+                    a_int[point],
+                    toolbox._integral(graph, 0,  # pylint: disable=W0212
+                                      point))
+
+    def _check_stub(self, a_x, a_y):
+
+        """ Check cumulative integral of stub graph for every point. """
+
+        a_int = cumulative_integral(StubGraph(a_x, a_y))
+        self.assertEqual(len(a_int), len(a_x))
+        for point in range(len(a_x)):
+            self.assertEqual(a_int[point], integral(a_x, a_y, 0, point))
+
+
+if __name__ == '__main__':
+    unittest.main()